@@ -3,14 +3,19 @@
 多智能体系统
 """
 
-import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
 from models import StoryData, StoryInput, StorySegment
 from config import COMIC_STYLES, VOLC_CONFIG, AGENT_CONFIG, VIDEO_CONFIG
 
-from utils import call_volc_api, plan_segment_durations
+from utils import (call_volc_api, estimate_tokens, log_token_usage, lookup_duration_plan, parse_llm_json,
+                   snap_to_allowed_duration, StoryboardCache, get_plan_format)
 
 import textwrap
 
+FILLER_TRANSITION_REASON = "补充分镜"
+
 class BaseAgent:
     """智能体基类"""
     def __init__(self, config):
@@ -24,37 +29,165 @@ class ScriptDoctorAgent(BaseAgent):
     """剧本医生智能体 - 将用户粗糙提示词扩写为可执行分镜脚本"""
 
     def enhance_story_prompts(self, story_input: StoryInput):
-        """增强版故事提示词生成（约30秒成片，单镜≥4秒，仅4/5秒混合）"""
-        self.log("开始增强故事剧本生成...")
-
-        style_key = getattr(story_input, "style", "cinematic") or "cinematic"
-        rhythm_style = getattr(story_input, "rhythm_style", "manju") or "manju"
+        """增强版故事提示词生成（约30秒成片，单镜时长取自 segment_duration_options）"""
+        return self.generate_storyboard_candidates(story_input, 1)[0]
+
+    def generate_storyboard_candidates(self, story_input: StoryInput, count=1):
+        """并发请求 count 份分镜脚本（每个请求独立采样），返回解析成功的候选；全部失败时返回备用故事"""
+        self.log("开始增强故事剧本生成..." if count <= 1 else f"并发生成 {count} 份候选分镜剧本...")
+        self.last_storyboard_source = "chat"
+        request = self._build_story_request(story_input)
+
+        # 相似剧本缓存（需显式开启）：同一提示词且规划一致时直接复用，相似提示词作为参考示例注入提示词
+        cached = self._lookup_storyboard_cache(story_input, request)
+        if cached is not None:
+            score, raw, reusable = cached
+            if reusable:
+                self.log("♻️ 复用同一提示词的历史剧本，跳过对话请求")
+                self.last_storyboard_source = "cache"
+                return [self._story_from_raw(raw, request)]
+            self.log(f"🌱 以相似剧本为参考（相似度 {score:.2f}）")
+            request = self._build_story_request(story_input, seed_storyboard=(score, raw))
+
+        def _one(index):
+            try:
+                result = call_volc_api(request["payload"], "chat")
+                log_token_usage("分镜剧本" + (f"候选{index + 1}" if count > 1 else ""),
+                                request["token_estimate"]["prompt"], request["token_estimate"]["completion"],
+                                request["payload"]["max_tokens"], result)
+                content = result["choices"][0]["message"]["content"].strip()
+                raw = self._parse_story_response(content)
+                if raw is None:
+                    self.log("JSON解析失败" + (f"（候选 {index + 1}）" if count > 1 else ""))
+                    return None
+                raw = self._continue_missing_segments(raw, content, request)
+                return self._story_from_raw(raw, request)
+            except Exception as e:
+                self.log(f"剧本生成失败: {e}")
+                return None
+
+        if count <= 1:
+            stories = [_one(0)]
+        else:
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                stories = list(executor.map(_one, range(count)))
+
+        stories = [s for s in stories if s is not None]
+        if stories:
+            self.log("分镜剧本生成完成！" if count <= 1 else f"分镜剧本生成完成：{len(stories)}/{count} 份有效")
+            return stories
+
+        self.log("使用备用方案")
+        self.last_storyboard_source = "fallback"
+        return [self._create_fallback_story(
+            story_input,
+            style_key=request["style_key"],
+            style_config=request["style_config"],
+            desired_count=request["segment_count"],
+            durations=request["planned_durations"],
+            allowed_durations=request["allowed_durations"],
+            min_duration_sec=request["min_duration"],
+        )]
+
+    @staticmethod
+    def _story_prompt_text(story_input):
+        """用户剧本文本（提示词正文，也是相似剧本缓存的检索键）"""
         user_script_prompt = getattr(story_input, "script_prompt", None)
-
+        if user_script_prompt:
+            return user_script_prompt.strip()
         theme = getattr(story_input, "theme", "")
         summary = getattr(story_input, "summary", "")
         characters = getattr(story_input, "characters", "") or ""
+        return f"主题：{theme}\n梗概：{summary}\n角色：{characters}".strip()
+
+    def _lookup_storyboard_cache(self, story_input, request):
+        """查相似剧本缓存，返回 (相似度, 原始分镜, 可否直接复用)；未开启/未命中/缺 NumPy 时返回 None
+
+        只有归一化后与历史提示词完全相同（且规划一致）才可直接复用：模板相同、人名不同的提示词相似度也很高，
+        复用会把上一次的角色名带进标题和画面提示词，这类命中只作为参考示例。
+        """
+        cfg = AGENT_CONFIG["script_doctor"]
+        mode = cfg.get("storyboard_cache")
+        if mode not in ("seed", "reuse"):
+            return None
+        try:
+            start = time.time()
+            cache = StoryboardCache.get()
+            prompt_text = self._story_prompt_text(story_input)
+            # 同一提示词可能以不同风格/规划入库多次，多取几条以便找到规划一致的那条
+            hits = cache.query(prompt_text, top_k=5)
+            self.log(f"相似剧本检索: {len(cache.entries)} 条历史，耗时 {(time.time() - start) * 1000:.1f}ms")
+        except ImportError as e:
+            self.log(f"相似剧本缓存不可用（缺少依赖: {e}）")
+            return None
+        if not hits:
+            return None
+        score, entry = hits[0]
+        reusable = False
+        if mode == "reuse":
+            key, meta = cache.text_key(prompt_text), self._storyboard_cache_meta(request)
+            exact = next(((s, e) for s, e in hits if e.get("text_key") == key and e.get("meta") == meta), None)
+            if exact is not None:
+                (score, entry), reusable = exact, True
+        if not reusable and score < float(cfg.get("storyboard_seed_threshold", 0.5)):
+            return None
+        try:
+            raw = cache.load_storyboard(entry)
+        except Exception as e:
+            self.log(f"相似剧本读取失败: {e}")
+            return None
+        return score, raw, reusable
+
+    @staticmethod
+    def _storyboard_cache_meta(request):
+        """复用条件：风格、节奏与逐镜时长规划都一致"""
+        return {"style_key": request["style_key"], "rhythm_style": request["rhythm_style"],
+                "planned_durations": list(request["planned_durations"])}
+
+    def remember_storyboard(self, story_input, story_data):
+        """把对话生成（非缓存复用/备用）的分镜登记进相似剧本缓存；在用户确认剧本后调用，被否决的剧本不入库"""
+        if AGENT_CONFIG["script_doctor"].get("storyboard_cache") not in ("seed", "reuse"):
+            return
+        if getattr(self, "last_storyboard_source", None) != "chat":
+            return
+        try:
+            request = self._build_story_request(story_input)
+            StoryboardCache.get().add(self._story_prompt_text(story_input), asdict(story_data),
+                                      self._storyboard_cache_meta(request))
+        except Exception as e:
+            self.log(f"相似剧本缓存写入失败: {e}")
+
+    def _build_story_request(self, story_input: StoryInput, seed_storyboard=None):
+        """组装分镜剧本请求：返回 payload 及解析/兜底所需的规划信息
+
+        seed_storyboard: (相似度, 原始分镜) 时把相似历史剧本的分镜梗概作为参考段落注入（预算紧张时可裁）
+        """
+        style_key = getattr(story_input, "style", "cinematic") or "cinematic"
+        rhythm_style = getattr(story_input, "rhythm_style", "manju") or "manju"
 
         style_config = COMIC_STYLES.get(style_key, COMIC_STYLES["cinematic"])
 
         prefer_more_cuts = (rhythm_style != "movie")
-        segment_count, planned_durations, total_duration = plan_segment_durations(
-            target_total_sec=VIDEO_CONFIG.get("target_total_duration", 30),
-            tolerance_sec=VIDEO_CONFIG.get("target_total_tolerance", 2),
-            allowed_durations=VIDEO_CONFIG.get("segment_duration_options", [4, 5]),
-            min_duration_sec=VIDEO_CONFIG.get("segment_duration_min", 4),
-            max_segments=VIDEO_CONFIG.get("max_segments", VIDEO_CONFIG.get("video_count", 10)),
+        # 按所选规格（默认 VIDEO_CONFIG 的单片规格）查预计算的规划表（O(1)），未收录的组合现场规划
+        plan_format = get_plan_format(getattr(story_input, "plan_format", None))
+        segment_count, planned_durations, total_duration = lookup_duration_plan(
+            target_total_sec=plan_format["target"],
+            tolerance_sec=plan_format["tolerance"],
+            allowed_durations=plan_format["allowed"],
+            min_duration_sec=plan_format["min_duration"],
+            max_segments=plan_format["max_segments"],
             prefer_more_cuts=prefer_more_cuts,
+            min_segments=plan_format["min_segments"],
         )
+        allowed_text = "或".join(str(d) for d in sorted(set(planned_durations)))
+        min_duration = plan_format["min_duration"]
 
 
-        base_story = user_script_prompt.strip() if user_script_prompt else (
-            f"主题：{theme}\n梗概：{summary}\n角色：{characters}".strip()
-        )
+        base_story = self._story_prompt_text(story_input)
 
         rhythm_guide = (
             "【节奏风格：漫剧】\n"
-            "- 高密度信息：每镜必须有明确动作/表情/关系变化（时长4-5秒）\n"
+            f"- 高密度信息：每镜必须有明确动作/表情/关系变化（时长{min(planned_durations)}-{max(planned_durations)}秒）\n"
             "- 分镜感强：多用特写/中景切换，夸张表情与肢体语言\n"
             "- 镜头语言：快速推进、明确运镜（推拉摇移）但不过度晃动\n"
             "- 转场：剧情需要连续时才用 tailframe_continue，其余 hard_cut\n"
@@ -73,29 +206,33 @@ class ScriptDoctorAgent(BaseAgent):
             "1) 画面中绝对不出现任何文字：字幕/对白框/拟声词/LOGO/水印/UI/招牌/书页文字/屏幕文字等一律禁止\n"
             "2) 仅输出画面描述，不要输出任何解释文字；最终只返回严格JSON\n"
             f"3) 本次分镜数量为{segment_count}镜，总时长约{total_duration}秒（允许合理浮动）\n"
-            f"4) 每镜 duration_sec 必须严格等于该镜规划时长：{planned_durations}（只能是4或5，且不得低于4）\n"
+            f"4) 每镜 duration_sec 必须严格等于该镜规划时长：{planned_durations}（只能是{allowed_text}，且不得低于{min_duration}）\n"
             f"5) 风格字段 style_used 必须返回视觉风格 key：\"{style_key}\"（不要返回中文名）\n"
             "6) transition_strategy 只能是：\"tailframe_continue\" 或 \"hard_cut\"\n"
+            "7) characters/location 填本镜出场角色与场景地点，同一角色/地点在各镜必须使用完全相同的称呼（无角色填 []）\n"
         )
 
 
-        enhanced_prompt = f"""你是一个专业的短视频分镜编剧。请基于用户提供的粗糙剧本，生成一条总时长约{total_duration}秒的短视频分镜脚本，按{segment_count}个分镜输出（每镜时长见下方规划）。
-
-【用户粗糙剧本】
-{base_story}
-
-{rhythm_guide}
-
-【视觉风格参考】
-- 视觉风格提示词（仅供参考）：{style_config['prompt']}
-
-{strict_no_text_rules}
-
-【本次时长规划】
-- 分镜数量: {segment_count}
-- 每镜 duration_sec 依次为: {planned_durations}
+        # 提示词按段组装：(内容, 裁剪优先级)，None 为必留；token 预算紧张时按优先级从小到大裁掉可选段
+        sections = [
+            (f"你是一个专业的短视频分镜编剧。请基于用户提供的粗糙剧本，生成一条总时长约{total_duration}秒的短视频分镜脚本，"
+             f"按{segment_count}个分镜输出（每镜时长见下方规划）。", None),
+            f"【用户粗糙剧本】\n{base_story}",
+            (rhythm_guide, 3),
+            (f"【视觉风格参考】\n- 视觉风格提示词（仅供参考）：{style_config['prompt']}", 2),
+            strict_no_text_rules,
+            (f"【本次时长规划】\n- 分镜数量: {segment_count}\n- 每镜 duration_sec 依次为: {planned_durations}", 1),
+        ]
+        if seed_storyboard:
+            score, seed = seed_storyboard
+            outline = "\n".join(
+                f"- 第{i}镜《{seg.get('title', '')}》：{str(seg.get('video_prompt', ''))[:60]}"
+                for i, seg in enumerate(seed.get("segments", [])[:segment_count], 1) if isinstance(seg, dict)
+            )
+            sections.append((f"【相似剧本参考（相似度 {score:.2f}，仅参考结构与节奏，人物情节按本次剧本改写，不要照抄）】\n"
+                             f"《{seed.get('overall_title', '')}》\n{outline}", 1))
 
-请严格按以下JSON格式输出（不要包含任何无关文本，不要用Markdown）：
+        json_format = f"""请严格按以下JSON格式输出（不要包含任何无关文本，不要用Markdown）：
 {{
   "overall_title": "[系列标题]",
   "plot_twist": "[最后的反转/爆点]",
@@ -108,67 +245,259 @@ class ScriptDoctorAgent(BaseAgent):
       "video_prompt": "[用于视频生成的动作与运镜描述（动作、表情、景别、运镜、氛围），无字，无配音要求；时长应与 duration_sec 对应]",
       "style_used": "{style_key}",
       "aspect_ratio": "9:16",
+      "characters": ["[本镜出场角色名]"],
+      "location": "[本镜场景地点]",
       "duration_sec": {planned_durations[0]},
       "transition_strategy": "hard_cut",
       "transition_reason": "[为何用该转场（可简短）]"
     }}
   ]
-}}
-
-注意：
+}}"""
+        notes = f"""注意：
 - segments 数组必须恰好包含 {segment_count} 个元素（segment_number 依次为 1..{segment_count}）
-- 第 i 镜的 duration_sec 必须严格等于上方规划的第 i 个数字（只能4或5，且不得低于4）
+- 第 i 镜的 duration_sec 必须严格等于上方规划的第 i 个数字（只能是{allowed_text}，且不得低于{min_duration}）
 - 你可以让某些镜头使用 transition_strategy=tailframe_continue 以便剧情连续（例如同场景连续动作/追随镜头）
 - 每个分镜的 visual_prompt/video_prompt 都必须再次强调“无文字纯画面”
 """
-
+        sections += [json_format, (notes, 0)]
+        enhanced_prompt, max_tokens, token_estimate = self._fit_token_budget(sections, segment_count)
 
         payload = {
             "model": VOLC_CONFIG["chat_model"],
             "messages": [{"role": "user", "content": enhanced_prompt}],
             "temperature": AGENT_CONFIG["script_doctor"]["temperature"],
-            "max_tokens": AGENT_CONFIG["script_doctor"]["max_tokens"],
+            "max_tokens": max_tokens,
         }
 
+        return {
+            "payload": payload,
+            "token_estimate": token_estimate,
+            "rhythm_style": rhythm_style,
+            "style_key": style_key,
+            "style_config": style_config,
+            "segment_count": segment_count,
+            "planned_durations": planned_durations,
+            "allowed_durations": list(plan_format["allowed"]),
+            "min_duration": min_duration,
+        }
+
+    @staticmethod
+    def _estimate_output_tokens(segment_count):
+        """预估输出 token：每镜 JSON 约 output_tokens_per_segment，加顶层字段开销与安全余量"""
+        cfg = AGENT_CONFIG["script_doctor"]
+        per_segment = int(cfg.get("output_tokens_per_segment", 280))
+        return int((80 + per_segment * max(1, segment_count)) * float(cfg.get("output_token_margin", 1.25)))
+
+    def _fit_token_budget(self, sections, segment_count):
+        """按预估输出量设定 max_tokens；提示词超出 prompt_token_budget，或输入+max_tokens 超出 context_window 时，
+        按优先级裁掉冗余提示段（输出量随镜头数增长，不挤占提示词预算）。
+
+        sections 元素为字符串（必留）或 (内容, 优先级)，优先级 None 必留、数值小的先裁。
+        返回 (prompt, max_tokens, {"prompt": 预估输入, "completion": 预估输出})。
+        """
+        cfg = AGENT_CONFIG["script_doctor"]
+        items = [sec if isinstance(sec, tuple) else (sec, None) for sec in sections]
+        predicted_output = self._estimate_output_tokens(segment_count)
+        if not cfg.get("adaptive_max_tokens", True):
+            prompt = "\n\n".join(text for text, _ in items)
+            return prompt, cfg["max_tokens"], {"prompt": estimate_tokens(prompt), "completion": predicted_output}
+
+        max_tokens = max(512, min(int(cfg.get("max_tokens_limit", 16384)), predicted_output))
+        budget = min(int(cfg.get("prompt_token_budget", 4000)), int(cfg.get("context_window", 32768)) - max_tokens)
+        costs = [estimate_tokens(text) for text, _ in items]
+        dropped = set()
+        for i in sorted((i for i, (_, rank) in enumerate(items) if rank is not None), key=lambda i: items[i][1]):
+            if sum(c for j, c in enumerate(costs) if j not in dropped) <= budget:
+                break
+            dropped.add(i)
+        prompt = "\n\n".join(text for i, (text, _) in enumerate(items) if i not in dropped)
+        predicted_prompt = estimate_tokens(prompt)
+        if dropped:
+            self.log(f"token 预算紧张（{budget}），裁掉 {len(dropped)} 段冗余提示（约 {sum(costs[i] for i in dropped)} token）")
+        if predicted_output > max_tokens:
+            self.log(f"⚠️ 预估输出 {predicted_output} token 超过上限 {max_tokens}，缺失分镜将续写补齐")
+        return prompt, max_tokens, {"prompt": predicted_prompt, "completion": predicted_output}
+
+    def _parse_story_response(self, content):
+        """容错解析模型返回的分镜 JSON（围栏/尾随文本/多余逗号/截断），记录修复项；无法恢复时返回 None"""
+        raw, repairs = parse_llm_json(content, list_key="segments")
+        if repairs:
+            self.log(f"JSON 已容错修复: {'; '.join(repairs)}")
+        if not isinstance(raw, dict):
+            return None
+        if not isinstance(raw.get("segments"), list):
+            raw["segments"] = []
+        return raw
+
+    @staticmethod
+    def _is_complete_segment(seg):
+        return isinstance(seg, dict) and bool(seg.get("visual_prompt")) and bool(seg.get("video_prompt"))
+
+    def _continue_missing_segments(self, raw, content, request):
+        """有效分镜不足规划数量时（多为 max_tokens 截断），追加一次续写请求只补缺失的分镜"""
+        segment_count = request["segment_count"]
+        complete = [seg for seg in raw["segments"] if self._is_complete_segment(seg)]
+        have = {seg.get("segment_number") for seg in complete if isinstance(seg.get("segment_number"), int)}
+        if len(complete) >= segment_count or len(have) != len(complete):
+            return raw
+        missing = [n for n in range(1, segment_count + 1) if n not in have]
+        if not missing or not AGENT_CONFIG["script_doctor"].get("continue_missing_segments", True):
+            return raw
+
+        self.log(f"有效分镜 {len(complete)}/{segment_count}，续写缺失的第{missing}镜...")
+        durations = request["planned_durations"]
+        follow_up = (
+            f"上面的输出不完整。请只补充缺失的第{missing}镜，"
+            f"duration_sec 依次为 {[durations[n - 1] for n in missing]}，字段与格式同上，"
+            "只返回严格JSON：{\"segments\": [...]}（不要重复已有分镜，不要用Markdown）"
+        )
+        payload = dict(request["payload"])
+        payload["messages"] = list(payload["messages"]) + [
+            {"role": "assistant", "content": content},
+            {"role": "user", "content": follow_up},
+        ]
+        predicted_output = self._estimate_output_tokens(len(missing))
+        if AGENT_CONFIG["script_doctor"].get("adaptive_max_tokens", True):
+            payload["max_tokens"] = max(512, min(int(AGENT_CONFIG["script_doctor"].get("max_tokens_limit", 16384)),
+                                                 predicted_output))
         try:
             result = call_volc_api(payload, "chat")
-            content = result["choices"][0]["message"]["content"].strip()
-
-            start = content.find("{")
-            end = content.rfind("}") + 1
-            if start != -1 and end != 0:
-                json_str = content[start:end]
-                raw = json.loads(json_str)
-                self.log("分镜剧本生成完成！")
-                return self._convert_to_story_data(
-                    raw,
-                    desired_count=segment_count,
-                    desired_durations=planned_durations,
-                    default_style_key=style_key,
-                    default_duration=int(VIDEO_CONFIG.get("video_duration", 4)),
-                )
+            log_token_usage("续写", sum(estimate_tokens(m["content"]) for m in payload["messages"]),
+                            predicted_output, payload["max_tokens"], result)
+            extra, repairs = parse_llm_json(result["choices"][0]["message"]["content"], list_key="segments")
+        except Exception as e:
+            self.log(f"续写失败，保留已恢复的分镜: {e}")
+            return raw
+        if repairs:
+            self.log(f"续写 JSON 已容错修复: {'; '.join(repairs)}")
+        added = [seg for seg in (extra or {}).get("segments", []) or []
+                 if self._is_complete_segment(seg) and seg.get("segment_number") in missing]
+        self.log(f"续写补回 {len(added)} 镜")
+        merged = dict(raw)
+        merged["segments"] = sorted(complete + added, key=lambda seg: seg["segment_number"])
+        return merged
+
+    def _story_from_raw(self, raw, request):
+        """按本次规划把原始分镜数据转为 StoryData"""
+        return self._convert_to_story_data(
+            raw,
+            desired_count=request["segment_count"],
+            desired_durations=request["planned_durations"],
+            default_style_key=request["style_key"],
+            default_duration=int(VIDEO_CONFIG.get("video_duration", 4)),
+            allowed_durations=request["allowed_durations"],
+            min_duration_sec=request["min_duration"],
+        )
 
 
-            self.log("JSON解析失败，使用备用方案")
-            return self._create_fallback_story(
-                story_input,
-                style_key=style_key,
-                style_config=style_config,
-                desired_count=segment_count,
-                durations=planned_durations,
-            )
+    @staticmethod
+    def is_filler_segment(segment):
+        """是否为解析不足时补齐的通用“补充分镜”"""
+        return getattr(segment, "transition_reason", None) == FILLER_TRANSITION_REASON
 
+    def regenerate_segment(self, story_data, segment_number, story_input=None):
+        """只重写第 segment_number 镜：以前后相邻分镜为上下文请求单镜 JSON，时长/编号保持不变。
 
-        except Exception as e:
-            self.log(f"剧本生成失败: {e}")
-            return self._create_fallback_story(
-                story_input,
-                style_key=style_key,
-                style_config=style_config,
-                desired_count=segment_count,
-                durations=planned_durations,
-            )
+        失败返回 None（调用方保留原分镜）。
+        """
+        segments = story_data.segments
+        index = segment_number - 1
+        current = segments[index]
+        style_key = current.style_used or getattr(story_input, "style", None) or "cinematic"
+        self.log(f"重写第{segment_number}镜分镜脚本...")
+
+        def describe(seg, label):
+            if seg is None:
+                return f"【{label}】无（本镜为{'开场' if label == '上一镜' else '结尾'}）"
+            return (f"【{label}】第{seg.segment_number}镜《{seg.title}》\n"
+                    f"- 画面: {seg.visual_prompt}\n- 动作/运镜: {seg.video_prompt}")
+
+        previous = segments[index - 1] if index > 0 else None
+        following = segments[index + 1] if index + 1 < len(segments) else None
+        original = "" if self.is_filler_segment(current) else f"\n【原分镜（需改写）】《{current.title}》{current.video_prompt}\n"
+        base_story = ""
+        if story_input is not None:
+            base_story = (getattr(story_input, "script_prompt", None) or
+                          f"主题：{story_input.theme}\n梗概：{story_input.summary}").strip()
+
+        prompt = f"""你是一个专业的短视频分镜编剧。下面是一条短视频分镜脚本中的一镜需要重写，请只输出这一镜。
+
+【系列标题】{story_data.overall_title}
+【剧情反转】{story_data.plot_twist}
+【用户剧本】
+{base_story}
 
+{describe(previous, "上一镜")}
+{describe(following, "下一镜")}
+{original}
+【硬性约束（必须遵守）】
+1) 本镜必须承接上一镜、引出下一镜，画面中绝对不出现任何文字
+2) duration_sec 必须等于 {current.duration_sec}，segment_number 必须等于 {segment_number}
+3) style_used 必须返回 "{style_key}"；transition_strategy 只能是 "tailframe_continue" 或 "hard_cut"
+
+请严格按以下JSON格式输出单个分镜对象（不要包含任何无关文本，不要用Markdown）：
+{{
+  "segment_number": {segment_number},
+  "title": "[分镜标题]",
+  "golden_hook": "[画面钩子/爆点提示]",
+  "visual_prompt": "[首帧单帧画面描述，无字]",
+  "video_prompt": "[动作与运镜描述，无字]",
+  "style_used": "{style_key}",
+  "aspect_ratio": "9:16",
+  "characters": ["[本镜出场角色名]"],
+  "location": "[本镜场景地点]",
+  "duration_sec": {current.duration_sec},
+  "transition_strategy": "hard_cut",
+  "transition_reason": "[为何用该转场]"
+}}
+"""
+        prompt, max_tokens, token_estimate = self._fit_token_budget([prompt], 1)
+        payload = {
+            "model": VOLC_CONFIG["chat_model"],
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": AGENT_CONFIG["script_doctor"]["temperature"],
+            "max_tokens": max_tokens,
+        }
+        try:
+            result = call_volc_api(payload, "chat")
+            log_token_usage(f"重写第{segment_number}镜", token_estimate["prompt"], token_estimate["completion"],
+                            max_tokens, result)
+            raw, repairs = parse_llm_json(result["choices"][0]["message"]["content"])
+            if repairs:
+                self.log(f"JSON 已容错修复: {'; '.join(repairs)}")
+            if raw is None:
+                raise ValueError("未找到JSON")
+            raw = (raw.get("segments") or [raw])[0] if "segments" in raw else raw
+            rebuilt = self._convert_to_story_data(
+                {"segments": [raw]},
+                desired_count=1,
+                desired_durations=[current.duration_sec],
+                default_style_key=style_key,
+                default_duration=current.duration_sec,
+                allowed_durations=[current.duration_sec],
+                min_duration_sec=current.duration_sec,
+            ).segments[0]
+        except Exception as e:
+            self.log(f"第{segment_number}镜重写失败: {e}")
+            return None
+        if self.is_filler_segment(rebuilt):
+            self.log(f"第{segment_number}镜重写结果无效，保留原分镜")
+            return None
+        rebuilt.segment_number = segment_number
+        self.log(f"第{segment_number}镜已重写: {rebuilt.title}")
+        return rebuilt
+
+    @staticmethod
+    def _normalize_names(value):
+        """角色名列表归一：兼容字符串（逗号/顿号分隔），去空白与重复，保持顺序"""
+        if isinstance(value, str):
+            value = value.replace("，", ",").replace("、", ",").split(",")
+        names = []
+        for name in value or []:
+            name = str(name).strip()
+            if name and name not in names:
+                names.append(name)
+        return names
 
     def _normalize_style_key(self, style_used, default_style_key="cinematic"):
         """兼容 style key / 中文名，内部统一返回 key"""
@@ -181,11 +510,13 @@ class ScriptDoctorAgent(BaseAgent):
                 return k
         return default_style_key
 
-    def _convert_to_story_data(self, raw_data, desired_count=10, desired_durations=None, default_style_key="cinematic", default_duration=4):
+    def _convert_to_story_data(self, raw_data, desired_count=10, desired_durations=None, default_style_key="cinematic", default_duration=4,
+                               allowed_durations=None, min_duration_sec=None):
         """将原始数据转换为StoryData模型，并保证分镜数量满足 desired_count。
 
         - 若提供 desired_durations（长度=desired_count），则会强制覆盖每镜 duration_sec
-        - 未提供时，会将 duration_sec 归一到 4/5 秒（且不得低于4秒）
+        - 未提供时，会将 duration_sec 归一到允许的单镜时长（snap_to_allowed_duration）
+        - allowed_durations/min_duration_sec: 所选规格的单镜时长集合与最小时长，None 时取 VIDEO_CONFIG
         """
 
         segments = []
@@ -213,8 +544,8 @@ class ScriptDoctorAgent(BaseAgent):
 
             style_key = self._normalize_style_key(seg.get("style_used"), default_style_key)
             duration_sec = int(seg.get("duration_sec", default_duration) or default_duration)
-            # 时长归一：只允许 4/5 秒，且不得低于4秒
-            duration_sec = 5 if duration_sec >= 5 else 4
+            # 时长归一：只允许配置的单镜时长，且不得低于最小时长
+            duration_sec = snap_to_allowed_duration(duration_sec, allowed_durations, min_duration_sec)
             transition_strategy = seg.get("transition_strategy", "hard_cut")
 
             if transition_strategy not in ["hard_cut", "tailframe_continue"]:
@@ -233,6 +564,8 @@ class ScriptDoctorAgent(BaseAgent):
                 duration_sec=duration_sec,
                 transition_strategy=transition_strategy,
                 transition_reason=seg.get("transition_reason"),
+                characters=self._normalize_names(seg.get("characters")),
+                location=str(seg.get("location") or "").strip(),
             )
             segments.append(segment)
 
@@ -259,7 +592,7 @@ class ScriptDoctorAgent(BaseAgent):
                         keywords=style_config.get("keywords", [])[:2],
                         duration_sec=default_duration,
                         transition_strategy="hard_cut",
-                        transition_reason="补充分镜",
+                        transition_reason=FILLER_TRANSITION_REASON,
                     )
                 )
 
@@ -274,7 +607,7 @@ class ScriptDoctorAgent(BaseAgent):
                     d = int(desired_durations[i - 1])
                 except Exception:
                     d = default_duration
-                seg.duration_sec = 5 if d >= 5 else 4
+                seg.duration_sec = snap_to_allowed_duration(d, allowed_durations, min_duration_sec)
 
 
         return StoryData(
@@ -284,10 +617,12 @@ class ScriptDoctorAgent(BaseAgent):
             segments=segments,
         )
 
-    def _create_fallback_story(self, story_input, style_key="cinematic", style_config=None, desired_count=10, durations=None):
+    def _create_fallback_story(self, story_input, style_key="cinematic", style_config=None, desired_count=10, durations=None,
+                               allowed_durations=None, min_duration_sec=None):
         """创建备用故事（保证 desired_count 个分镜）。
 
-        durations: 可选的每镜时长数组（仅允许4/5秒）
+        durations: 可选的每镜时长数组（通常为本次规划时长）
+        allowed_durations/min_duration_sec: 所选规格的单镜时长集合与最小时长，None 时取 VIDEO_CONFIG
         """
 
         self.log("创建备用分镜脚本...")
@@ -304,13 +639,10 @@ class ScriptDoctorAgent(BaseAgent):
             idx = i + 1
             transition_strategy = "tailframe_continue" if idx > 1 and idx <= 3 else "hard_cut"
 
-            d = None
+            d = VIDEO_CONFIG.get("video_duration", 4)
             if durations and isinstance(durations, list) and len(durations) >= idx:
-                try:
-                    d = int(durations[idx - 1])
-                except Exception:
-                    d = None
-            duration_sec = 5 if (d and d >= 5) else 4
+                d = durations[idx - 1]
+            duration_sec = snap_to_allowed_duration(d, allowed_durations, min_duration_sec)
 
             segments.append(
                 StorySegment(
@@ -331,7 +663,7 @@ class ScriptDoctorAgent(BaseAgent):
 
 
         return StoryData(
-            overall_title=f"{getattr(story_input, 'theme', '自定义故事')} - 约30秒成片",
+            overall_title=f"{getattr(story_input, 'theme', '自定义故事')} - 约{sum(s.duration_sec for s in segments)}秒成片",
 
             plot_twist="",
             segments=segments,
@@ -367,7 +699,40 @@ class VisualDirectorAgent(BaseAgent):
         self.log(f"提示词增强完成: {len(enhanced_prompt)}字符")
         return enhanced_prompt
 
-    
+    def plan_reference_assets(self, story_data, min_shots=2):
+        """从分镜中找出反复出现的角色/场景，返回参考帧规划。
+
+        只统计需要新出首帧的分镜（首镜与 hard_cut）；返回
+        {"characters": {角色: [镜号]}, "locations": {地点: [镜号]}, "shots": {地点|角色组合: [镜号]}}，
+        只保留出现次数 ≥ min_shots 的项。
+        """
+        characters, locations, shots = {}, {}, {}
+        for seg in story_data.segments:
+            if seg.segment_number > 1 and seg.transition_strategy == "tailframe_continue":
+                continue
+            names = list(getattr(seg, "characters", None) or [])
+            location = getattr(seg, "location", "") or ""
+            for name in names:
+                characters.setdefault(name, []).append(seg.segment_number)
+            if location:
+                locations.setdefault(location, []).append(seg.segment_number)
+            if location or names:
+                shots.setdefault(self.shot_reference_key(seg), []).append(seg.segment_number)
+
+        def recurring(groups):
+            return {key: numbers for key, numbers in groups.items() if len(numbers) >= min_shots}
+
+        plan = {"characters": recurring(characters), "locations": recurring(locations), "shots": recurring(shots)}
+        self.log(f"参考帧规划: 复现角色 {len(plan['characters'])} 个，复现场景 {len(plan['locations'])} 个，"
+                 f"同机位组合 {len(plan['shots'])} 组")
+        return plan
+
+    @staticmethod
+    def shot_reference_key(segment):
+        """同一地点 + 同一组角色视为同一机位组合（角色顺序无关）"""
+        names = sorted(getattr(segment, "characters", None) or [])
+        return f"{getattr(segment, 'location', '') or ''}|{'、'.join(names)}"
+
     def recommend_camera_shots(self, scene_type):
         """推荐镜头语言"""
         shot_recommendations = {
@@ -388,7 +753,7 @@ class RhythmDesignerAgent(BaseAgent):
         
         dur = int(getattr(story_segment, "duration_sec", VIDEO_CONFIG.get("video_duration", 4)) or VIDEO_CONFIG.get("video_duration", 4))
 
-        # 基于场景类型推荐节奏（单镜4/5秒）
+        # 基于场景类型推荐节奏（单镜时长按规划）
         rhythm_patterns = {
             "开场": f"{dur}秒短镜头：开头抓钩子画面，中段动作推进，结尾留下悬念",
             "发展": f"{dur}秒短镜头：开头变化出现，中段冲突升级，结尾切到下一镜",
@@ -518,19 +883,39 @@ class VideoDirectorAgent:
         """创建完整的视频制作计划"""
         print("🎬 视频导演开始制定制作计划...")
         
-        # 1. 剧本创作
+        # 1. 剧本创作（storyboard_candidates > 1 时并发生成多份候选）
         print("\n📝 第一步：剧本创作")
-        story_data = self.script_doctor.enhance_story_prompts(user_input)
+        candidate_count = max(1, int(AGENT_CONFIG["script_doctor"].get("storyboard_candidates", 1) or 1))
+        candidates = [s for s in self.script_doctor.generate_storyboard_candidates(user_input, candidate_count)
+                      if s.segments]
         
         # 确保至少有一个有效分段
-        if not story_data.segments:
-            self.log("⚠️  故事数据中没有有效分段，创建备用故事")
-            style_config = COMIC_STYLES.get(user_input.style, COMIC_STYLES["cinematic"])
-            story_data = self.script_doctor._create_fallback_story(user_input, style_config)
-        
-        # 2. 质量评估
+        if not candidates:
+            print("  ⚠️  故事数据中没有有效分段，创建备用故事")
+            request = self.script_doctor._build_story_request(user_input)
+            candidates = [self.script_doctor._create_fallback_story(
+                user_input,
+                style_key=request["style_key"],
+                style_config=request["style_config"],
+                desired_count=request["segment_count"],
+                durations=request["planned_durations"],
+                allowed_durations=request["allowed_durations"],
+                min_duration_sec=request["min_duration"],
+            )]
+        
+        # 2. 质量评估（多候选时逐份评分，择优进入后续出图/出视频）
         print("\n📊 第二步：质量评估")
-        quality_report = self.quality_inspector.evaluate_story_quality(story_data)
+        if len(candidates) == 1:
+            story_data = candidates[0]
+            quality_report = self.quality_inspector.evaluate_story_quality(story_data)
+        else:
+            variants = []
+            for i, story in enumerate(candidates):
+                print(f"  候选剧本 {i + 1}/{len(candidates)}: {story.overall_title}")
+                report = self.quality_inspector.evaluate_story_quality(story)
+                variants.append({"story_data": story, "quality_report": report, "quality_score": report["score"]})
+            best = self.quality_inspector.select_best_variant(variants)
+            story_data, quality_report = best["story_data"], best["quality_report"]
         
         # 3. 视觉规划
         print("\n🎨 第三步：视觉规划")
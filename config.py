@@ -27,12 +27,23 @@ VIDEO_CONFIG = {
     "output_dir": "./generated_videos",
     "image_size": "1920x1920",
 
-    # 单镜时长规划（约30s成片）：单镜最少4秒，仅允许4/5秒混合
+    # 单镜时长规划（约30s成片）：DP 规划器支持任意时长集合（如 [3, 4, 5, 6, 8, 10]）与镜头数上下限
     "target_total_duration": 30,       # 目标总时长（秒）
     "target_total_tolerance": 2,       # 允许浮动范围（秒），例如 28~32
     "segment_duration_min": 4,         # 单镜最小时长（秒）
     "segment_duration_options": [4, 5],# 允许的单镜时长选项（秒）
     "max_segments": 10,                # 最多支持分镜数
+    "min_segments": 1,                 # 最少分镜数
+
+    # 批量规格：启动时与默认规格一起预计算时长规划表（按节奏 manju/movie），缓存在 plan_table_cache
+    "plan_formats": [
+        {"name": "15s", "target": 15, "tolerance": 1, "allowed": [3, 4, 5, 6], "min_duration": 3, "max_segments": 6},
+        {"name": "60s", "target": 60, "tolerance": 3, "allowed": [4, 5, 6, 8, 10], "max_segments": 15},
+        {"name": "90s", "target": 90, "tolerance": 3, "allowed": [4, 5, 6, 8, 10], "max_segments": 20},
+    ],
+    "plan_table_cache": None,          # None 表示 <output_dir>/.cache/plan_table.json
+    # ffmpeg/ffprobe 能力探测缓存（版本/编码器/滤镜，按二进制路径+mtime 失效），None 表示 <output_dir>/.cache/toolchain.json
+    "toolchain_cache": None,
 
     # 兼容旧字段（作为默认/兜底，避免外部调用崩溃）
     "video_duration": 4,
@@ -40,6 +51,74 @@ VIDEO_CONFIG = {
 
     # 合成阶段音频策略：默认保留音轨（不刻意去音）；如需静音可设为 True
     "force_no_audio": False,
+    # 角色/场景参考帧：None 关闭 | reuse（同地点+角色组合的分镜复用首个分镜的首帧，省出图调用）
+    # | condition（每个复现角色/场景先出一张参考帧，分镜出图时作为条件图，保持跨镜一致）
+    "reference_frames": None,
+    "reference_min_shots": 2,  # 角色/场景/组合至少在几个需出图的分镜中出现才建参考帧
+    "reference_max_images": 4,  # condition 模式单次出图最多传入的参考帧数
+    # 成片时长超出目标不超过该值（秒）时不裁切，整条链路保持 stream copy
+    "final_trim_tolerance_sec": 0.25,
+    # 按实际时长分摊裁切：每段最多裁掉的秒数（尾部按参考帧边界 copy 截断，片头仅在关键帧处入点）
+    "max_segment_trim_sec": 0.5,
+    # 合成模式：smart（仅重编码规格不一致的分段，其余 copy）| copy（先 copy，失败整片重编码）| reencode（整片重编码）
+    "merge_mode": "smart",
+    # ffmpeg 进程调度：本机同时运行的编码进程上限（None 表示 CPU 核数的一半）与单条命令超时（秒）
+    "max_concurrent_encodes": None,
+    # stream copy/抽帧/响度分析等轻量 ffmpeg 命令的独立并发上限（None 表示 CPU 核数，至少 2），不占编码名额
+    "max_concurrent_light_jobs": None,
+    "ffmpeg_timeout_sec": 600,
+    # 增量拼装：分段按时间线顺序到齐即在后台完成逐段探测（规格/出点/响度），成片阶段只剩 concat copy；
+    # 时间线达到 1/2/4/8… 段时刷新 preview_partial.mp4 供预览
+    "incremental_assembly": True,
+    "partial_preview": True,
+    # 下载即规格化：每段下载后立即在后台 ffmpeg 进程中转为统一规格（多核并行、不占关键路径），成片只做 concat copy
+    "normalize_on_download": False,
+    "normalize_workers": 2,
+    "canonical_spec": {
+        "vcodec": "h264",
+        "profile": "High",
+        "pix_fmt": "yuv420p",
+        "fps": "24/1",
+        "sar": "1:1",
+        "width": None,                 # None 表示以第一个分段的分辨率为准
+        "height": None,
+        "time_base": None,             # None 表示以第一个分段的视频时间基为准（concat copy 要求各段一致）
+        "acodec": "aac",
+        "sample_rate": "44100",
+        "channels": 2,
+    },
+
+    # 多版本输出：成片完成后一次解码、split 滤镜同时输出各画幅/预览版，写在 final_30s.mp4 旁边
+    "render_renditions": False,
+    "output_renditions": [
+        {"name": "9x16", "aspect": "9:16", "max_width": 1080, "crf": 20},
+        {"name": "1x1", "aspect": "1:1", "max_width": 1080, "crf": 20},
+        {"name": "16x9", "aspect": "16:9", "max_width": 1920, "crf": 20},
+        {"name": "preview", "aspect": None, "max_width": 360, "video_bitrate": "400k", "audio_bitrate": "64k"},
+    ],
+
+    # 流媒体封装：None | "hls"（TS 分片）| "cmaf"（fMP4 分片），按分镜边界 stream copy 切片，输出到 stream_<格式>/index.m3u8
+    "stream_packaging": None,
+
+    # 审片素材：成片阶段一次滤镜图输出分镜联系表（每镜首/中/尾帧）、海报图与缩略图条，尾帧直接复用 frames/tail_NN.jpg
+    "contact_sheet": True,
+
+    # 响度归一（EBU R128）：下载时测量每段响度并缓存，合成时仅当偏差超过阈值才做一遍增益+限幅（视频仍 copy）
+    "loudness_normalization": False,
+    "loudness_target_lufs": -16,
+    "loudness_threshold_lu": 2.0,
+    "loudness_true_peak_db": -1.5,
+
+    # 尾帧续接：下载时把字节流同时喂给ffmpeg解码，下载结束即得尾帧（要求MP4为faststart，否则自动回退）
+    "tail_frame_during_download": False,
+    # 尾帧择优：一次解码末尾窗口内的帧，取最后N帧中清晰度/曝光最佳的一帧（1 表示直接取最后一帧）
+    "tail_frame_candidates": 6,
+    "tail_frame_window_sec": 0.5,
+
+    # 首帧无字检测（OpenCV MSER 离线检测）：疑似含字的首帧在提交视频前自动重生成
+    "no_text_check": True,
+    "no_text_threshold": 0.35,          # 文字可能性分数（0~1）超过该值视为含字
+    "no_text_max_regenerations": 2,     # 每镜最多重生成次数，仍超标则取分数最低的一张
 
     "aspect_ratio": "9:16",
     "max_retries": 3,
@@ -118,11 +197,24 @@ COMIC_STYLES = {
 AGENT_CONFIG = {
     "script_doctor": {
         "temperature": 0.8,
-        "max_tokens": 2000,
-        "enhancement_level": "high"
+        "max_tokens": 2000,  # adaptive_max_tokens 关闭时使用的固定值
+        "adaptive_max_tokens": True,  # 按分镜数预估输出 token 设定每次请求的 max_tokens
+        "output_tokens_per_segment": 280,  # 每镜 JSON 输出的预估 token（中文约 1 token/字）
+        "output_token_margin": 1.25,  # 预估输出的安全余量
+        "max_tokens_limit": 16384,  # 模型单次输出上限
+        "prompt_token_budget": 4000,  # 提示词（输入）token 预算，超出时按优先级裁掉冗余提示段；不含输出
+        "context_window": 32768,  # 模型上下文窗口，输入+max_tokens 超出时同样裁剪提示段
+        "enhancement_level": "high",
+        "storyboard_candidates": 1,  # 并发请求的候选分镜剧本数，质量检测官逐份评分后择优；1 表示不做多候选
+        "continue_missing_segments": True,  # 容错解析后有效分镜仍不足时，追加一次续写请求只补缺失分镜；False 直接补充分镜
+        # 相似剧本缓存（本地 TF-IDF 检索，需 NumPy）：None 关闭 | seed（相似剧本作为参考注入提示词）
+        # | reuse（另外：归一化后提示词完全相同且风格/节奏/时长规划一致时直接复用，不发对话请求）
+        "storyboard_cache": None,
+        "storyboard_seed_threshold": 0.5,
+        "storyboard_cache_dir": None  # None 表示 <output_dir>/.cache/storyboards
     },
     "visual_director": {
         "quality_preset": "cinematic",
-        "max_variants": 3
+        "max_variants": 3  # 每镜并发生成的候选首帧数，批量评分（清晰度/曝光/无字）后择优；1 表示不做多候选
     }
 }
\ No newline at end of file
@@ -4,13 +4,17 @@
 集成多智能体系统
 """
 
+import os
 import sys
-import subprocess
+import importlib.util
 from datetime import datetime
 
 from config import VOLC_CONFIG, NGINX_CONFIG, VIDEO_CONFIG, COMIC_STYLES
 from models import StoryInput
-from video_generator import VideoGenerator
+from utils import probe_toolchain
+
+# 菜单文案中的单镜时长选项（如 "4/5"），随 VIDEO_CONFIG 变化
+DURATION_OPTIONS_TEXT = "/".join(str(d) for d in VIDEO_CONFIG.get("segment_duration_options", [4, 5]))
 
 def check_environment():
     """检查运行环境"""
@@ -21,24 +25,21 @@ def check_environment():
         print("❌ 需要Python 3.7或更高版本")
         return False
     
-    # 检查必要库
-    try:
-        import PIL
-        import urllib
-        import json
-        print("✅ 必要库已安装")
-    except ImportError as e:
-        print(f"❌ 缺少必要库: {e}")
+    # 检查必要库（只查找不导入，避免启动时加载 PIL）
+    missing = [name for name in ("PIL",) if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"❌ 缺少必要库: {', '.join(missing)}")
         return False
+    print("✅ 必要库已安装")
     
-    # 检查FFmpeg
-    try:
-        result = subprocess.run(['ffmpeg', '-version'], capture_output=True, timeout=5)
-        if result.returncode == 0:
-            print("✅ FFmpeg已安装")
-        else:
-            print("⚠️  FFmpeg检查失败，尾帧提取功能可能受限")
-    except:
+    # 检查FFmpeg（能力探测结果按二进制路径+mtime 缓存，二进制未变时不起子进程）
+    toolchain = probe_toolchain()
+    if toolchain.get("ffmpeg") and toolchain["ffmpeg"].get("version"):
+        ffmpeg = toolchain["ffmpeg"]
+        print(f"✅ FFmpeg已安装: {ffmpeg['version']}（{len(ffmpeg['encoders'])} 个编码器 / {len(ffmpeg['filters'])} 个滤镜）")
+    elif toolchain.get("ffmpeg"):
+        print("⚠️  FFmpeg检查失败，尾帧提取功能可能受限")
+    else:
         print("⚠️  FFmpeg未安装，尾帧提取功能将使用备用方案")
     
     return True
@@ -52,7 +53,7 @@ def display_welcome():
     print("  • 🤖 多智能体协作：剧本医生 + 视觉导演 + 节奏设计师 + 质量检测官")
     print("  • 🎯 专业三幕剧结构：开场 → 发展 → 高潮反转")
     print("  • 🎨 多种视觉风格：电影感、漫画、摄影等12种风格")
-    print("  • 📹 约30秒成片：最多10镜，单镜4/5秒混合（最少4秒），按剧情决定尾帧续接，ffmpeg自动合成")
+    print(f"  • 📹 约30秒成片：最多10镜，单镜{DURATION_OPTIONS_TEXT}秒混合（最少4秒），按剧情决定尾帧续接，ffmpeg自动合成")
 
 
     print("  • 🚫 无文字纯画面：所有画面严格保证无任何文字")
@@ -95,11 +96,26 @@ def read_multiline_input(tip, end_token="END"):
         lines.append(line)
     return "\n".join(lines).strip()
 
+def choose_plan_format():
+    """选择时长规格（VIDEO_CONFIG["plan_formats"]），默认规格返回 None"""
+    names = [fmt["name"] for fmt in VIDEO_CONFIG.get("plan_formats") or []]
+    if not names:
+        return None
+    target = VIDEO_CONFIG.get("target_total_duration", 30)
+    print("\n⏱️ 选择成片时长规格:")
+    print(f"  1. 默认（约{target}秒，单镜{DURATION_OPTIONS_TEXT}秒）")
+    for i, name in enumerate(names, 2):
+        print(f"  {i}. {name}")
+    choice = input(f"选择 (1-{len(names) + 1}，默认1): ").strip()
+    if choice.isdigit() and 2 <= int(choice) <= len(names) + 1:
+        return names[int(choice) - 2]
+    return None
+
 def run_30s_auto_mode():
     """约30秒全自动模式：一次性输入粗糙剧本提示词，系统自动编剧分镜并合成"""
 
     print("\n" + "="*70)
-    print("🚀 约30秒全自动模式（4/5秒混合） - 粘贴粗糙剧本提示词")
+    print(f"🚀 约30秒全自动模式（{DURATION_OPTIONS_TEXT}秒混合） - 粘贴粗糙剧本提示词")
 
     print("="*70)
 
@@ -109,6 +125,7 @@ def run_30s_auto_mode():
     print("  2. 电影（更连贯镜头、更克制节奏）")
     rhythm_choice = input("选择 (1-2，默认1): ").strip()
     rhythm_style = "movie" if rhythm_choice == "2" else "manju"
+    plan_format = choose_plan_format()
 
     # 选择视觉风格
     print("\n🎨 选择视觉风格:")
@@ -142,13 +159,16 @@ def run_30s_auto_mode():
         output_name=output_name,
         script_prompt=script_prompt,
         rhythm_style=rhythm_style,
+        plan_format=plan_format,
         auto_mode=True,
     )
 
-    print("\n✅ 已进入全自动模式：将生成 ≤10 镜，单镜4/5秒混合（最少4秒），并自动合成约30s成片（默认保留音轨、严格无字）")
+    print(f"\n✅ 已进入全自动模式：将生成 ≤10 镜，单镜{DURATION_OPTIONS_TEXT}秒混合（最少4秒），并自动合成约30s成片（默认保留音轨、严格无字）")
 
 
     print(f"  节奏风格: {rhythm_style}")
+    if plan_format:
+        print(f"  时长规格: {plan_format}")
     print(f"  视觉风格: {COMIC_STYLES[selected_style]['name']}")
 
     return story_input
@@ -193,6 +213,8 @@ def run_interactive_mode():
     except:
         selected_style = "cinematic"
     
+    plan_format = choose_plan_format()
+
     output_name = input("\n📁 输出系列名称 (可选，默认自动生成): ").strip()
     
     # 创建输入对象
@@ -201,14 +223,18 @@ def run_interactive_mode():
         summary=summary,
         characters=characters if characters else None,
         style=selected_style,
-        output_name=output_name
+        output_name=output_name,
+        plan_format=plan_format,
     )
     
     print(f"\n✅ 输入确认:")
     print(f"  主题: {theme}")
     print(f"  风格: {COMIC_STYLES[selected_style]['name']}")
     print(f"  画面: 无文字纯画面")
-    print(f"  时长: 约30s（系统自动规划4/5秒分镜）")
+    if plan_format:
+        print(f"  时长: {plan_format} 规格（系统自动规划分镜时长）")
+    else:
+        print(f"  时长: 约30s（系统自动规划{DURATION_OPTIONS_TEXT}秒分镜）")
 
 
     
@@ -321,6 +347,8 @@ def main():
 
         
         # 初始化视频生成器
+        from video_generator import VideoGenerator
+
         print("\n" + "="*70)
         print("🚀 初始化视频导演系统...")
         generator = VideoGenerator({
@@ -365,5 +393,91 @@ def main():
         import traceback
         traceback.print_exc()
 
+def run_cli_command(argv):
+    """非交互命令行子命令
+
+    eval-text-detector <无字图片目录> <含字图片目录> [阈值]  评估首帧无字检测的误报率/漏报率与耗时
+    bench-merge <输出目录> <目标秒数|0> <分段1.mp4> [分段2.mp4 ...]  对比 copy/reencode/smart 合成的 CPU 开销
+    plan-table [--rebuild]  查看（或强制重建）预计算的时长规划表
+    repair <系列目录> [--segments 2,5] [--rewrite 3]  按运行日志只重做失败/补齐的分段（或指定分段）并重新合成
+    """
+    command = argv[0]
+
+    if command == "eval-text-detector" and len(argv) >= 3:
+        from utils import evaluate_text_detector
+
+        def list_images(folder):
+            return sorted(
+                os.path.join(folder, name) for name in os.listdir(folder)
+                if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp"))
+            )
+
+        threshold = float(argv[3]) if len(argv) > 3 else None
+        report = evaluate_text_detector(list_images(argv[1]), list_images(argv[2]), threshold)
+        print("🔤 无字检测评估结果:")
+        print(f"  阈值: {report['threshold']}")
+        print(f"  样本: 无字 {report['clean_count']} 张 / 含字 {report['text_count']} 张")
+        print(f"  误报率: {report['false_positive_rate'] * 100:.1f}%")
+        print(f"  漏报率: {report['false_negative_rate'] * 100:.1f}%")
+        print(f"  平均耗时: {report['avg_latency_ms']:.1f}ms/张")
+        return
+
+    if command == "bench-merge" and len(argv) >= 4:
+        from utils import benchmark_merge_modes
+
+        target = float(argv[2]) or None
+        results = benchmark_merge_modes(argv[3:], argv[1], target_duration_sec=target)
+        print("🎞️ 合成模式开销对比（每部成片）:")
+        for item in results:
+            status = "✅" if not item["error"] else f"❌ {item['error'][:80]}"
+            print(f"  {item['mode']:<9} CPU {item['cpu_sec']:.2f}s  墙钟 {item['wall_sec']:.2f}s  {status}")
+        return
+
+    if command == "plan-table":
+        from utils import load_plan_table
+
+        table = load_plan_table(rebuild="--rebuild" in argv[1:])
+        print(f"📐 时长规划表（{len(table)} 条）:")
+        for key, plan in table.items():
+            print(f"  [{plan['format']:<8}] {plan['rhythm']:<6} {plan['segment_count']:>2}镜 "
+                  f"{plan['planned_total']:>3}s  {plan['durations']}")
+            print(f"             key={key}")
+        return
+
+    if command == "repair" and len(argv) >= 2:
+        from video_generator import VideoGenerator
+
+        def parse_numbers(flag):
+            if flag not in argv:
+                return None
+            value = argv[argv.index(flag) + 1] if argv.index(flag) + 1 < len(argv) else ""
+            try:
+                return [int(x) for x in value.split(",") if x.strip()]
+            except ValueError:
+                raise SystemExit(f"❌ {flag} 需要逗号分隔的分段编号，收到: {value!r}")
+
+        generator = VideoGenerator({
+            "volc_config": VOLC_CONFIG,
+            "nginx_config": NGINX_CONFIG,
+            "video_config": VIDEO_CONFIG,
+            "comic_styles": COMIC_STYLES,
+            "auto_mode": True,
+        })
+        result = generator.repair_segments(
+            argv[1], segment_numbers=parse_numbers("--segments"), rewrite_numbers=parse_numbers("--rewrite"),
+        )
+        if result.status == "failed":
+            print(f"❌ 修复失败: {result.reason}")
+        else:
+            print(f"🩹 修复完成: {result.successful_videos}/{result.total_segments} 段成功")
+            if result.final_video_path:
+                print(f"  成片: {result.final_video_path}")
+        return
+
+    print(run_cli_command.__doc__)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        run_cli_command(sys.argv[1:])
+    else:
+        main()
\ No newline at end of file
@@ -3,7 +3,7 @@
 数据模型定义
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List, Dict, Optional, Any
 
 @dataclass
@@ -22,6 +22,8 @@ class StorySegment:
 
     transition_strategy: str = "hard_cut"  # hard_cut | tailframe_continue
     transition_reason: Optional[str] = None
+    characters: List[str] = field(default_factory=list)  # 本镜出场角色（跨镜同名，用于参考帧复用）
+    location: str = ""  # 本镜场景地点
 
 
 @dataclass
@@ -41,6 +43,7 @@ class StoryInput:
     output_name: Optional[str] = None
     script_prompt: Optional[str] = None  # 运行时一次性输入的粗糙剧本提示词
     rhythm_style: str = "manju"  # manju | movie（节奏风格）
+    plan_format: Optional[str] = None  # 时长规格名（VIDEO_CONFIG["plan_formats"]，如 15s/60s），None 为默认规格
     auto_mode: bool = False  # True 时跳过所有确认环节
 
 
@@ -54,6 +57,7 @@ class VideoResult:
     status: str = "pending"
     reason: Optional[str] = None
     video_info: Optional[Dict] = None
+    tail_frame_bytes: Optional[bytes] = None  # 边下载边解码得到的尾帧JPEG（tail_frame_during_download）
 
 @dataclass
 class SegmentResult:
@@ -66,6 +70,7 @@ class SegmentResult:
     image_url: str
     video_result: VideoResult
     last_frame_path: Optional[str] = None
+    last_frame_bytes: Optional[bytes] = None  # 尾帧JPEG字节，供下一段尾帧续接直接发布
 
 @dataclass
 class ImageResult:
@@ -77,6 +82,7 @@ class ImageResult:
     file_size_kb: float = 0
     style: str = ""
     is_fallback: bool = False
+    text_score: Optional[float] = None  # 无字检测分数（0~1，越高越可能含字）
 
 @dataclass
 class GenerationResult:
@@ -88,10 +94,18 @@ class GenerationResult:
     merge_instructions: str = ""
     detailed_report: str = ""
     final_video_path: str = ""
+    preview_video_path: str = ""
+    rendition_paths: Dict[str, str] = None
+    stream_playlist_path: str = ""
+    review_assets: Dict[str, str] = None
     all_results: List[SegmentResult] = None
     reason: Optional[str] = None
 
     
     def __post_init__(self):
         if self.all_results is None:
-            self.all_results = []
\ No newline at end of file
+            self.all_results = []
+        if self.rendition_paths is None:
+            self.rendition_paths = {}
+        if self.review_assets is None:
+            self.review_assets = {}
\ No newline at end of file
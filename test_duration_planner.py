@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+时长规划器单元测试：随机参数下与暴力枚举对拍
+运行：python test_duration_planner.py
+"""
+
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from config import VIDEO_CONFIG
+from models import StoryInput
+from utils import plan_segment_durations, lookup_duration_plan, snap_to_allowed_duration, get_plan_format
+
+
+def brute_force_plan(target, tolerance, allowed, min_segments, max_segments, prefer_more_cuts, weights=None):
+    """枚举所有镜头数 × 各时长数量组合，按规划器的选优顺序取最优，返回 (选优键, 镜头数, 总时长)"""
+    weights = weights or {}
+    best = None
+    for n in range(max(1, min_segments), max_segments + 1):
+        for combo in itertools.combinations_with_replacement(allowed, n):
+            total = sum(combo)
+            cost = (sum(weights.get(d, 0.0) for d in combo), sum(d * d for d in combo))
+            key = (
+                0 if target - tolerance <= total <= target + tolerance else 1,
+                abs(total - target),
+                -n if prefer_more_cuts else n,
+                cost,
+            )
+            if best is None or key < best[0]:
+                best = (key, n, total)
+    return best
+
+
+class TestDurationPlanner(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # 规划表缓存写到临时目录，不污染输出目录
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls._saved_cache = VIDEO_CONFIG.get("plan_table_cache")
+        VIDEO_CONFIG["plan_table_cache"] = os.path.join(cls._tmp_dir, "plan_table.json")
+
+    @classmethod
+    def tearDownClass(cls):
+        VIDEO_CONFIG["plan_table_cache"] = cls._saved_cache
+        shutil.rmtree(cls._tmp_dir, ignore_errors=True)
+
+    def _check_against_brute_force(self, target, tolerance, allowed, min_segments, max_segments,
+                                   prefer_more_cuts, weights=None):
+        n, durations, total = plan_segment_durations(
+            target_total_sec=target,
+            tolerance_sec=tolerance,
+            allowed_durations=allowed,
+            min_duration_sec=min(allowed),
+            max_segments=max_segments,
+            prefer_more_cuts=prefer_more_cuts,
+            min_segments=min_segments,
+            pacing_weights=weights,
+        )
+        label = (target, tolerance, allowed, min_segments, max_segments, prefer_more_cuts, weights)
+
+        # 结构性质：镜头数、总时长一致，每镜时长都来自允许集合，镜头数在上下限内
+        self.assertEqual(len(durations), n, label)
+        self.assertEqual(sum(durations), total, label)
+        self.assertTrue(all(d in allowed for d in durations), label)
+        self.assertTrue(max(1, min_segments) <= n <= max_segments, label)
+
+        # 最优性：与暴力枚举的选优键完全一致
+        expected_key, expected_n, expected_total = brute_force_plan(
+            target, tolerance, allowed, min_segments, max_segments, prefer_more_cuts, weights)
+        weights = weights or {}
+        key = (
+            0 if target - tolerance <= total <= target + tolerance else 1,
+            abs(total - target),
+            -n if prefer_more_cuts else n,
+            (sum(weights.get(d, 0.0) for d in durations), sum(d * d for d in durations)),
+        )
+        self.assertEqual(key, expected_key, label)
+        self.assertEqual((n, total), (expected_n, expected_total), label)
+
+        # 有可行解时必须落在容差区间内
+        if expected_key[0] == 0:
+            self.assertLessEqual(abs(total - target), tolerance, label)
+
+    def test_default_config_mixes_4_and_5(self):
+        n, durations, total = plan_segment_durations(30, 2, [4, 5], 4)
+        self.assertLessEqual(abs(total - 30), 2)
+        self.assertTrue(set(durations) <= {4, 5})
+        self.assertEqual(sum(durations), total)
+
+    def test_random_parameters_match_brute_force(self):
+        rng = random.Random(20260419)
+        pool = [2, 3, 4, 5, 6, 8, 10, 12]
+        for _ in range(300):
+            allowed = sorted(rng.sample(pool, rng.randint(1, 4)))
+            max_segments = rng.randint(1, 8)
+            min_segments = rng.randint(1, max_segments)
+            target = rng.randint(3, 70)
+            tolerance = rng.randint(0, 3)
+            weights = None
+            if rng.random() < 0.4:
+                weights = {d: rng.choice([0.25, 0.5, 1.0, 1.5]) for d in allowed if rng.random() < 0.5}
+            self._check_against_brute_force(target, tolerance, allowed, min_segments, max_segments,
+                                            rng.random() < 0.5, weights)
+
+    def test_batch_formats(self):
+        for target in (15, 30, 60, 90):
+            for prefer_more_cuts in (True, False):
+                self._check_against_brute_force(target, 2, [3, 4, 5, 6, 8, 10], 1, 12, prefer_more_cuts)
+
+    def test_rhythm_preference(self):
+        more, _, _ = plan_segment_durations(30, 2, [4, 5], 4, max_segments=10, prefer_more_cuts=True)
+        fewer, _, _ = plan_segment_durations(30, 2, [4, 5], 4, max_segments=10, prefer_more_cuts=False)
+        self.assertGreater(more, fewer)
+
+    def test_infeasible_band_returns_closest_total(self):
+        # 两镜最多 10 秒，够不到 30±1：退而求其次给出最接近目标的组合
+        n, durations, total = plan_segment_durations(30, 1, [4, 5], 4, max_segments=2)
+        self.assertEqual((n, durations, total), (2, [5, 5], 10))
+        self._check_against_brute_force(30, 1, [4, 5], 1, 2, True)
+        # 只能凑奇偶受限的总时长：4 秒整数倍无法命中 30±1
+        n, durations, total = plan_segment_durations(30, 1, [4, 8], 4, max_segments=10)
+        self.assertEqual(abs(total - 30), 2)
+        self._check_against_brute_force(30, 1, [4, 8], 1, 10, True)
+
+    def test_invalid_parameters_raise(self):
+        with self.assertRaises(ValueError):
+            plan_segment_durations(30, 2, [4, 5], 4, max_segments=3, min_segments=5)
+        with self.assertRaises(ValueError):
+            plan_segment_durations(30, 2, [2, 3], 4)
+
+    def test_min_duration_filters_allowed(self):
+        _, durations, _ = plan_segment_durations(30, 2, [2, 3, 4, 5], 4)
+        self.assertTrue(all(d >= 4 for d in durations))
+
+    def test_lookup_matches_planner(self):
+        self.assertEqual(
+            lookup_duration_plan(60, 2, [3, 4, 5, 6, 8, 10], 3, 12, True, 1),
+            plan_segment_durations(60, 2, [3, 4, 5, 6, 8, 10], 3, 12, True, 1),
+        )
+
+    def test_snap_to_allowed_duration(self):
+        self.assertEqual(snap_to_allowed_duration(4.9, [4, 5], 4), 4)
+        self.assertEqual(snap_to_allowed_duration(7, [3, 6, 8, 10], 3), 6)
+        self.assertEqual(snap_to_allowed_duration(2, [3, 6], 3), 3)
+        self.assertEqual(snap_to_allowed_duration("bad", [3, 6], 3), 3)
+
+    def test_get_plan_format(self):
+        default = get_plan_format()
+        self.assertEqual(default["name"], "default")
+        self.assertEqual(default["allowed"], VIDEO_CONFIG.get("segment_duration_options", [4, 5]))
+        for fmt in VIDEO_CONFIG.get("plan_formats") or []:
+            resolved = get_plan_format(fmt["name"])
+            self.assertEqual(resolved["allowed"], fmt["allowed"])
+            # 规格未写的字段继承默认规格
+            self.assertIn("min_segments", resolved)
+        with self.assertRaises(ValueError):
+            get_plan_format("no-such-format")
+
+    def test_selected_format_reaches_planner_and_snapping(self):
+        from agents import ScriptDoctorAgent
+
+        agent = ScriptDoctorAgent({})
+        for fmt in VIDEO_CONFIG.get("plan_formats") or []:
+            fmt = get_plan_format(fmt["name"])
+            story_input = StoryInput(theme="t", summary="s", script_prompt="测试剧本", plan_format=fmt["name"])
+            request = agent._build_story_request(story_input)
+            durations = request["planned_durations"]
+            self.assertEqual(request["allowed_durations"], list(fmt["allowed"]))
+            self.assertTrue(all(d in fmt["allowed"] and d >= fmt["min_duration"] for d in durations), fmt["name"])
+            self.assertLessEqual(abs(sum(durations) - fmt["target"]), fmt["tolerance"], fmt["name"])
+            self.assertLessEqual(len(durations), fmt["max_segments"], fmt["name"])
+
+            # 解析分镜时按所选规格归一，规划中的 3/6/8/10 秒镜头不会被默认规格夹回 4/5
+            raw = {"segments": [{"visual_prompt": "v", "video_prompt": "p", "duration_sec": d} for d in durations]}
+            story = agent._story_from_raw(raw, request)
+            self.assertEqual([seg.duration_sec for seg in story.segments], durations, fmt["name"])
+
+    def test_fallback_story_keeps_format_durations(self):
+        from agents import ScriptDoctorAgent
+
+        agent = ScriptDoctorAgent({})
+        for fmt in VIDEO_CONFIG.get("plan_formats") or []:
+            for rhythm in ("manju", "movie"):
+                story_input = StoryInput(theme="t", summary="s", script_prompt="测试剧本",
+                                         rhythm_style=rhythm, plan_format=fmt["name"])
+                request = agent._build_story_request(story_input)
+                story = agent._create_fallback_story(
+                    story_input,
+                    style_key=request["style_key"],
+                    style_config=request["style_config"],
+                    desired_count=request["segment_count"],
+                    durations=request["planned_durations"],
+                    allowed_durations=request["allowed_durations"],
+                    min_duration_sec=request["min_duration"],
+                )
+                self.assertEqual([seg.duration_sec for seg in story.segments], request["planned_durations"],
+                                 (fmt["name"], rhythm))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+大模型 JSON 容错解析单元测试：代码块围栏、尾随说明、多余逗号、截断与单个元素损坏
+运行：python test_parse_llm_json.py
+"""
+
+import json
+import unittest
+
+from utils import parse_llm_json
+
+
+def storyboard(count=4):
+    return {
+        "overall_title": "怀表",
+        "plot_twist": "时间回溯的代价",
+        "segments": [
+            {"segment_number": i, "title": f"第{i}镜", "visual_prompt": "雨夜，小镇街道，{霓虹}倒影", "duration_sec": 5}
+            for i in range(1, count + 1)
+        ],
+    }
+
+
+class TestParseLlmJson(unittest.TestCase):
+
+    def setUp(self):
+        self.expected = storyboard()
+        self.text = json.dumps(self.expected, ensure_ascii=False, indent=2)
+
+    def test_plain_json(self):
+        self.assertEqual(parse_llm_json(self.text), (self.expected, []))
+
+    def test_fenced_json(self):
+        data, repairs = parse_llm_json(f"```json\n{self.text}\n```")
+        self.assertEqual(data, self.expected)
+        self.assertEqual(repairs, ["去除代码块围栏"])
+
+    def test_trailing_prose_with_code_block(self):
+        content = self.text + "\n\n说明：可以这样调用：\n```python\nrun({'a': 1})\n```"
+        data, repairs = parse_llm_json(content)
+        self.assertEqual(data, self.expected)
+        self.assertEqual(repairs, ["忽略 JSON 之后的多余文本"])
+
+    def test_leading_prose_then_fence(self):
+        data, _ = parse_llm_json(f"好的，以下是分镜：\n```json\n{self.text}\n```\n如需调整请告诉我。")
+        self.assertEqual(data, self.expected)
+
+    def test_trailing_commas(self):
+        content = self.text.replace('"duration_sec": 5\n', '"duration_sec": 5,\n')
+        data, repairs = parse_llm_json(content)
+        self.assertEqual(data, self.expected)
+        self.assertTrue(repairs[0].startswith("去除多余逗号"))
+
+    def test_truncated_output_keeps_complete_segments(self):
+        content = self.text[:self.text.rfind('"title"')]
+        data, repairs = parse_llm_json(content)
+        # 末尾不完整的分镜可能残留部分字段，由调用方按必填字段过滤后续写
+        self.assertEqual(data["segments"][:3], self.expected["segments"][:3])
+        self.assertLessEqual(len(data["segments"]), 4)
+        self.assertEqual(data["overall_title"], "怀表")
+        self.assertIn("截断", repairs[-1])
+
+    def test_one_malformed_segment_keeps_later_segments(self):
+        content = self.text.replace('"第2镜"', '"第2"镜"')
+        data, repairs = parse_llm_json(content)
+        self.assertEqual([s["segment_number"] for s in data["segments"]], [1, 3, 4])
+        self.assertEqual(data["plot_twist"], "时间回溯的代价")
+        self.assertIn("丢弃 1 个无效元素", repairs[-1])
+
+    def test_malformed_middle_of_three(self):
+        text = json.dumps(storyboard(3), ensure_ascii=False)
+        data, _ = parse_llm_json(text.replace('"第2镜"', '"第2"镜"'))
+        self.assertEqual([s["segment_number"] for s in data["segments"]], [1, 3])
+
+    def test_unrecoverable(self):
+        self.assertIsNone(parse_llm_json("抱歉，我无法完成这个请求。")[0])
+        self.assertIsNone(parse_llm_json("```\nno json\n```")[0])
+        self.assertIsNone(parse_llm_json("")[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
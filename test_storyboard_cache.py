@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+相似剧本缓存单元测试：检索、精确复用键、快照落盘与多进程并发写入
+运行：python test_storyboard_cache.py
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from config import AGENT_CONFIG
+from utils import StoryboardCache
+
+TEMPLATE = ("小镇少年{}在暴雨夜发现祖父留下的旧怀表，表盘每逆转一圈时间就倒退十分钟。"
+            "他试图用它阻止好友的车祸，却发现每次回溯都会让另一个人遭遇意外。")
+
+WORKER = """
+import sys
+sys.path.insert(0, {root!r})
+from utils import StoryboardCache
+cache = StoryboardCache({cache_dir!r})
+for i in range(15):
+    cache.add("worker {{}} 第{{}}集：猫和狗的冒险".format(sys.argv[1], i), {{"segments": [i]}}, {{"worker": sys.argv[1]}})
+"""
+
+
+class TestStoryboardCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self._saved_dir = AGENT_CONFIG["script_doctor"].get("storyboard_cache_dir")
+        AGENT_CONFIG["script_doctor"]["storyboard_cache_dir"] = self.cache_dir
+
+    def tearDown(self):
+        AGENT_CONFIG["script_doctor"]["storyboard_cache_dir"] = self._saved_dir
+        StoryboardCache._instance = None
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_query_ranks_most_similar_first(self):
+        cache = StoryboardCache(self.cache_dir)
+        cache.add(TEMPLATE.format("林远"), {"overall_title": "怀表"})
+        cache.add("太空站的清洁机器人爱上了一颗彗星，决定偷偷改变空间站轨道去追随它。", {"overall_title": "彗星"})
+        score, entry = cache.query(TEMPLATE.format("陈默"))[0]
+        self.assertEqual(cache.load_storyboard(entry), {"overall_title": "怀表"})
+        self.assertGreater(score, 0.5)
+        self.assertLess(score, 1.0)
+        self.assertEqual(cache.query(""), [])
+
+    def test_text_key_ignores_whitespace_and_case_only(self):
+        self.assertEqual(StoryboardCache.text_key(" Hello  世界\n"), StoryboardCache.text_key("hello世界"))
+        self.assertNotEqual(StoryboardCache.text_key(TEMPLATE.format("林远")),
+                            StoryboardCache.text_key(TEMPLATE.format("陈默")))
+
+    def test_snapshot_round_trip_and_dedup(self):
+        cache = StoryboardCache(self.cache_dir)
+        first = cache.add(TEMPLATE.format("林远"), {"v": 1}, {"style_key": "cinematic"})
+        again = cache.add(TEMPLATE.format("林远"), {"v": 2}, {"style_key": "cinematic"})
+        self.assertEqual(first, again)
+        reloaded = StoryboardCache(self.cache_dir)
+        self.assertEqual(len(reloaded.entries), 1)
+        self.assertEqual(reloaded.load_storyboard(reloaded.entries[0]), {"v": 2})
+        self.assertEqual(reloaded.entries[0]["text_key"], StoryboardCache.text_key(TEMPLATE.format("林远")))
+
+    def test_other_process_writes_are_visible(self):
+        reader = StoryboardCache(self.cache_dir)
+        StoryboardCache(self.cache_dir).add(TEMPLATE.format("林远"), {"v": 1})
+        self.assertEqual(len(reader.query(TEMPLATE.format("林远"))), 1)
+
+    def test_corrupt_snapshot_is_rebuilt_on_next_write(self):
+        StoryboardCache(self.cache_dir).add(TEMPLATE.format("林远"), {"v": 1})
+        with open(os.path.join(self.cache_dir, "index.npz"), "wb") as f:
+            f.write(b"not a snapshot")
+        cache = StoryboardCache(self.cache_dir)
+        self.assertEqual(cache.entries, [])
+        cache.add("新的剧本", {"v": 2})
+        self.assertEqual(len(StoryboardCache(self.cache_dir).entries), 1)
+
+    def test_concurrent_processes_keep_every_entry(self):
+        script = WORKER.format(root=os.path.dirname(os.path.abspath(__file__)), cache_dir=self.cache_dir)
+        workers = [subprocess.Popen([sys.executable, "-c", script, name]) for name in ("a", "b", "c")]
+        for worker in workers:
+            self.assertEqual(worker.wait(timeout=120), 0)
+        self.assertEqual(len(StoryboardCache(self.cache_dir).entries), 45)
+
+
+if __name__ == "__main__":
+    unittest.main()
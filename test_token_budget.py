@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+分镜请求 token 预算单元测试：内置规格不裁提示段、预算紧张时按优先级裁剪、上下文窗口约束
+运行：python test_token_budget.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from config import AGENT_CONFIG, VIDEO_CONFIG
+from models import StoryInput
+
+
+class TestTokenBudget(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # 规划表缓存写到临时目录，不污染输出目录
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls._saved_cache = VIDEO_CONFIG.get("plan_table_cache")
+        VIDEO_CONFIG["plan_table_cache"] = os.path.join(cls._tmp_dir, "plan_table.json")
+
+        from agents import ScriptDoctorAgent
+        cls.agent = ScriptDoctorAgent({})
+
+    @classmethod
+    def tearDownClass(cls):
+        VIDEO_CONFIG["plan_table_cache"] = cls._saved_cache
+        shutil.rmtree(cls._tmp_dir, ignore_errors=True)
+
+    def setUp(self):
+        self._saved_cfg = dict(AGENT_CONFIG["script_doctor"])
+
+    def tearDown(self):
+        AGENT_CONFIG["script_doctor"].clear()
+        AGENT_CONFIG["script_doctor"].update(self._saved_cfg)
+
+    @staticmethod
+    def sections():
+        # (内容, 优先级)：None 必留，数值小的先裁
+        return [
+            "必留-开头" + "甲" * 100,
+            ("可裁-优先级2" + "乙" * 100, 2),
+            ("可裁-优先级0" + "丙" * 100, 0),
+            "必留-格式" + "丁" * 100,
+            ("可裁-优先级1" + "戊" * 100, 1),
+        ]
+
+    def test_builtin_formats_keep_all_sections(self):
+        # 默认配置下，所有内置规格 × 节奏（含 90s 漫剧 20 镜）都不应裁掉任何提示段
+        for name in [None] + [fmt["name"] for fmt in VIDEO_CONFIG.get("plan_formats") or []]:
+            for rhythm in ("manju", "movie"):
+                story_input = StoryInput(theme="t", summary="s", script_prompt="测试剧本" * 50,
+                                         rhythm_style=rhythm, plan_format=name)
+                request = self.agent._build_story_request(story_input)
+                prompt = request["payload"]["messages"][0]["content"]
+                self.assertIn("【本次时长规划】", prompt, (name, rhythm))
+                self.assertIn("【节奏风格", prompt, (name, rhythm))
+
+    def test_trim_order_follows_priority(self):
+        cfg = AGENT_CONFIG["script_doctor"]
+        cfg["adaptive_max_tokens"] = True
+        cfg["context_window"] = 10 ** 6
+
+        cfg["prompt_token_budget"] = 10 ** 6
+        prompt, _, _ = self.agent._fit_token_budget(self.sections(), 1)
+        self.assertTrue(all(tag in prompt for tag in ("优先级0", "优先级1", "优先级2")))
+
+        # 每段约 110 token：预算只够 4 段时裁掉优先级 0，只够 3 段时再裁优先级 1
+        cfg["prompt_token_budget"] = 4 * 110
+        prompt, _, _ = self.agent._fit_token_budget(self.sections(), 1)
+        self.assertNotIn("优先级0", prompt)
+        self.assertIn("优先级1", prompt)
+        self.assertIn("优先级2", prompt)
+
+        cfg["prompt_token_budget"] = 3 * 110
+        prompt, _, _ = self.agent._fit_token_budget(self.sections(), 1)
+        self.assertNotIn("优先级0", prompt)
+        self.assertNotIn("优先级1", prompt)
+        self.assertIn("优先级2", prompt)
+
+        # 预算再小也不裁必留段，且剩余段保持原顺序
+        cfg["prompt_token_budget"] = 1
+        prompt, _, _ = self.agent._fit_token_budget(self.sections(), 1)
+        self.assertNotIn("优先级", prompt)
+        self.assertLess(prompt.index("必留-开头"), prompt.index("必留-格式"))
+
+    def test_context_window_limits_prompt(self):
+        cfg = AGENT_CONFIG["script_doctor"]
+        cfg["adaptive_max_tokens"] = True
+        cfg["prompt_token_budget"] = 10 ** 6
+        _, max_tokens, _ = self.agent._fit_token_budget(self.sections(), 20)
+
+        # 输入 + max_tokens 超出上下文窗口时同样按优先级裁剪
+        cfg["context_window"] = max_tokens + 4 * 110
+        prompt, same_max_tokens, _ = self.agent._fit_token_budget(self.sections(), 20)
+        self.assertEqual(same_max_tokens, max_tokens)
+        self.assertNotIn("优先级0", prompt)
+        self.assertIn("优先级1", prompt)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,10 +5,10 @@
 
 import os
 import json
-import urllib.request
+import re
+import sys
 import base64
 import io
-from PIL import Image, ImageDraw, ImageEnhance
 import shutil
 import urllib.parse
 import subprocess
@@ -16,8 +16,15 @@ import time
 from datetime import datetime
 import glob
 import textwrap
+import threading
+import collections
+import functools
+import itertools
+import hashlib
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
-from config import VOLC_CONFIG, VIDEO_CONFIG, NGINX_CONFIG
+from config import VOLC_CONFIG, VIDEO_CONFIG, NGINX_CONFIG, AGENT_CONFIG
 
 def call_volc_api(payload, api_type="chat", method="POST"):
     """调用火山引擎API - 完整实现"""
@@ -35,6 +42,9 @@ def call_volc_api(payload, api_type="chat", method="POST"):
         "Authorization": f"Bearer {VOLC_CONFIG['api_key']}"
     }
     
+    import urllib.request
+    import urllib.error
+
     for attempt in range(VIDEO_CONFIG["max_retries"]):
         try:
             data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
@@ -71,8 +81,397 @@ def call_volc_api(payload, api_type="chat", method="POST"):
     
     raise Exception("超过最大重试次数")
 
+def estimate_tokens(text):
+    """粗估 token 数：CJK 字符约 1 token/字，其余字符约 4 个/token（不依赖分词器）"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + -(-(len(text) - cjk) // 4)
+
+def log_token_usage(label, predicted_prompt, predicted_completion, max_tokens, result):
+    """对比预估与接口返回 usage 的 token 数；输出被 max_tokens 截断时提示"""
+    usage = (result or {}).get("usage") or {}
+    choice = ((result or {}).get("choices") or [{}])[0]
+    actual = (f"实际 输入 {usage.get('prompt_tokens', '?')} / 输出 {usage.get('completion_tokens', '?')}"
+              if usage else "接口未返回 usage")
+    reasoning = (usage.get("completion_tokens_details") or {}).get("reasoning_tokens")
+    if reasoning:
+        actual += f"（含推理 {reasoning}）"
+    print(f"  🧮 {label} token: 预估 输入≈{predicted_prompt} / 输出≈{predicted_completion}（max_tokens={max_tokens}），{actual}")
+    if choice.get("finish_reason") == "length":
+        print(f"  ⚠️ {label} 输出达到 max_tokens 被截断")
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+def _scan_json_structure(text):
+    """单遍扫描 JSON 文本（跳过字符串内部），返回 (可截断点列表, 结束时的括号栈, 是否停在字符串内)。
+
+    可截断点 = 刚闭合一个对象/数组之后、或元素间逗号之前：在此截断并补齐括号即得到合法前缀。
+    """
+    stack, safe_points = [], []
+    in_string = escape = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            safe_points.append((i + 1, tuple(stack)))
+            if not stack:
+                break
+        elif ch == "," and stack:
+            safe_points.append((i, tuple(stack)))
+    return safe_points, stack, in_string
+
+def _strip_trailing_commas(text):
+    """去掉 `}`/`]` 前多余的逗号（字符串内部不动），返回 (文本, 去掉的个数)"""
+    out, removed = [], 0
+    in_string = escape = False
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch in "}]":
+            j = len(out) - 1
+            while j >= 0 and out[j] in " \t\r\n":
+                j -= 1
+            if j >= 0 and out[j] == ",":
+                del out[j]
+                removed += 1
+        elif ch == '"':
+            in_string = True
+        out.append(ch)
+    return "".join(out), removed
+
+def _salvage_list_items(text, list_key, decoder):
+    """逐个恢复 list_key 数组中的合法元素与顶层字符串字段，返回 (data, 恢复数, 丢弃数, 损坏处之后是否仍有恢复)；
+    找不到数组时 data 为 None。
+
+    某个元素不合法（如多了一个引号）时跳到下一个 `},{` 元素边界继续，不连带丢弃其后的合法元素。
+    """
+    key_pos = text.find(f'"{list_key}"')
+    array_start = text.find("[", key_pos) if key_pos != -1 else -1
+    if array_start == -1:
+        return None, 0, 0, False
+    data = {}
+    for field in ("overall_title", "plot_twist"):
+        field_pos = text.find(f'"{field}"')
+        if field_pos != -1:
+            value_start = text.find('"', text.find(":", field_pos) + 1)
+            try:
+                data[field], _ = decoder.raw_decode(text, value_start)
+            except (json.JSONDecodeError, ValueError):
+                pass
+    items, dropped, resumed, pos = [], 0, False, array_start + 1
+    while True:
+        obj_start = text.find("{", pos)
+        if obj_start == -1:
+            break
+        safe_points, _, _ = _scan_json_structure(text[obj_start:])
+        closed = [p for p, open_stack in safe_points if not open_stack]
+        item = None
+        if closed:
+            raw_item = text[obj_start:obj_start + closed[0]]
+            for candidate in (raw_item, _strip_trailing_commas(raw_item)[0]):
+                try:
+                    item = json.loads(candidate)
+                    break
+                except json.JSONDecodeError:
+                    pass
+        if isinstance(item, dict):
+            items.append(item)
+            resumed = resumed or dropped > 0
+            pos = obj_start + closed[0]
+            continue
+        dropped += 1
+        boundary = re.compile(r"\}\s*,\s*\{").search(text, obj_start + 1)
+        if boundary is None:
+            break
+        pos = boundary.end() - 1
+    data[list_key] = items
+    return data, len(items), dropped, resumed
+
+def parse_llm_json(content, list_key="segments"):
+    """容错解析大模型返回的 JSON，返回 (data, repairs)；完全无法恢复时 data 为 None。
+
+    依次尝试：从第一个 `{` 起 raw_decode（忽略尾随说明文字，即使其中含花括号或代码块）
+    → 去掉 Markdown 代码块围栏（仅当围栏内含 `{`）→ 去掉多余逗号
+    → 逐个恢复 list_key 数组中的合法元素（数组中间有元素损坏时）/ 截断补齐（max_tokens 截断时丢弃末尾不完整
+    内容并补齐括号）。repairs 为中文描述的修复项，供日志输出。
+    """
+    repairs = []
+    text = (content or "").strip()
+    decoder = json.JSONDecoder()
+
+    def try_decode(candidate):
+        try:
+            data, end = decoder.raw_decode(candidate)
+        except json.JSONDecodeError:
+            return None, 0
+        return (data, end) if isinstance(data, dict) else (None, 0)
+
+    start = text.find("{")
+    if start != -1:
+        data, end = try_decode(text[start:])
+        if data is not None:
+            if text[:start].strip().startswith("```") and text[start + end:].strip() == "```":
+                repairs.append("去除代码块围栏")
+            elif text[start + end:].strip():
+                repairs.append("忽略 JSON 之后的多余文本")
+            return data, repairs
+
+    fence = text.find("```")
+    if fence != -1:
+        body_start = text.find("\n", fence)
+        body_end = text.find("```", body_start + 1) if body_start != -1 else -1
+        if body_start != -1:
+            body = text[body_start + 1:body_end if body_end != -1 else None].strip()
+            if "{" in body:
+                text = body
+                repairs.append("去除代码块围栏" if body_end != -1 else "去除未闭合的代码块围栏")
+
+    start = text.find("{")
+    if start == -1:
+        return None, repairs + ["未找到 JSON 对象"]
+    text = text[start:]
+
+    data, end = try_decode(text)
+    if data is not None:
+        if text[end:].strip():
+            repairs.append("忽略 JSON 之后的多余文本")
+        return data, repairs
+
+    original = text
+    text, removed = _strip_trailing_commas(text)
+    if removed:
+        repairs.append(f"去除多余逗号 {removed} 处")
+        data, end = try_decode(text)
+        if data is not None:
+            return data, repairs
+
+    # 先逐个恢复数组元素：损坏元素之后仍能恢复出合法元素，说明是中间某个元素损坏而非截断，
+    # 此时按截断处理会丢掉其后所有合法元素
+    salvaged, kept, dropped, resumed = _salvage_list_items(original, list_key, decoder)
+
+    safe_points, stack, in_string = _scan_json_structure(text)
+    if (stack or in_string) and not resumed:
+        for cut, open_stack in reversed(safe_points):
+            if not open_stack:
+                break
+            candidate = text[:cut].rstrip().rstrip(",") + "".join(_CLOSERS[c] for c in reversed(open_stack))
+            data, _ = try_decode(candidate)
+            if data is not None:
+                repairs.append(f"JSON 被截断，丢弃末尾不完整内容并补齐 {len(open_stack)} 层括号")
+                return data, repairs
+
+    if salvaged is None:
+        return None, repairs + ["JSON 无法修复"]
+    repairs.append(f"逐个恢复 {list_key}: 保留 {kept} 个" + (f"，丢弃 {dropped} 个无效元素" if dropped else ""))
+    return salvaged, repairs
+
+def _storyboard_cache_dir():
+    return (AGENT_CONFIG["script_doctor"].get("storyboard_cache_dir")
+            or os.path.join(VIDEO_CONFIG["output_dir"], ".cache", "storyboards"))
+
+class StoryboardCache:
+    """相似剧本缓存：历史提示词的哈希字符 n-gram TF-IDF + NumPy 倒排索引，纯本地、毫秒级检索。
+
+    目录结构：index.npz（条目列表与按条存的特征/词频，整体原子替换）、boards/<id>.json（分镜）、.lock（写锁）。
+    多进程写入时持文件锁、先重读磁盘快照再追加，条目与索引始终成对落盘；其他进程写入后查询会自动重读。
+    需要 NumPy；缺失时构造抛 ImportError，由调用方降级为不使用缓存。
+    """
+
+    NGRAM_SIZES = (2, 3)
+    FEATURE_BITS = 20
+    SNAPSHOT_VERSION = 2
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        with cls._instance_lock:
+            if cls._instance is None or cls._instance.cache_dir != _storyboard_cache_dir():
+                cls._instance = cls(_storyboard_cache_dir())
+            return cls._instance
+
+    def __init__(self, cache_dir):
+        import numpy as np
+
+        self._np = np
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self.entries = []
+        self._doc_ptr = np.zeros(1, dtype=np.int64)
+        self._feats = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0, dtype=np.float32)
+        self._inverted = None  # 懒构建：(按特征排序的特征, 文档号, 权重, 文档范数)
+        self._snapshot_sig = None
+        self._load()
+
+    @staticmethod
+    def normalize_text(text):
+        """检索与去重用的归一化文本：去掉全部空白并转小写"""
+        return "".join((text or "").lower().split())
+
+    @classmethod
+    def text_key(cls, text):
+        """归一化后完全相同的提示词得到相同的键（reuse 模式只复用键一致的条目）"""
+        return hashlib.sha1(cls.normalize_text(text).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _features(cls, text):
+        """归一化文本后取 2/3 字 n-gram，哈希到 2^FEATURE_BITS 维，返回 {特征: 次数}"""
+        text = cls.normalize_text(text)
+        mask = (1 << cls.FEATURE_BITS) - 1
+        counts = collections.Counter()
+        for n in cls.NGRAM_SIZES:
+            for i in range(len(text) - n + 1):
+                counts[zlib.crc32(text[i:i + n].encode("utf-8")) & mask] += 1
+        return counts
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.cache_dir, "index.npz")
+
+    def _snapshot_signature(self):
+        try:
+            stat = os.stat(self._index_path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _load(self):
+        """读取磁盘快照（条目与索引在同一个 npz 中）；文件未变时不重复读取"""
+        np = self._np
+        signature = self._snapshot_signature()
+        if signature is None or signature == self._snapshot_sig:
+            return
+        try:
+            with np.load(self._index_path) as data:
+                if int(data["version"]) != self.SNAPSHOT_VERSION:
+                    raise ValueError(f"快照版本 {int(data['version'])} 与当前版本 {self.SNAPSHOT_VERSION} 不一致")
+                entries = json.loads(str(data["entries"]))
+                doc_ptr, feats, counts = data["doc_ptr"], data["feats"], data["counts"]
+            if len(doc_ptr) != len(entries) + 1 or int(doc_ptr[-1]) != len(feats):
+                raise ValueError("索引与条目数量不一致")
+            self.entries, self._doc_ptr, self._feats, self._counts = entries, doc_ptr, feats, counts
+            self._inverted = None
+        except Exception as e:
+            print(f"⚠️ 相似剧本缓存读取失败，下次写入时重建: {e}")
+        self._snapshot_sig = signature
+
+    def _lock_file(self):
+        """跨进程写锁（POSIX flock）；平台不支持时只有进程内锁"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        handle = open(os.path.join(self.cache_dir, ".lock"), "a")
+        try:
+            import fcntl
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+        return handle
+
+    def _build_inverted(self):
+        """按特征排序得到倒排表；TF 取 1+log(tf)，IDF 取平滑 log，文档向量 L2 归一"""
+        np = self._np
+        n_docs = len(self.entries)
+        doc_ids = np.repeat(np.arange(n_docs, dtype=np.int64), np.diff(self._doc_ptr))
+        df = np.bincount(self._feats, minlength=1 << self.FEATURE_BITS).astype(np.float32)
+        idf = np.log((1.0 + n_docs) / (1.0 + df)) + 1.0
+        weights = (1.0 + np.log(self._counts)) * idf[self._feats]
+        norms = np.sqrt(np.bincount(doc_ids, weights=weights * weights, minlength=n_docs))
+        order = np.argsort(self._feats, kind="stable")
+        self._inverted = (self._feats[order], doc_ids[order], weights[order] / np.maximum(norms[doc_ids[order]], 1e-9),
+                          idf)
+
+    def query(self, text, top_k=1):
+        """返回最相似的历史条目 [(余弦相似度, 条目)]，按相似度降序"""
+        np = self._np
+        with self._lock:
+            self._load()
+            if not self.entries:
+                return []
+            if self._inverted is None:
+                self._build_inverted()
+            sorted_feats, doc_ids, weights, idf = self._inverted
+            query = self._features(text)
+            if not query:
+                return []
+            q_feats = np.fromiter(query.keys(), dtype=np.int64, count=len(query))
+            q_weights = (1.0 + np.log(np.fromiter(query.values(), dtype=np.float32, count=len(query)))) * idf[q_feats]
+            q_weights /= max(float(np.sqrt((q_weights * q_weights).sum())), 1e-9)
+
+            starts = np.searchsorted(sorted_feats, q_feats, side="left")
+            ends = np.searchsorted(sorted_feats, q_feats, side="right")
+            lengths = ends - starts
+            if not lengths.sum():
+                return []
+            # 拼接各查询特征的倒排区间，一次 bincount 累加出全部文档得分
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            scores = np.bincount(doc_ids[positions], weights=weights[positions] * np.repeat(q_weights, lengths),
+                                 minlength=len(self.entries))
+            best = np.argsort(-scores)[:top_k]
+            return [(float(scores[i]), self.entries[i]) for i in best if scores[i] > 0]
+
+    def load_storyboard(self, entry):
+        with open(os.path.join(self.cache_dir, "boards", f"{entry['id']}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def add(self, text, storyboard, meta=None):
+        """登记一条提示词及其分镜；与已有条目完全相同（文本+规划信息）时只更新分镜"""
+        np = self._np
+        meta = meta or {}
+        entry_id = hashlib.sha1(json.dumps([text, meta], sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+        os.makedirs(os.path.join(self.cache_dir, "boards"), exist_ok=True)
+        with open(os.path.join(self.cache_dir, "boards", f"{entry_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(storyboard, f, ensure_ascii=False)
+
+        with self._lock:
+            lock_handle = self._lock_file()
+            try:
+                # 持锁后先合并其他进程已写入的条目，再追加并整体原子替换快照
+                self._load()
+                if any(e["id"] == entry_id for e in self.entries):
+                    return entry_id
+                features = self._features(text)
+                entry = {"id": entry_id, "prompt": text[:200], "text_key": self.text_key(text), "meta": meta,
+                         "created_at": datetime.now().isoformat(timespec="seconds")}
+                entries = self.entries + [entry]
+                feats = np.concatenate([self._feats, np.fromiter(features.keys(), dtype=np.int64)])
+                counts = np.concatenate([self._counts, np.fromiter(features.values(), dtype=np.float32)])
+                doc_ptr = np.append(self._doc_ptr, len(feats))
+                tmp_path = os.path.join(self.cache_dir, f"index.{os.getpid()}.tmp.npz")
+                np.savez(tmp_path, version=self.SNAPSHOT_VERSION, entries=json.dumps(entries, ensure_ascii=False),
+                         doc_ptr=doc_ptr, feats=feats, counts=counts)
+                os.replace(tmp_path, self._index_path)
+                self.entries, self._feats, self._counts, self._doc_ptr = entries, feats, counts, doc_ptr
+                self._inverted = None
+                self._snapshot_sig = self._snapshot_signature()
+            finally:
+                lock_handle.close()
+        return entry_id
+
 def compress_image_to_target(image_path, target_size_kb=512):
     """将图片压缩到指定大小（KB）以内 - 完整实现"""
+    from PIL import Image
+
     print(f"  📦📦 压缩图片到{target_size_kb}KB以内...")
     
     try:
@@ -170,6 +569,88 @@ def compress_image_to_target(image_path, target_size_kb=512):
     
     return final_path
 
+def compress_image_bytes_to_target(image_bytes, target_size_kb=512):
+    """内存版压缩：输入图片字节，返回 (字节, 扩展名)，全程不落盘。
+
+    主要用于尾帧续接：ffmpeg 经 stdout 输出的 JPEG 直接压缩后发布。
+    """
+    from PIL import Image
+
+    original_size_kb = len(image_bytes) / 1024
+    img = Image.open(io.BytesIO(image_bytes))
+    file_ext = ".png" if img.format == "PNG" else ".jpg"
+
+    if original_size_kb <= target_size_kb:
+        return image_bytes, file_ext
+
+    print(f"  📦📦 内存压缩图片到{target_size_kb}KB以内 (原始 {original_size_kb:.1f}KB)...")
+
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    quality = 85
+    while quality >= 30:
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', optimize=True, quality=quality)
+        if buffer.tell() / 1024 <= target_size_kb:
+            print(f"    ✅ JPEG压缩完成: {original_size_kb:.1f}KB → {buffer.tell() / 1024:.1f}KB (质量{quality}%)")
+            return buffer.getvalue(), ".jpg"
+        quality -= 10
+
+    scale_factor = (target_size_kb / original_size_kb) ** 0.5
+    scale_factor = min(max(scale_factor, 0.3), 0.9)
+    new_width = max(int(img.width * scale_factor), 1024)
+    new_height = max(int(img.height * scale_factor), 1024)
+
+    buffer = io.BytesIO()
+    img.resize((new_width, new_height), Image.Resampling.LANCZOS).save(
+        buffer, format='JPEG', optimize=True, quality=75
+    )
+    print(f"    ✅ 尺寸调整完成: {buffer.tell() / 1024:.1f}KB")
+    return buffer.getvalue(), ".jpg"
+
+def deploy_image_bytes_to_nginx(image_bytes, story_title):
+    """将内存中的图片字节压缩后直接写入Nginx目录（省去中间文件的读写）"""
+    print("🌐🌐 部署图片到Nginx (内存直传)...")
+
+    payload, file_ext = compress_image_bytes_to_target(image_bytes, target_size_kb=512)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"comic_{timestamp}{file_ext}"
+    target_path = os.path.join(NGINX_CONFIG["local_image_dir"], filename)
+
+    try:
+        with open(target_path, 'wb') as f:
+            f.write(payload)
+        os.chmod(target_path, 0o644)
+
+        safe_filename = urllib.parse.quote(filename)
+        image_url = f"{NGINX_CONFIG['server_url']}/{NGINX_CONFIG['sub_path']}/{safe_filename}"
+        file_size = len(payload) / 1024
+
+        print(f"  ✅ 部署成功")
+        print(f"     📁📁 路径: {target_path}")
+        print(f"     🌐🌐 URL: {image_url}")
+        print(f"     📦📦 大小: {file_size:.1f} KB")
+
+        return {
+            "local_path": None,
+            "compressed_path": None,
+            "nginx_path": target_path,
+            "public_url": image_url,
+            "filename": filename,
+            "file_size_kb": file_size,
+            "is_compressed": payload is not image_bytes
+        }
+
+    except PermissionError as e:
+        print(f"  ❌❌ 权限错误: {e}")
+        print(f"  请运行: sudo chown -R $USER:$USER {NGINX_CONFIG['local_image_dir']}")
+        raise
+    except Exception as e:
+        print(f"  ❌❌ 部署失败: {e}")
+        raise
+
 def deploy_to_nginx(image_path, story_title):
     """部署图片到Nginx服务器 - 完整实现"""
     print("🌐🌐 部署图片到Nginx...")
@@ -222,53 +703,604 @@ def deploy_to_nginx(image_path, story_title):
         print(f"  ❌❌ 部署失败: {e}")
         raise
 
-def extract_last_frame(video_path, output_image_path):
-    """使用FFmpeg提取视频的最后一帧 - 完整实现"""
-    print(f"  🎞🎞🎞️  提取尾帧: {os.path.basename(video_path)}")
-    
+def split_jpeg_stream(data):
+    """把 image2pipe/mjpeg 输出的连续JPEG字节流切分为单帧列表（末尾不完整的帧丢弃）"""
+    frames = []
+    pos = 0
+    while True:
+        start = data.find(b'\xff\xd8', pos)
+        if start == -1:
+            break
+        end = data.find(b'\xff\xd9', start + 2)
+        if end == -1:
+            break
+        frames.append(data[start:end + 2])
+        pos = end + 2
+    return frames
+
+def score_frame_batch(gray_batch):
+    """批量评估帧质量（向量化）：拉普拉斯方差衡量清晰度，亮度均值/过曝欠曝比例衡量曝光。
+
+    gray_batch: 形状 (N, H, W) 的灰度数组；返回形状 (N,) 的评分，越大越好。
+    """
+    import numpy as np
+
+    x = np.asarray(gray_batch, dtype=np.float32)
+    lap = (x[:, :-2, 1:-1] + x[:, 2:, 1:-1] + x[:, 1:-1, :-2] + x[:, 1:-1, 2:]
+           - 4.0 * x[:, 1:-1, 1:-1])
+    sharpness = lap.var(axis=(1, 2))
+
+    mean_luma = x.mean(axis=(1, 2)) / 255.0
+    clipped = ((x < 8) | (x > 247)).mean(axis=(1, 2))
+    exposure = np.clip(1.0 - np.abs(mean_luma - 0.5) - clipped, 0.0, 1.0)
+
+    peak = float(sharpness.max()) if sharpness.size else 0.0
+    sharpness_norm = sharpness / peak if peak > 0 else np.ones_like(sharpness)
+    return sharpness_norm * (0.5 + 0.5 * exposure)
+
+def select_sharpest_frame(jpeg_frames):
+    """从若干JPEG帧中选出最清晰且曝光正常的一帧，返回 (字节, 下标)。
+
+    评分相同或缺少 OpenCV/NumPy 时取最后一帧（最贴近镜头结尾，续接最自然）。
+    """
+    if not jpeg_frames:
+        return None, -1
+    if len(jpeg_frames) == 1:
+        return jpeg_frames[0], 0
+
     try:
-        # 获取视频时长
-        cmd_duration = [
-            'ffprobe', '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'csv=p=0',
-            video_path
-        ]
-        
-        result = subprocess.run(cmd_duration, capture_output=True, text=True, timeout=10)
+        import cv2
+        import numpy as np
+    except ImportError:
+        return jpeg_frames[-1], len(jpeg_frames) - 1
+
+    grays = [
+        cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        for frame in jpeg_frames
+    ]
+    valid = [i for i, g in enumerate(grays) if g is not None]
+    if not valid:
+        return jpeg_frames[-1], len(jpeg_frames) - 1
+
+    shape = grays[valid[0]].shape
+    valid = [i for i in valid if grays[i].shape == shape]
+    scores = score_frame_batch(np.stack([grays[i] for i in valid]))
+    # 轻微偏向更靠后的帧：清晰度接近时优先续接点更准确的那一帧
+    recency = 1.0 - 0.02 * (len(valid) - 1 - np.arange(len(valid)))
+    best = valid[int(np.argmax(scores * recency))]
+    print(f"     🔍 尾帧候选 {len(jpeg_frames)} 帧，选中倒数第{len(jpeg_frames) - best}帧 "
+          f"(评分 {', '.join(f'{v:.2f}' for v in scores)})")
+    return jpeg_frames[best], best
+
+def load_gray_images(images, max_side=640):
+    """批量读取图片为灰度并等比缩放到 max_side 以内；images 元素可为路径或图片字节。读取失败的位置为 None。"""
+    import cv2
+    import numpy as np
+
+    grays = []
+    for item in images:
+        if isinstance(item, (bytes, bytearray)):
+            gray = cv2.imdecode(np.frombuffer(item, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        else:
+            gray = cv2.imread(str(item), cv2.IMREAD_GRAYSCALE)
+        if gray is not None and max(gray.shape) > max_side:
+            scale = max_side / float(max(gray.shape))
+            gray = cv2.resize(gray, (int(gray.shape[1] * scale), int(gray.shape[0] * scale)),
+                              interpolation=cv2.INTER_AREA)
+        grays.append(gray)
+    return grays
+
+def _text_line_members(boxes):
+    """向量化判断候选字符框是否成行：高度相近、中心线对齐、水平间距小的邻居≥1个即视为文字行成员"""
+    import numpy as np
+
+    x, y, w, h = (boxes[:, i].astype(np.float32) for i in range(4))
+    yc = y + h / 2.0
+    # 两两比较 (K, K)
+    h_min = np.minimum(h[:, None], h[None, :])
+    h_ratio = np.maximum(h[:, None], h[None, :]) / np.maximum(h_min, 1.0)
+    y_aligned = np.abs(yc[:, None] - yc[None, :]) < 0.35 * h_min
+    gap = np.maximum(x[None, :] - (x + w)[:, None], x[:, None] - (x + w)[None, :])
+    close = (gap > -0.1 * h_min) & (gap < 1.5 * h_min)
+    neighbors = (h_ratio < 1.5) & y_aligned & close
+    np.fill_diagonal(neighbors, False)
+    return int(neighbors.any(axis=1).sum())
+
+def text_likelihood_batch(images, max_side=640):
+    """离线估计一批图片（路径或字节）含有文字（字幕/招牌/水印等）的可能性，返回 0~1 分数列表"""
+    return text_likelihood_grays(load_gray_images(images, max_side=max_side))
+
+def text_likelihood_grays(grays):
+    """同 text_likelihood_batch，输入为已解码缩放的灰度图（load_gray_images 的结果），避免重复解码。
+
+    基于 OpenCV MSER 提取稳定区域，按字符几何特征（尺寸、宽高比、填充率）与边缘密度
+    （积分图一次性求所有候选框的梯度均值）筛选，再用两两矩阵运算找出成行排列的字符框；
+    成行字符、整词连通块越多分数越高。读取失败的图片记为 0。
+    """
+    import cv2
+    import numpy as np
+
+    mser = cv2.MSER_create(5, 12, 6000, 0.5)  # delta, min_area, max_area, max_variation
+
+    scores = []
+    for gray in grays:
+        if gray is None:
+            scores.append(0.0)
+            continue
+
+        img_h = gray.shape[0]
+        regions, boxes = mser.detectRegions(gray)
+        if len(boxes) == 0:
+            scores.append(0.0)
+            continue
+
+        grad = np.abs(cv2.Sobel(gray, cv2.CV_32F, 1, 0)) + np.abs(cv2.Sobel(gray, cv2.CV_32F, 0, 1))
+        integral = cv2.integral(grad)
+
+        boxes = np.asarray(boxes, dtype=np.int32)
+        x, y, w, h = boxes.T
+        area = np.maximum(w * h, 1).astype(np.float32)
+        pixel_counts = np.fromiter((len(r) for r in regions), dtype=np.float32, count=len(regions))
+        fill = pixel_counts / area
+        edge_density = (integral[y + h, x + w] - integral[y, x + w] - integral[y + h, x] + integral[y, x]) / area
+        aspect = w / np.maximum(h, 1).astype(np.float32)
+
+        base = (
+            (h >= 0.012 * img_h) & (h <= 0.15 * img_h)
+            & (fill >= 0.15) & (fill <= 0.95)
+            # 文字笔画边缘明显强于画面平均纹理；高频纹理（草地/噪点）整体梯度高，阈值随之抬升
+            & (edge_density >= max(90.0, 2.5 * float(grad.mean())))
+        )
+        char_like = base & (aspect >= 0.1) & (aspect <= 2.5)
+        word_like = base & (aspect > 2.5) & (aspect <= 12.0)
+
+        candidates = np.unique(boxes[char_like] // 2 * 2, axis=0)  # 合并 MSER 嵌套产生的近似重复框
+        if len(candidates) > 600:
+            candidates = candidates[np.argsort(-candidates[:, 3])[:600]]
+        members = _text_line_members(candidates) if len(candidates) >= 2 else 0
+        words = len(np.unique(boxes[word_like] // 4 * 4, axis=0))
+
+        scores.append(float(1.0 - np.exp(-(members + 2 * words) / 4.0)))
+    return scores
+
+def score_image_variants(images, max_side=640):
+    """批量评估候选首帧：清晰度/曝光（score_frame_batch）与无字检测分数合成 quality_score。
+
+    返回与输入等长的字典列表：{"quality": 0~1, "text_score": 0~1, "quality_score": 0~10}；
+    quality 为批内相对值，仅用于同批候选之间比较。
+    """
+    import cv2
+    import numpy as np
+
+    grays = load_gray_images(images, max_side=max_side)
+    valid = [i for i, g in enumerate(grays) if g is not None]
+    quality = [0.0] * len(grays)
+    if valid:
+        shape = grays[valid[0]].shape
+        batch = np.stack([
+            grays[i] if grays[i].shape == shape else cv2.resize(grays[i], (shape[1], shape[0]))
+            for i in valid
+        ])
+        for i, q in zip(valid, score_frame_batch(batch)):
+            quality[i] = float(q)
+
+    text_scores = text_likelihood_grays(grays)
+    return [
+        {
+            "quality": q,
+            "text_score": t,
+            "quality_score": round(10.0 * q * (1.0 - t), 2),
+        }
+        for q, t in zip(quality, text_scores)
+    ]
+
+# 无字检测门限缺省值：生成时的门限与 evaluate_text_detector 评估的门限必须一致
+DEFAULT_NO_TEXT_THRESHOLD = 0.35
+
+def no_text_threshold():
+    """当前生效的无字检测门限（VIDEO_CONFIG["no_text_threshold"]，缺省 DEFAULT_NO_TEXT_THRESHOLD）"""
+    return float(VIDEO_CONFIG.get("no_text_threshold", DEFAULT_NO_TEXT_THRESHOLD))
+
+def evaluate_text_detector(clean_images, text_images, threshold=None):
+    """在标注样本上评估无字检测器：返回误报率（无字图被判有字）、漏报率与单张平均耗时"""
+    if threshold is None:
+        threshold = no_text_threshold()
+
+    start = time.time()
+    clean_scores = text_likelihood_batch(clean_images) if clean_images else []
+    text_scores = text_likelihood_batch(text_images) if text_images else []
+    elapsed = time.time() - start
+    total = len(clean_scores) + len(text_scores)
+
+    false_positive = sum(1 for s in clean_scores if s > threshold)
+    false_negative = sum(1 for s in text_scores if s <= threshold)
+    return {
+        "threshold": threshold,
+        "clean_count": len(clean_scores),
+        "text_count": len(text_scores),
+        "false_positive_rate": false_positive / len(clean_scores) if clean_scores else 0.0,
+        "false_negative_rate": false_negative / len(text_scores) if text_scores else 0.0,
+        "avg_latency_ms": elapsed * 1000 / total if total else 0.0,
+    }
+
+class FFmpegProcessManager:
+    """ffmpeg/ffprobe 进程统一调度（进程内单例）。
+
+    - ffmpeg 编码类命令受信号量限制并发数（VIDEO_CONFIG["max_concurrent_encodes"]），ffprobe 不占名额
+    - stream copy/抽帧/-f null 分析等轻量命令走独立的 light 名额（max_concurrent_light_jobs），不与编码抢占
+    - active 以自增任务号为键（label 可重名，如多条输出到 pipe:1 的命令），值含 label/类别/进度指标
+    - 每条命令都有超时，超时直接 kill 进程并抛出 subprocess.TimeoutExpired
+    - progress=True 时注入 -progress pipe:1 -nostats，实时解析 fps/speed/已输出时长
+    - spawn()/release() 托管需要流式读写 stdin/stdout 的长驻进程（如边下边解尾帧），同样占名额、计入 active、超时 kill
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_concurrent=None, default_timeout=None):
+        if max_concurrent is None:
+            max_concurrent = VIDEO_CONFIG.get("max_concurrent_encodes") or max(1, (os.cpu_count() or 2) // 2)
+        self.max_concurrent = int(max_concurrent)
+        self.default_timeout = float(default_timeout or VIDEO_CONFIG.get("ffmpeg_timeout_sec", 600))
+        self.max_light = int(VIDEO_CONFIG.get("max_concurrent_light_jobs") or max(2, os.cpu_count() or 2))
+        self._slots = {
+            "encode": threading.BoundedSemaphore(self.max_concurrent),
+            "light": threading.BoundedSemaphore(self.max_light),
+        }
+        self._lock = threading.Lock()
+        self._spawned = {}
+        self._job_ids = itertools.count(1)
+        self.active = {}
+        self.stats = {"runs": 0, "light_runs": 0, "timeouts": 0, "failures": 0, "busy_sec": 0.0}
+
+    @classmethod
+    def get(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @staticmethod
+    def parse_progress_block(lines):
+        """解析一组 -progress 输出（key=value 行）为指标字典"""
+        raw = dict(line.split("=", 1) for line in lines if "=" in line)
+
+        def as_float(value):
+            try:
+                return float(str(value).rstrip("x"))
+            except (TypeError, ValueError):
+                return None
+
+        out_time_us = raw.get("out_time_us") or raw.get("out_time_ms")  # 两者单位均为微秒
+        out_time = as_float(out_time_us)
+        return {
+            "frame": int(as_float(raw.get("frame")) or 0),
+            "fps": as_float(raw.get("fps")),
+            "speed": as_float(raw.get("speed")),
+            "out_time_sec": out_time / 1_000_000 if out_time is not None else None,
+            "progress": raw.get("progress"),
+        }
+
+    @staticmethod
+    def classify(cmd):
+        """命令类别：ffprobe 为 None；stream copy/抽帧/-f null 分析为 light；其余 ffmpeg 为 encode"""
+        if not os.path.basename(cmd[0]).startswith("ffmpeg"):
+            return None
+        args = list(cmd[1:])
+        pairs = set(zip(args, args[1:]))
+        copies = any(flag in ("-c", "-c:v", "-vcodec", "-codec") and value == "copy" for flag, value in pairs)
+        filtered = any(arg in ("-vf", "-filter:v", "-filter_complex") for arg in args)
+        if ("-f", "null") in pairs:
+            return "light"
+        if not filtered and (copies or ("-frames:v", "1") in pairs or ("-f", "image2pipe") in pairs):
+            return "light"
+        return "encode"
+
+    def run(self, cmd, timeout=None, text=True, progress=False, label=None, on_progress=None, job_class=None):
+        """同步执行一条命令，返回 subprocess.CompletedProcess；超时 kill 后抛出 TimeoutExpired
+
+        job_class: "encode" | "light"，None 时按命令自动判定（见 classify）
+        """
+        timeout = timeout or self.default_timeout
+        job_class = job_class or self.classify(cmd)
+        progress = progress and job_class is not None
+        if progress:
+            cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+        label = label or os.path.basename(cmd[-1])
+
+        slots = self._slots.get(job_class)
+        if slots:
+            slots.acquire()
+        started = time.time()
+        with self._lock:
+            job_id = next(self._job_ids)
+            if job_class:
+                self.active[job_id] = {"label": label, "job_class": job_class, "started": started}
+        try:
+            if progress:
+                result = self._run_with_progress(cmd, timeout, text, label, on_progress, job_id)
+            else:
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text)
+                try:
+                    stdout, stderr = proc.communicate(timeout=timeout)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.communicate()
+                    with self._lock:
+                        self.stats["timeouts"] += 1
+                    print(f"  ⏰ ffmpeg 超时（>{timeout:.0f}s）已终止: {label}")
+                    raise
+                result = subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+        finally:
+            if slots:
+                slots.release()
+            with self._lock:
+                self.stats["runs"] += 1
+                self.stats["light_runs"] += job_class == "light"
+                self.stats["busy_sec"] += time.time() - started
+                self.active.pop(job_id, None)
+
         if result.returncode != 0:
-            raise Exception(f"获取视频时长失败: {result.stderr}")
-        
-        duration = float(result.stdout.strip())
-        
-        # 提取最后一帧（在结束前0.1秒）
-        seek_time = max(0, duration - 0.1)
-        
+            with self._lock:
+                self.stats["failures"] += 1
+        return result
+
+    def _run_with_progress(self, cmd, timeout, text, label, on_progress, job_id):
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        stderr_chunks = []
+        stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+        stderr_reader.start()
+        timed_out = threading.Event()
+
+        def _kill():
+            timed_out.set()
+            proc.kill()
+
+        watchdog = threading.Timer(timeout, _kill)
+        watchdog.start()
+        block, last_print = [], 0.0
+        try:
+            for line in proc.stdout:
+                line = line.strip()
+                block.append(line)
+                if not line.startswith("progress="):
+                    continue
+                metrics = self.parse_progress_block(block)
+                block = []
+                with self._lock:
+                    if job_id in self.active:
+                        self.active[job_id].update(metrics)
+                if on_progress:
+                    on_progress(metrics)
+                if time.time() - last_print >= 2 or metrics["progress"] == "end":
+                    last_print = time.time()
+                    print(f"  ⏱️ {label}: 已输出 {metrics['out_time_sec'] or 0:.1f}s"
+                          f"  fps={metrics['fps'] or 0:.1f}  speed={metrics['speed'] or 0:.2f}x")
+            proc.wait()
+        finally:
+            watchdog.cancel()
+            stderr_reader.join(timeout=5)
+
+        if timed_out.is_set():
+            with self._lock:
+                self.stats["timeouts"] += 1
+            print(f"  ⏰ ffmpeg 超时（>{timeout:.0f}s）已终止: {label}")
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        stderr = "".join(stderr_chunks)
+        return subprocess.CompletedProcess(cmd, proc.returncode, "", stderr if text else stderr.encode())
+
+    def spawn(self, cmd, label=None, job_class="light", timeout=None, blocking=True, **popen_kwargs):
+        """启动由调用方读写管道的长驻进程，返回 (job_id, Popen)；用完（含异常路径）必须调用 release(job_id)。
+
+        占用 job_class 名额并登记到 active，超时由看门狗 kill；blocking=False 且名额已满时返回 None
+        """
+        timeout = timeout or self.default_timeout
+        label = label or os.path.basename(cmd[-1])
+        slots = self._slots.get(job_class)
+        if slots and not slots.acquire(blocking=blocking):
+            return None
+        try:
+            proc = subprocess.Popen(cmd, **popen_kwargs)
+        except Exception:
+            if slots:
+                slots.release()
+            raise
+
+        def _kill():
+            if proc.poll() is None:
+                proc.kill()
+                with self._lock:
+                    self.stats["timeouts"] += 1
+                print(f"  ⏰ ffmpeg 超时（>{timeout:.0f}s）已终止: {label}")
+
+        watchdog = threading.Timer(timeout, _kill)
+        watchdog.daemon = True
+        started = time.time()
+        with self._lock:
+            job_id = next(self._job_ids)
+            self.active[job_id] = {"label": label, "job_class": job_class, "started": started}
+            self._spawned[job_id] = (proc, slots, watchdog, job_class, started)
+        watchdog.start()
+        return job_id, proc
+
+    def release(self, job_id):
+        """归还 spawn() 占用的名额（可重复调用）；进程仍在运行时先 kill"""
+        with self._lock:
+            entry = self._spawned.pop(job_id, None)
+            self.active.pop(job_id, None)
+        if entry is None:
+            return
+        proc, slots, watchdog, job_class, started = entry
+        watchdog.cancel()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        if slots:
+            slots.release()
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["light_runs"] += job_class == "light"
+            self.stats["busy_sec"] += time.time() - started
+            if proc.returncode != 0:
+                self.stats["failures"] += 1
+
+def run_ffmpeg(cmd, timeout=None, text=True, progress=False, label=None, job_class=None):
+    """经进程管理器执行 ffmpeg/ffprobe 命令（按 encode/light 分别限并发 + 超时 kill）"""
+    return FFmpegProcessManager.get().run(cmd, timeout=timeout, text=text, progress=progress, label=label,
+                                          job_class=job_class)
+
+def extract_last_frame_bytes(video_path, candidates=None, window_sec=None):
+    """单次ffmpeg调用提取尾帧，JPEG字节经 stdout 返回（不落盘、不再单独 ffprobe 时长）。
+
+    使用 -sseof 从文件末尾回退定位；个别视频末尾窗口内无完整帧时，放宽窗口（至少 1 秒、且为首次窗口的两倍）再取一次。
+    candidates > 1 时同一次解码输出末尾 window_sec 秒内的帧，取最后 candidates 帧按清晰度择优，
+    避免运动模糊的尾帧成为下一段的首帧。
+    """
+    if candidates is None:
+        candidates = int(VIDEO_CONFIG.get("tail_frame_candidates", 1) or 1)
+    if window_sec is None:
+        window_sec = float(VIDEO_CONFIG.get("tail_frame_window_sec", 0.5))
+
+    first_window = window_sec if candidates > 1 else 0.1
+    # 重试窗口必须比首次更宽，否则 window_sec >= 1 时会原样重复同一条命令
+    for seek_from_end in (first_window, max(1.0, 2 * first_window)):
         cmd_extract = [
-            'ffmpeg', '-y',
-            '-ss', str(seek_time),
+            'ffmpeg', '-v', 'error',
+            '-sseof', f"-{seek_from_end}",
             '-i', video_path,
-            '-vframes', '1',
+        ]
+        if candidates <= 1:
+            cmd_extract += ['-frames:v', '1']
+        cmd_extract += [
             '-q:v', '2',  # 高质量
-            output_image_path
+            '-f', 'image2pipe',
+            '-vcodec', 'mjpeg',
+            'pipe:1',
         ]
-        
-        print(f"     视频时长: {duration:.2f}秒，提取时间: {seek_time:.2f}秒")
-        
-        result = subprocess.run(cmd_extract, capture_output=True, text=True, timeout=30)
+        result = run_ffmpeg(cmd_extract, timeout=30, text=False)
         if result.returncode != 0:
-            raise Exception(f"提取尾帧失败: {result.stderr}")
-        
-        if os.path.exists(output_image_path):
-            file_size_kb = os.path.getsize(output_image_path) / 1024
-            print(f"     ✅ 尾帧提取成功: {output_image_path}")
-            print(f"        大小: {file_size_kb:.1f} KB")
-            return output_image_path
-        else:
-            raise Exception("尾帧文件未生成")
-            
+            raise Exception(f"提取尾帧失败: {result.stderr.decode('utf-8', 'ignore')[:300]}")
+        if not result.stdout:
+            continue
+        if candidates <= 1:
+            return result.stdout
+        frames = split_jpeg_stream(result.stdout)[-candidates:]
+        if frames:
+            return select_sharpest_frame(frames)[0]
+    raise Exception("尾帧数据为空")
+
+class TailFrameDecoder:
+    """边下载边解码尾帧：把下载字节流 tee 给 ffmpeg（stdin），下载结束即可拿到最后一帧JPEG。
+
+    - 解码与网络下载重叠，省去下载后的 ffprobe/再次解码等待
+    - 只在内存保留最近 candidates 帧完整JPEG（按清晰度择优），无需等待文件落盘
+    - moov 位于文件末尾（非 faststart）的 MP4 无法流式解码，此时 finish() 返回 None，调用方应回退到 extract_last_frame_bytes
+    - 解码进程经 FFmpegProcessManager 以 light 任务托管（占名额、受超时约束）；名额已满时构造抛出 RuntimeError，
+      调用方跳过边下边解即可
+    """
+
+    JPEG_EOI = b'\xff\xd9'
+
+    def __init__(self, candidates=None):
+        if candidates is None:
+            candidates = int(VIDEO_CONFIG.get("tail_frame_candidates", 1) or 1)
+        self._recent_frames = collections.deque(maxlen=max(1, candidates))
+        self._failed = False
+        self._stderr = b""
+        self._manager = FFmpegProcessManager.get()
+        spawned = self._manager.spawn(
+            [
+                'ffmpeg', '-v', 'error',
+                '-i', 'pipe:0',
+                '-an',
+                '-q:v', '2',
+                '-f', 'image2pipe',
+                '-vcodec', 'mjpeg',
+                'pipe:1',
+            ],
+            label="tail_frame_stream",
+            job_class="light",
+            blocking=False,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if spawned is None:
+            raise RuntimeError("轻量 ffmpeg 任务名额已满")
+        self._job_id, self._proc = spawned
+        self._reader = threading.Thread(target=self._read_frames, daemon=True)
+        self._stderr_reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._reader.start()
+        self._stderr_reader.start()
+
+    def _read_frames(self):
+        buf = b""
+        while True:
+            data = self._proc.stdout.read(65536)
+            if not data:
+                break
+            buf += data
+            # mjpeg 数据段中 0xFF 会被字节填充，EOI 标记只会出现在帧尾
+            end = buf.rfind(self.JPEG_EOI)
+            if end != -1:
+                self._recent_frames.extend(split_jpeg_stream(buf[:end + 2]))
+                buf = buf[end + 2:]
+
+    def _read_stderr(self):
+        self._stderr = self._proc.stderr.read()
+
+    def feed(self, chunk):
+        """写入一段下载数据；解码器异常退出时静默停止喂数据，不影响下载本身"""
+        if self._failed:
+            return
+        try:
+            self._proc.stdin.write(chunk)
+        except (BrokenPipeError, OSError):
+            self._failed = True
+
+    def finish(self, timeout=30):
+        """结束输入并返回最后一帧JPEG字节；失败返回 None"""
+        try:
+            self._proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        try:
+            self._proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._manager.release(self._job_id)
+            print("     ⚠️ 边下边解尾帧超时，已终止解码器")
+            return None
+        self._reader.join(timeout=5)
+        self._stderr_reader.join(timeout=5)
+        self._manager.release(self._job_id)
+
+        if self._proc.returncode != 0 or not self._recent_frames:
+            err = self._stderr.decode('utf-8', 'ignore').strip()
+            print(f"     ⚠️ 边下边解尾帧失败，将回退到下载后提取: {err[:200]}")
+            return None
+        return select_sharpest_frame(list(self._recent_frames))[0]
+
+    def abort(self):
+        """下载失败时终止解码器"""
+        self._failed = True
+        self._manager.release(self._job_id)
+
+def extract_last_frame(video_path, output_image_path):
+    """使用FFmpeg提取视频的最后一帧并写入文件 - 完整实现"""
+    print(f"  🎞🎞🎞️  提取尾帧: {os.path.basename(video_path)}")
+
+    try:
+        frame_bytes = extract_last_frame_bytes(video_path)
+        with open(output_image_path, 'wb') as f:
+            f.write(frame_bytes)
+
+        file_size_kb = len(frame_bytes) / 1024
+        print(f"     ✅ 尾帧提取成功: {output_image_path}")
+        print(f"        大小: {file_size_kb:.1f} KB")
+        return output_image_path
+
     except FileNotFoundError:
-        raise Exception("未找到ffmpeg或ffprobe，请确保已安装FFmpeg")
+        raise Exception("未找到ffmpeg，请确保已安装FFmpeg")
     except Exception as e:
         print(f"     ❌❌ 尾帧提取失败: {e}")
         # 创建备用图片
@@ -276,6 +1308,8 @@ def extract_last_frame(video_path, output_image_path):
 
 def create_fallback_last_frame(output_path):
     """创建备用尾帧图片 - 完整实现"""
+    from PIL import Image, ImageDraw
+
     print("     ⚠⚠⚠️  创建备用尾帧...")
     
     # 创建简单的渐变图片（无文字）
@@ -292,8 +1326,171 @@ def create_fallback_last_frame(output_path):
     img.save(output_path, "PNG", quality=90)
     return output_path
 
+# 媒体探测缓存：同一文件（路径+大小+mtime 不变）只跑一次 ffprobe，所有查询共用结果
+_PROBE_CACHE = collections.OrderedDict()
+_PACKET_CACHE = collections.OrderedDict()
+_PROBE_CACHE_LOCK = threading.Lock()
+_PROBE_CACHE_MAX = 512
+_PROBE_STATS = {"hits": 0, "misses": 0}
+
+def _probe_cache_key(video_path):
+    stat = os.stat(video_path)
+    return (os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)
+
+def _cache_lookup(cache, key):
+    with _PROBE_CACHE_LOCK:
+        if key in cache:
+            _PROBE_STATS["hits"] += 1
+            cache.move_to_end(key)
+            return True, cache[key]
+        _PROBE_STATS["misses"] += 1
+        return False, None
+
+def _cache_store(cache, key, value):
+    with _PROBE_CACHE_LOCK:
+        cache[key] = value
+        while len(cache) > _PROBE_CACHE_MAX:
+            cache.popitem(last=False)
+
+def probe_media(video_path):
+    """ffprobe -show_streams -show_format 的完整结果（dict），带缓存；文件不存在或探测失败返回 None"""
+    try:
+        key = _probe_cache_key(video_path)
+    except OSError:
+        return None
+    hit, data = _cache_lookup(_PROBE_CACHE, key)
+    if hit:
+        return data
+
+    try:
+        result = run_ffmpeg(
+            ['ffprobe', '-v', 'error', '-show_streams', '-show_format', '-of', 'json', video_path],
+            timeout=15,
+        )
+        if result.returncode != 0 or not result.stdout:
+            return None
+        data = json.loads(result.stdout)
+    except Exception:
+        return None
+    _cache_store(_PROBE_CACHE, key, data)
+    return data
+
+def _probe_streams(video_path, codec_type):
+    data = probe_media(video_path) or {}
+    return [st for st in data.get('streams', []) or [] if st.get('codec_type') == codec_type]
+
+def probe_duration(video_path, container=False):
+    """视频时长（秒）：优先视频流时长，缺失时用容器时长（container=True 时只取容器时长）；失败返回 None"""
+    data = probe_media(video_path)
+    if not data:
+        return None
+    videos = [st for st in data.get('streams', []) or [] if st.get('codec_type') == 'video']
+    candidates = [videos[0].get('duration')] if videos and not container else []
+    candidates.append((data.get('format') or {}).get('duration'))
+    for value in candidates:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def probe_audio_stream_count(video_path):
+    return len(_probe_streams(video_path, 'audio'))
+
+def probe_has_audio(video_path):
+    return probe_audio_stream_count(video_path) > 0
+
+def probe_cache_stats():
+    """探测缓存命中/未命中计数"""
+    with _PROBE_CACHE_LOCK:
+        return {**_PROBE_STATS, "entries": len(_PROBE_CACHE) + len(_PACKET_CACHE)}
+
+def clear_probe_cache():
+    with _PROBE_CACHE_LOCK:
+        _PROBE_CACHE.clear()
+        _PACKET_CACHE.clear()
+        _PROBE_STATS.update(hits=0, misses=0)
+
+TOOLCHAIN_CACHE_VERSION = 1
+_TOOLCHAIN = None
+_TOOLCHAIN_LOCK = threading.Lock()
+
+def _toolchain_cache_path():
+    return VIDEO_CONFIG.get("toolchain_cache") or os.path.join(VIDEO_CONFIG["output_dir"], ".cache", "toolchain.json")
+
+def _binary_fingerprint(name):
+    """可执行文件的 (真实路径, 大小, mtime_ns)；找不到返回 None"""
+    path = shutil.which(name)
+    if not path:
+        return None
+    real = os.path.realpath(path)
+    stat = os.stat(real)
+    return [real, stat.st_size, stat.st_mtime_ns]
+
+def _list_ffmpeg_capability(kind):
+    """解析 `ffmpeg -encoders` / `ffmpeg -filters` 的名称列（跳过 `X = 说明` 图例与 `------` 分隔行）"""
+    result = run_ffmpeg(["ffmpeg", "-hide_banner", f"-{kind}"], timeout=10, label=f"ffmpeg_{kind}", job_class="light")
+    names = []
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if line.startswith(" ") and len(parts) >= 3 and parts[1] != "=" and not parts[0].startswith("---"):
+            names.append(parts[1])
+    return sorted(set(names))
+
+def probe_toolchain(refresh=False):
+    """探测 ffmpeg/ffprobe 能力（版本、可用编码器与滤镜），按二进制路径+大小+mtime 缓存到磁盘。
+
+    二进制未变时启动只读一次缓存文件（不起子进程）；返回
+    {"ffmpeg": {"path", "version", "encoders", "filters"} | None, "ffprobe": {"path", "version"} | None}
+    """
+    global _TOOLCHAIN
+    fingerprint = {"ffmpeg": _binary_fingerprint("ffmpeg"), "ffprobe": _binary_fingerprint("ffprobe")}
+    with _TOOLCHAIN_LOCK:
+        if not refresh and _TOOLCHAIN is not None and _TOOLCHAIN.get("fingerprint") == fingerprint:
+            return _TOOLCHAIN["tools"]
+
+        cache_path = _toolchain_cache_path()
+        if not refresh and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                if cached.get("version") == TOOLCHAIN_CACHE_VERSION and cached.get("fingerprint") == fingerprint:
+                    _TOOLCHAIN = cached
+                    return cached["tools"]
+            except Exception:
+                pass
+
+        def version_of(name):
+            result = run_ffmpeg([name, "-version"], timeout=5, label=f"{name}_version", job_class="light")
+            first = (result.stdout or "").splitlines()[:1]
+            parts = first[0].split() if first else []
+            return parts[2] if len(parts) > 2 and result.returncode == 0 else None
+
+        tools = {"ffmpeg": None, "ffprobe": None}
+        try:
+            if fingerprint["ffmpeg"]:
+                tools["ffmpeg"] = {
+                    "path": fingerprint["ffmpeg"][0],
+                    "version": version_of("ffmpeg"),
+                    "encoders": _list_ffmpeg_capability("encoders"),
+                    "filters": _list_ffmpeg_capability("filters"),
+                }
+            if fingerprint["ffprobe"]:
+                tools["ffprobe"] = {"path": fingerprint["ffprobe"][0], "version": version_of("ffprobe")}
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"⚠️ 工具链探测失败: {e}")
+
+        _TOOLCHAIN = {"version": TOOLCHAIN_CACHE_VERSION, "fingerprint": fingerprint, "tools": tools}
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump(_TOOLCHAIN, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"⚠️ 工具链缓存写入失败: {e}")
+        return tools
+
 def get_video_info(video_path):
-    """获取视频文件信息 - 完整实现"""
+    """获取视频文件信息 - 完整实现（经探测缓存）"""
     try:
         if not os.path.exists(video_path):
             return {"error": "文件不存在"}
@@ -301,33 +1498,96 @@ def get_video_info(video_path):
         file_size_mb = os.path.getsize(video_path) / (1024 * 1024)
         
         info = {"file_size_mb": round(file_size_mb, 2)}
-        
-        try:
-            import subprocess
-            result = subprocess.run([
-                'ffprobe', '-v', 'error', '-select_streams', 'v:0',
-                '-show_entries', 'stream=duration,width,height,codec_name',
-                '-of', 'json', video_path
-            ], capture_output=True, text=True, timeout=10)
-            
-            if result.returncode == 0:
-                video_data = json.loads(result.stdout)
-                if 'streams' in video_data and len(video_data['streams']) > 0:
-                    stream = video_data['streams'][0]
-                    info.update({
-                        "duration": float(stream.get('duration', 0)),
-                        "width": int(stream.get('width', 0)),
-                        "height": int(stream.get('height', 0)),
-                        "codec": stream.get('codec_name', 'unknown')
-                    })
-        except:
-            pass
+
+        videos = _probe_streams(video_path, 'video')
+        if videos:
+            stream = videos[0]
+            info.update({
+                "duration": probe_duration(video_path) or 0.0,
+                "width": int(stream.get('width', 0) or 0),
+                "height": int(stream.get('height', 0) or 0),
+                "codec": stream.get('codec_name', 'unknown')
+            })
         
         return info
         
     except Exception as e:
         return {"error": str(e)}
 
+def snap_to_allowed_duration(duration_sec, allowed_durations=None, min_duration_sec=None):
+    """把任意时长归一到允许的单镜时长：取不超过它的最大允许值，不足时取最小允许值"""
+    min_duration_sec = int(min_duration_sec or VIDEO_CONFIG.get("segment_duration_min", 4))
+    allowed = sorted({int(x) for x in (allowed_durations or VIDEO_CONFIG.get("segment_duration_options", [4, 5]))
+                      if int(x) >= min_duration_sec})
+    if not allowed:
+        return min_duration_sec
+    try:
+        duration_sec = float(duration_sec)
+    except (TypeError, ValueError):
+        return allowed[0]
+    fitting = [d for d in allowed if d <= duration_sec]
+    return fitting[-1] if fitting else allowed[0]
+
+def _spread_durations(counts):
+    """把多重集合排成时间线：以最短时长为底，其余镜头按“长的优先”均匀散开（避免堆在片头）"""
+    base = min(counts)
+    n = sum(counts.values())
+    others = sorted((d for d, c in counts.items() if d != base for _ in range(c)), reverse=True)
+    k = len(others)
+    if k <= 1:
+        return others + [base] * (n - k)
+
+    step = (n - 1) / float(k)
+    positions = {int(round(i * step)) for i in range(k)}
+    # 修正数量（round 可能导致重复位置）
+    positions = sorted(positions)
+    if len(positions) < k:
+        free = [i for i in range(n) if i not in positions]
+        positions = sorted(positions + free[:k - len(positions)])
+    durations = [base] * n
+    for pos, d in zip(positions, others):
+        durations[pos] = d
+    return durations
+
+@functools.lru_cache(maxsize=256)
+def _plan_durations_cached(target, tolerance, allowed, min_segments, max_segments, prefer_more_cuts, weights):
+    """动态规划：best[n][total] = 用 n 个镜头凑出 total 秒的最小代价组合（各时长的数量）。
+
+    代价 = (节奏权重之和, 时长平方和)；平方和越小各镜时长越均匀。
+    """
+    weight_of = dict(weights)
+    lo, hi = target - tolerance, target + tolerance
+    # layer: {total: (cost, counts_tuple)}，counts_tuple 与 allowed 对齐
+    layer = {0: ((0.0, 0), (0,) * len(allowed))}
+    best = None
+    for n in range(1, max_segments + 1):
+        next_layer = {}
+        for total, (cost, counts) in layer.items():
+            for i, d in enumerate(allowed):
+                new_total = total + d
+                new_cost = (cost[0] + weight_of.get(d, 0.0), cost[1] + d * d)
+                new_counts = counts[:i] + (counts[i] + 1,) + counts[i + 1:]
+                current = next_layer.get(new_total)
+                if current is None or (new_cost, new_counts) < current:
+                    next_layer[new_total] = (new_cost, new_counts)
+        layer = next_layer
+        if n < min_segments:
+            continue
+        for total, (cost, counts) in layer.items():
+            key = (
+                0 if lo <= total <= hi else 1,
+                abs(total - target),
+                -n if prefer_more_cuts else n,
+                cost,
+            )
+            if best is None or key < best[0]:
+                best = (key, n, total, counts)
+
+    if best is None:
+        raise ValueError("无可行的分镜时长组合（检查 min_segments/max_segments 配置）")
+    _, n, total, counts = best
+    return n, tuple(_spread_durations({d: c for d, c in zip(allowed, counts) if c})), total
+
 def plan_segment_durations(
     target_total_sec=None,
     tolerance_sec=None,
@@ -335,10 +1595,16 @@ def plan_segment_durations(
     min_duration_sec=None,
     max_segments=None,
     prefer_more_cuts=True,
+    min_segments=None,
+    pacing_weights=None,
 ):
     """规划分镜数量与每镜时长。
 
     目标：总时长约为 target_total_sec，允许误差 tolerance_sec；每镜时长不得低于 min_duration_sec，且必须来自 allowed_durations。
+    支持任意时长集合（如 3/4/5/6/8/10 秒）与镜头数上下限；pacing_weights（{时长: 每镜惩罚}）可表达节奏偏好。
+    结果按参数缓存，重复调用为 O(1)。
+
+    选优顺序：命中容差区间 > 距目标更近 > 节奏偏好（更多/更少镜头）> 节奏权重 > 时长更均匀。
 
     返回：
     - segment_count: int
@@ -350,81 +1616,587 @@ def plan_segment_durations(
     tolerance_sec = int(tolerance_sec if tolerance_sec is not None else VIDEO_CONFIG.get("target_total_tolerance", 2))
     min_duration_sec = int(min_duration_sec or VIDEO_CONFIG.get("segment_duration_min", 4))
     max_segments = int(max_segments or VIDEO_CONFIG.get("max_segments", VIDEO_CONFIG.get("video_count", 10)))
+    min_segments = int(min_segments or VIDEO_CONFIG.get("min_segments", 1))
 
     allowed_durations = allowed_durations or VIDEO_CONFIG.get("segment_duration_options", [4, 5])
-    allowed = sorted({int(x) for x in allowed_durations if int(x) >= min_duration_sec})
+    allowed = tuple(sorted({int(x) for x in allowed_durations if int(x) >= min_duration_sec}))
     if not allowed:
         raise ValueError("allowed_durations 不能为空，且必须满足最小时长约束")
+    if min_segments > max_segments:
+        raise ValueError(f"min_segments({min_segments}) 不能大于 max_segments({max_segments})")
 
-    # 当前项目约束：只允许 4/5 秒
-    if allowed != [4, 5]:
-        # 未来可扩展（DP），但先显式报错避免生成超预期时长
-        raise ValueError(f"当前仅支持 [4,5] 秒分配，实际为: {allowed}")
+    weights = tuple(sorted((int(d), float(w)) for d, w in (pacing_weights or {}).items()))
+    n, durations, total = _plan_durations_cached(
+        target_total_sec, tolerance_sec, allowed, max(1, min_segments), max_segments, bool(prefer_more_cuts), weights,
+    )
+    return n, list(durations), total
 
-    lo = target_total_sec - tolerance_sec
-    hi = target_total_sec + tolerance_sec
 
-    # 枚举镜头数 N，寻找最优组合：total = 4N + k (k=升级为5秒的镜头数)
-    candidates = []
-    for n in range(1, max_segments + 1):
-        min_total = 4 * n
-        max_total = 5 * n
-
-        # 最接近 target_total 的 total（先 clamp 到可达区间）
-        desired_total = max(min_total, min(target_total_sec, max_total))
-        k = desired_total - min_total
-        k = max(0, min(n, k))
-        total = min_total + k
-
-        # 评分：优先命中容忍区间；其次距离 target 更近；再根据节奏偏好选更多/更少镜头
-        in_band = (lo <= total <= hi)
-        dist = abs(total - target_total_sec)
-        candidates.append((
-            0 if in_band else 1,
-            dist,
-            -n if prefer_more_cuts else n,
-            n,
-            k,
-            total,
-        ))
-
-    candidates.sort()
-    _, _, _, n, k, total = candidates[0]
-
-    # 构造 durations：默认 4s，前 k 个升级为 5s（可调整分布策略）
-    durations = [5] * k + [4] * (n - k)
-
-    # 为了让节奏更均匀：把 5s 均匀散开（避免全堆在片头）
-    if k > 1:
-        five_positions = set()
-        step = (n - 1) / float(k)
-        for i in range(k):
-            pos = int(round(i * step))
-            five_positions.add(pos)
-        durations = [5 if i in five_positions and len(five_positions) > 0 else 4 for i in range(n)]
-        # 修正数量（避免 round 导致偏差）
-        current_k = sum(1 for d in durations if d == 5)
-        if current_k > k:
-            for i in range(n - 1, -1, -1):
-                if durations[i] == 5 and current_k > k:
-                    durations[i] = 4
-                    current_k -= 1
-        elif current_k < k:
-            for i in range(n):
-                if durations[i] == 4 and current_k < k:
-                    durations[i] = 5
-                    current_k += 1
-
-    planned_total = sum(durations)
-    return n, durations, planned_total
-
-
-def merge_videos_ffmpeg(segment_paths, output_path, target_duration_sec=None, force_no_audio=False):
+# 规划表：批量模式下按 (目标, 容差, 时长集合, 最小时长, 镜头数上下限, 节奏) 预先算好全部时长规划
+PLAN_TABLE_VERSION = 1
+RHYTHM_PREFER_MORE_CUTS = {"manju": True, "movie": False}
+_PLAN_TABLE = None
+_PLAN_TABLE_LOCK = threading.Lock()
+
+def plan_table_key(target_total_sec, tolerance_sec, allowed_durations, min_duration_sec, min_segments, max_segments,
+                   prefer_more_cuts):
+    allowed = sorted({int(x) for x in allowed_durations if int(x) >= int(min_duration_sec)})
+    return (f"{int(target_total_sec)}|{int(tolerance_sec)}|{','.join(map(str, allowed))}|{int(min_duration_sec)}"
+            f"|{int(min_segments)}-{int(max_segments)}|{'more' if prefer_more_cuts else 'fewer'}")
+
+def _plan_formats():
+    """配置的规格列表；缺省时只含当前 VIDEO_CONFIG 的默认规格"""
+    formats = VIDEO_CONFIG.get("plan_formats") or []
+    default = {
+        "name": "default",
+        "target": VIDEO_CONFIG.get("target_total_duration", 30),
+        "tolerance": VIDEO_CONFIG.get("target_total_tolerance", 2),
+        "allowed": VIDEO_CONFIG.get("segment_duration_options", [4, 5]),
+        "min_duration": VIDEO_CONFIG.get("segment_duration_min", 4),
+        "min_segments": VIDEO_CONFIG.get("min_segments", 1),
+        "max_segments": VIDEO_CONFIG.get("max_segments", VIDEO_CONFIG.get("video_count", 10)),
+    }
+    return [default] + [{**default, **fmt} for fmt in formats]
+
+def get_plan_format(name=None):
+    """按名称取规格（target/tolerance/allowed/min_duration/min_segments/max_segments），None 为默认规格"""
+    formats = _plan_formats()
+    if not name:
+        return formats[0]
+    for fmt in formats:
+        if fmt.get("name") == name:
+            return fmt
+    raise ValueError(f"未知的规格: {name}（可选: {', '.join(fmt['name'] for fmt in formats)}）")
+
+def _plan_table_path():
+    return VIDEO_CONFIG.get("plan_table_cache") or os.path.join(VIDEO_CONFIG["output_dir"], ".cache", "plan_table.json")
+
+def build_plan_table(formats=None):
+    """对每个规格 × 节奏预计算时长规划，返回 {key: {"format", "rhythm", "segment_count", "durations", "planned_total"}}"""
+    table = {}
+    for fmt in formats or _plan_formats():
+        for rhythm, prefer_more_cuts in RHYTHM_PREFER_MORE_CUTS.items():
+            key = plan_table_key(fmt["target"], fmt["tolerance"], fmt["allowed"], fmt["min_duration"],
+                                 fmt["min_segments"], fmt["max_segments"], prefer_more_cuts)
+            n, durations, total = plan_segment_durations(
+                target_total_sec=fmt["target"],
+                tolerance_sec=fmt["tolerance"],
+                allowed_durations=fmt["allowed"],
+                min_duration_sec=fmt["min_duration"],
+                max_segments=fmt["max_segments"],
+                prefer_more_cuts=prefer_more_cuts,
+                min_segments=fmt["min_segments"],
+            )
+            table[key] = {
+                "format": fmt.get("name", key),
+                "rhythm": rhythm,
+                "segment_count": n,
+                "durations": durations,
+                "planned_total": total,
+            }
+    return table
+
+def load_plan_table(rebuild=False):
+    """加载规划表：版本号与规格配置一致时直接读缓存文件，否则重新计算并写回"""
+    global _PLAN_TABLE
+    formats = _plan_formats()
+    fingerprint = hashlib.sha1(json.dumps(formats, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    cache_path = _plan_table_path()
+
+    with _PLAN_TABLE_LOCK:
+        if not rebuild and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                if cached.get("version") == PLAN_TABLE_VERSION and cached.get("fingerprint") == fingerprint:
+                    _PLAN_TABLE = cached["plans"]
+                    return _PLAN_TABLE
+            except Exception:
+                pass
+
+        _PLAN_TABLE = build_plan_table(formats)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump({"version": PLAN_TABLE_VERSION, "fingerprint": fingerprint, "plans": _PLAN_TABLE},
+                          f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"⚠️ 规划表缓存写入失败: {e}")
+        return _PLAN_TABLE
+
+def lookup_duration_plan(target_total_sec=None, tolerance_sec=None, allowed_durations=None, min_duration_sec=None,
+                         max_segments=None, prefer_more_cuts=True, min_segments=None):
+    """O(1) 查规划表；未收录的参数组合现场规划（同样有缓存），返回 (segment_count, durations, planned_total)"""
+    target_total_sec = int(target_total_sec or VIDEO_CONFIG.get("target_total_duration", 30))
+    tolerance_sec = int(tolerance_sec if tolerance_sec is not None else VIDEO_CONFIG.get("target_total_tolerance", 2))
+    allowed_durations = allowed_durations or VIDEO_CONFIG.get("segment_duration_options", [4, 5])
+    min_duration_sec = int(min_duration_sec or VIDEO_CONFIG.get("segment_duration_min", 4))
+    max_segments = int(max_segments or VIDEO_CONFIG.get("max_segments", VIDEO_CONFIG.get("video_count", 10)))
+    min_segments = int(min_segments or VIDEO_CONFIG.get("min_segments", 1))
+
+    table = _PLAN_TABLE if _PLAN_TABLE is not None else load_plan_table()
+    key = plan_table_key(target_total_sec, tolerance_sec, allowed_durations, min_duration_sec,
+                         min_segments, max_segments, prefer_more_cuts)
+    plan = table.get(key)
+    if plan:
+        return plan["segment_count"], list(plan["durations"]), plan["planned_total"]
+    return plan_segment_durations(
+        target_total_sec=target_total_sec,
+        tolerance_sec=tolerance_sec,
+        allowed_durations=allowed_durations,
+        min_duration_sec=min_duration_sec,
+        max_segments=max_segments,
+        prefer_more_cuts=prefer_more_cuts,
+        min_segments=min_segments,
+    )
+
+def probe_stream_spec(video_path):
+    """读取视频的编码规格（编码/分辨率/帧率/SAR/像素格式/音频布局），失败返回 None"""
+    data = probe_media(video_path)
+    if not data:
+        return None
+    streams = data.get('streams', []) or []
+
+    video = next((st for st in streams if st.get('codec_type') == 'video'), None)
+    audio = next((st for st in streams if st.get('codec_type') == 'audio'), None)
+    if not video:
+        return None
+
+    sar = video.get('sample_aspect_ratio') or "1:1"
+    if sar in ("0:1", "N/A"):
+        sar = "1:1"
+    return {
+        "vcodec": video.get('codec_name'),
+        "profile": video.get('profile'),
+        "width": int(video.get('width', 0) or 0),
+        "height": int(video.get('height', 0) or 0),
+        "pix_fmt": video.get('pix_fmt'),
+        "fps": video.get('r_frame_rate'),
+        "sar": sar,
+        "time_base": video.get('time_base'),
+        "acodec": audio.get('codec_name') if audio else None,
+        "sample_rate": audio.get('sample_rate') if audio else None,
+        "channels": audio.get('channels') if audio else None,
+    }
+
+def pick_reference_spec(specs):
+    """多数分段共有的规格作为拼接基准（只需重编码少数不一致的分段）"""
+    counter = collections.Counter(tuple(sorted(spec.items())) for spec in specs if spec)
+    if not counter:
+        return None
+    return dict(counter.most_common(1)[0][0])
+
+def spec_matches(spec, reference, keep_audio=True):
+    """判断分段规格能否与基准直接 stream copy 拼接"""
+    if not spec or not reference:
+        return False
+    keys = ["vcodec", "profile", "width", "height", "pix_fmt", "fps", "sar", "time_base"]
+    if keep_audio:
+        keys += ["acodec", "sample_rate", "channels"]
+    return all(spec.get(k) == reference.get(k) for k in keys)
+
+def normalize_segment(src_path, dst_path, spec, keep_audio=True):
+    """把单个分段重编码为指定规格。
+
+    用于 smart 合成，只处理与基准规格不一致的分段；
+    原分段缺音轨而基准有音轨时补静音轨，保证 concat demuxer 可直接 copy。
+    """
+    width, height = spec["width"], spec["height"]
+    vf = (
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,"
+        f"setsar={spec['sar'].replace(':', '/')},fps={spec['fps']},format={spec['pix_fmt'] or 'yuv420p'}"
+    )
+    encoder = {"h264": "libx264", "hevc": "libx265"}.get(spec.get("vcodec"), "libx264")
+    profile = {"High": "high", "Main": "main", "Constrained Baseline": "baseline", "Baseline": "baseline"}.get(
+        spec.get("profile") or "", None)
+
+    cmd = ["ffmpeg", "-y", "-i", src_path]
+    src_spec = probe_stream_spec(src_path) or {}
+    want_audio = keep_audio and spec.get("acodec")
+    if want_audio and not src_spec.get("acodec"):
+        layout = "mono" if str(spec.get("channels")) == "1" else "stereo"
+        cmd += ["-f", "lavfi", "-i", f"anullsrc=r={spec['sample_rate']}:cl={layout}"]
+        audio_map = ["-map", "1:a:0", "-shortest"]
+    else:
+        audio_map = ["-map", "0:a:0"] if want_audio else []
+
+    cmd += ["-map", "0:v:0", *audio_map, "-vf", vf, "-c:v", encoder, "-preset", "medium", "-crf", "18"]
+    if profile and encoder == "libx264":
+        cmd += ["-profile:v", profile]
+    if spec.get("time_base") and "/" in spec["time_base"]:
+        cmd += ["-video_track_timescale", spec["time_base"].split("/")[1]]
+    if want_audio:
+        cmd += ["-c:a", "aac", "-b:a", "192k", "-ar", str(spec["sample_rate"]), "-ac", str(spec["channels"])]
+    else:
+        cmd += ["-an"]
+    cmd.append(dst_path)
+
+    print(f"  🔧 规格对齐（仅重编码该分段）: {os.path.basename(src_path)}")
+    result = run_ffmpeg(cmd, progress=True, label=os.path.basename(dst_path))
+    if result.returncode != 0:
+        raise RuntimeError(f"分段规格对齐失败: {result.stderr[-500:]}")
+    return dst_path
+
+def segment_conforms(spec, canonical, keep_audio=True):
+    """判断分段是否已符合统一规格（canonical 中为 None 的字段不做约束）"""
+    if not spec:
+        return False
+    audio_keys = ("acodec", "sample_rate", "channels")
+    for key, expected in canonical.items():
+        if expected is None or (not keep_audio and key in audio_keys):
+            continue
+        if str(spec.get(key)) != str(expected):
+            return False
+    return True
+
+class SegmentNormalizer:
+    """下载即规格化：每段下载完成后立即提交，在后台把不合规分段转成统一规格。
+
+    - 每个分段由独立的 ffmpeg 进程编码，多段可同时占用多个 CPU 核，且与后续分段的生成/下载重叠
+    - 规格来自 VIDEO_CONFIG["canonical_spec"]；宽高/时间基为 None 时以第一个提交的分段为准
+    - 已符合规格的分段不做任何处理；成片阶段只需 concat copy
+    """
+
+    def __init__(self, output_dir, spec=None, max_workers=None, keep_audio=True):
+        self.output_dir = output_dir
+        self.spec = {"time_base": None, **(spec or VIDEO_CONFIG.get("canonical_spec") or {})}
+        self.keep_audio = keep_audio
+        self._futures = {}
+        self._lock = threading.Lock()
+        workers = max_workers or int(VIDEO_CONFIG.get("normalize_workers", 2) or 2)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        os.makedirs(output_dir, exist_ok=True)
+
+    REFERENCE_KEYS = ("width", "height", "time_base")
+
+    def _resolve_spec(self, source_spec):
+        with self._lock:
+            if source_spec:
+                for key in self.REFERENCE_KEYS:
+                    if not self.spec.get(key):
+                        self.spec[key] = source_spec.get(key)
+            return dict(self.spec)
+
+    def _normalize(self, index, src_path):
+        source_spec = probe_stream_spec(src_path)
+        spec = self._resolve_spec(source_spec)
+        if segment_conforms(source_spec, spec, keep_audio=self.keep_audio):
+            return src_path
+        dst_path = os.path.join(self.output_dir, f"norm_{index:02d}.mp4")
+        # 规格字段缺省时沿用源分段的值
+        full_spec = {**(source_spec or {}), **{k: v for k, v in spec.items() if v is not None}}
+        return normalize_segment(src_path, dst_path, full_spec, keep_audio=self.keep_audio)
+
+    def submit(self, index, src_path):
+        """提交一个已下载分段（立即返回，规格化在后台进行）"""
+        if not all(self.spec.get(key) for key in self.REFERENCE_KEYS):
+            # 分辨率/时间基以第一个提交的分段为准，在提交线程确定，避免受后台完成顺序影响
+            self._resolve_spec(probe_stream_spec(src_path))
+        future = self._executor.submit(self._normalize, index, src_path)
+        self._futures[os.path.abspath(src_path)] = future
+        return future
+
+    def result_paths(self, segment_paths):
+        """按 segment_paths 顺序返回规格化后的路径；某段失败时保留原文件（由合成阶段兜底）"""
+        resolved = []
+        for src_path in segment_paths:
+            future = self._futures.get(os.path.abspath(src_path))
+            if future is None:
+                resolved.append(src_path)
+                continue
+            try:
+                resolved.append(future.result())
+            except Exception as e:
+                print(f"  ⚠️ {os.path.basename(src_path)} 规格化失败，合成时兜底处理: {e}")
+                resolved.append(src_path)
+        return resolved
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+class IncrementalAssembler:
+    """成片增量拼装：分段按时间线顺序到齐即在后台完成合成所需的逐段准备，不必等全部分段完成再探测。
+
+    - add() 可乱序调用；只有当某段及其之前所有分段都就绪时才推进时间线
+    - 每推进一段就在后台预先探测该段规格、包索引（出点/关键帧）、容器时长，开启响度归一时测量响度；
+      这些结果按文件缓存，finalize() 中的合成直接命中缓存，最后一段下载后只剩 concat copy（+必要时裁切）
+    - 预览片 preview_partial.mp4 在时间线长度为 1、2、4、8… 段时刷新（每次 stream copy 整个前缀，总拷贝量
+      不超过成片的两倍）；分段未全部成功时 wait_preview() 把预览片补到当前时间线
+    - 出点裁切依赖全部分段的实际时长，成片本身仍在 finalize() 中一次合成
+    """
+
+    def __init__(self, output_path, expected_count, force_no_audio=False, preview=True):
+        self.output_path = output_path
+        self.expected_count = expected_count
+        self.force_no_audio = force_no_audio
+        self.out_dir = os.path.dirname(output_path)
+        self.preview_path = os.path.join(self.out_dir, "preview_partial.mp4") if preview else None
+        self.timeline = []
+        self.sources = []  # 与 timeline 对应的原分段（规格化前），响度按原分段查缓存
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._prepare_futures = []
+        self._preview_future = None
+        self._preview_length = 0
+        self._next_preview_at = 1
+        os.makedirs(self.out_dir, exist_ok=True)
+
+    @property
+    def complete(self):
+        return len(self.timeline) >= self.expected_count
+
+    def add(self, index, path, source_path=None):
+        """登记第 index 段（从1开始）的文件，并推进可连续拼接的前缀
+
+        source_path: path 为规格化副本时传入原分段（下载时已测响度），缺省即 path 本身
+        """
+        with self._lock:
+            self._pending[index] = (path, source_path or path)
+            added = []
+            while len(self.timeline) + 1 in self._pending:
+                added.append(self._pending.pop(len(self.timeline) + 1))
+                self.timeline.append(added[-1][0])
+                self.sources.append(added[-1][1])
+            if not added:
+                return
+            ready = len(self.timeline)
+            for p, source in added:
+                self._prepare_futures.append(self._executor.submit(self._prepare, p, source))
+            refresh = bool(self.preview_path) and ready < self.expected_count and ready >= self._next_preview_at
+            if refresh:
+                self._next_preview_at = ready * 2
+                self._preview_future = self._executor.submit(self._write_preview, list(self.timeline))
+        print(f"  🧱 增量拼装: 时间线已就绪 {ready}/{self.expected_count} 段")
+
+    def _prepare(self, path, source_path):
+        """预先完成合成阶段要做的逐段探测（结果进探测/响度缓存；响度按原分段，下载时已测则直接命中）"""
+        probe_stream_spec(path)
+        probe_duration(path, container=True)
+        get_safe_outpoints(path)
+        if (not self.force_no_audio) and VIDEO_CONFIG.get("loudness_normalization", False):
+            measure_loudness(source_path)
+
+    def _write_preview(self, timeline):
+        list_path = os.path.join(self.out_dir, "preview_list.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for p in timeline:
+                f.write(f"file '{os.path.abspath(p)}'\n")
+        cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path,
+               "-map", "0:v:0", *(["-an"] if self.force_no_audio else ["-map", "0:a?"]),
+               "-c", "copy", "-movflags", "+faststart", self.preview_path]
+        result = run_ffmpeg(cmd, timeout=120, label="preview_partial")
+        if result.returncode != 0:
+            print(f"  ⚠️ 预览片刷新失败: {result.stderr[-200:]}")
+            return None
+        self._preview_length = len(timeline)
+        return self.preview_path
+
+    def wait_preview(self):
+        """等待后台预览刷新；预览片落后于时间线时（分段未全部成功）补写到当前时间线"""
+        if self._preview_future:
+            try:
+                self._preview_future.result()
+            except Exception:
+                pass
+        if self.preview_path and self.timeline and not self.complete and self._preview_length < len(self.timeline):
+            self._write_preview(list(self.timeline))
+
+    def finalize(self, target_duration_sec=None, planned_durations=None):
+        """全部分段到齐后输出成片，返回值同 merge_videos_ffmpeg；未到齐时抛出异常（预览片保留）"""
+        if not self.complete:
+            raise RuntimeError(f"分段未到齐（{len(self.timeline)}/{self.expected_count}），仅保留预览片")
+        started = time.time()
+        for future in self._prepare_futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"  ⚠️ 分段预探测失败（合成时重新探测）: {e}")
+        if time.time() - started > 0.5:
+            print(f"  ⏳ 等待分段预探测 {time.time() - started:.1f}s")
+        result = merge_videos_ffmpeg(
+            self.timeline,
+            self.output_path,
+            target_duration_sec=target_duration_sec,
+            force_no_audio=self.force_no_audio,
+            planned_durations=planned_durations,
+            loudness_sources=self.sources,
+        )
+        if self.preview_path and os.path.exists(self.preview_path):
+            os.remove(self.preview_path)
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+def measure_loudness(video_path):
+    """测量分段响度（EBU R128，loudnorm 第一遍），结果缓存到同目录 <文件>.loudness.json。
+
+    文件大小/mtime 未变时直接读缓存；无音轨返回 None。返回 {"input_i", "input_tp", "input_lra", "input_thresh"}
+    """
+    cache_path = video_path + ".loudness.json"
+    try:
+        stat = os.stat(video_path)
+    except OSError:
+        return None
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("size") == stat.st_size and cached.get("mtime_ns") == stat.st_mtime_ns:
+                return cached.get("measurement")
+        except Exception:
+            pass
+
+    measurement = None
+    if probe_has_audio(video_path):
+        cmd = ["ffmpeg", "-hide_banner", "-nostats", "-i", video_path, "-map", "0:a:0",
+               "-af", "loudnorm=print_format=json", "-f", "null", "-"]
+        result = run_ffmpeg(cmd, timeout=60, label=f"loudness_{os.path.basename(video_path)}")
+        stderr = result.stderr or ""
+        start, end = stderr.rfind("{"), stderr.rfind("}")
+        if result.returncode == 0 and start != -1 and end > start:
+            raw = json.loads(stderr[start:end + 1])
+            measurement = {}
+            for key in ("input_i", "input_tp", "input_lra", "input_thresh"):
+                try:
+                    measurement[key] = float(raw.get(key))
+                except (TypeError, ValueError):
+                    measurement[key] = None
+
+    try:
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "measurement": measurement}, f)
+    except Exception:
+        pass
+    return measurement
+
+def loudness_gain_filter(segment_paths, segment_durations=None, target_lufs=None, threshold_lu=None,
+                         true_peak_db=None):
+    """根据缓存的分段响度生成一遍式音频滤镜：按时间段分别增益 + 限幅。
+
+    segment_paths 应为测量响度时的原分段（命中 .loudness.json 缓存）；segment_durations 为各段在成片中的
+    实际时长（扣除出点/入点裁切），缺省时按分段容器时长计算增益切换点。
+    所有分段与目标响度偏差都不超过阈值时返回 None（成片保持 stream copy）。
+    """
+    target_lufs = float(VIDEO_CONFIG.get("loudness_target_lufs", -16) if target_lufs is None else target_lufs)
+    threshold_lu = float(VIDEO_CONFIG.get("loudness_threshold_lu", 2.0) if threshold_lu is None else threshold_lu)
+    true_peak_db = float(VIDEO_CONFIG.get("loudness_true_peak_db", -1.5) if true_peak_db is None else true_peak_db)
+
+    gains, boundaries, elapsed = [], [], 0.0
+    for i, path in enumerate(segment_paths):
+        measurement = measure_loudness(path) or {}
+        loudness = measurement.get("input_i")
+        # 无音轨/静音段（-inf）不做增益
+        gain_db = 0.0 if loudness is None or loudness < -70 else max(-20.0, min(20.0, target_lufs - loudness))
+        gains.append(gain_db)
+        if segment_durations is not None and i < len(segment_durations):
+            elapsed += segment_durations[i]
+        else:
+            elapsed += probe_duration(path, container=True) or 0.0
+        boundaries.append(elapsed)
+
+    if not gains or max(abs(g) for g in gains) <= threshold_lu:
+        return None
+
+    print(f"  🔊 响度归一: 目标 {target_lufs:.0f} LUFS，分段增益 {', '.join(f'{g:+.1f}dB' for g in gains)}")
+    expr = f"{10 ** (gains[-1] / 20):.4f}"
+    for gain_db, boundary in reversed(list(zip(gains[:-1], boundaries[:-1]))):
+        expr = f"if(lt(t,{boundary:.3f}),{10 ** (gain_db / 20):.4f},{expr})"
+    limit = max(0.0625, min(1.0, 10 ** (true_peak_db / 20)))
+    return f"volume='{expr}':eval=frame,alimiter=limit={limit:.4f}:level=0"
+
+def plan_cut_points(segment_paths, target_duration_sec, planned_durations=None, tolerance_sec=None, max_trim_sec=None):
+    """按分段实际时长规划各段的入点/出点，使总时长落在目标容差内且全程 stream copy。
+
+    - 出点（截掉分段尾部若干帧）无需关键帧：优先裁掉比规划时长多出的部分，剩余超出量在各段间均摊
+    - 入点必须落在关键帧上：仅当尾部可裁余量不够、且片头 max_trim_sec 内恰有关键帧时才使用
+    - 每段裁切量不超过 max_trim_sec，出点对齐到参考帧之后（见 get_safe_outpoints）
+    返回 (cuts, remaining)：cuts 为每段 {"inpoint", "outpoint", "frames"}（None 表示不裁；frames 为出点前保留的
+    视频包数），remaining 为仍未消化的超出秒数
+    """
+    tolerance_sec = float(VIDEO_CONFIG.get("final_trim_tolerance_sec", 0.25) if tolerance_sec is None else tolerance_sec)
+    max_trim_sec = float(VIDEO_CONFIG.get("max_segment_trim_sec", 0.5) if max_trim_sec is None else max_trim_sec)
+    n = len(segment_paths)
+    no_cuts = [{"inpoint": None, "outpoint": None, "frames": None} for _ in range(n)]
+
+    actual = [probe_duration(p, container=True) for p in segment_paths]
+    if not target_duration_sec or any(d is None for d in actual):
+        return no_cuts, 0.0
+    excess = sum(actual) - float(target_duration_sec)
+    if excess <= tolerance_sec:
+        return no_cuts, 0.0
+
+    # 1) 先裁各段超出规划时长的部分
+    trims = [0.0] * n
+    if planned_durations and len(planned_durations) == n:
+        trims = [min(max(0.0, a - float(p)), max_trim_sec) for a, p in zip(actual, planned_durations)]
+        if sum(trims) > excess:
+            scale = excess / sum(trims)
+            trims = [t * scale for t in trims]
+
+    # 2) 剩余超出量在仍有余量的分段间均摊
+    remaining = excess - sum(trims)
+    while remaining > 1e-6:
+        eligible = [i for i in range(n) if max_trim_sec - trims[i] > 1e-6]
+        if not eligible:
+            break
+        share = remaining / len(eligible)
+        for i in eligible:
+            add = min(share, max_trim_sec - trims[i])
+            trims[i] += add
+            remaining -= add
+
+    # 出点对齐到参考帧之后（B 帧不丢参考），取不早于期望出点的最近安全点，避免多裁
+    cuts = []
+    for path, duration, trim in zip(segment_paths, actual, trims):
+        outpoint = None
+        if trim > 1e-6:
+            desired = duration - trim
+            safe = [pt for pt in get_safe_outpoints(path) if desired - 1e-6 <= pt[0] < duration - 1e-3]
+            outpoint = safe[0] if safe else None
+        cuts.append({"inpoint": None, "outpoint": outpoint[0] if outpoint else None,
+                     "frames": outpoint[1] if outpoint else None})
+    remaining = sum(actual) - float(target_duration_sec) - sum(
+        a - c["outpoint"] for a, c in zip(actual, cuts) if c["outpoint"] is not None)
+
+    # 3) 尾部余量不够时，用片头 max_trim_sec 内的关键帧作入点（copy 只能从关键帧开始）
+    if remaining > tolerance_sec:
+        for i, path in enumerate(segment_paths):
+            if remaining <= tolerance_sec:
+                break
+            keyframes = get_keyframe_times(path)
+            base = keyframes[0] if keyframes else 0.0
+            heads = [k - base for k in keyframes if 0 < k - base <= min(max_trim_sec, remaining)]
+            if heads:
+                cuts[i]["inpoint"] = heads[-1]
+                remaining -= heads[-1]
+
+    return cuts, max(0.0, remaining)
+
+def merge_videos_ffmpeg(segment_paths, output_path, target_duration_sec=None, force_no_audio=False, merge_mode=None,
+                        planned_durations=None, loudness_sources=None):
     """使用 ffmpeg 合并多个视频为单个成片。
 
     - 优先尝试 concat demuxer + stream copy（快但要求规格一致）
-    - 失败则 fallback 到 concat filter + 重新编码（更稳）
+    - 失败则 fallback 到 concat filter + 重新编码（更稳），目标时长裁切在同一次编码中完成
+    - 最终输出一律 stream copy：时长已在容差内不裁切，超出时仅用 -t 截掉尾部；copy 失败才重编码
     - 默认保留音轨；如 force_no_audio=True 则显式去音频（-an）
+
+    merge_mode（默认取 VIDEO_CONFIG["merge_mode"]）：
+    - smart: 先比对各分段规格，只把与多数规格不一致的分段重编码对齐，其余分段原样 copy（未改动区域逐位一致）
+    - copy: 直接 concat copy，失败再整片重编码（旧行为）
+    - reencode: 跳过 copy，整片 concat filter 重编码
+
+    planned_durations: 各段规划时长；smart/copy 模式下据此与实际时长对比，用出点（copy 截尾）/入点（concat
+    inpoint）把超出量分摊到各段，仍超出时才 -t 截尾，最后才重编码
+
+    loudness_sources: 与 segment_paths 一一对应的原分段（segment_paths 为规格化副本时传入），响度按原分段
+    查缓存，不对副本重复测量；缺省即 segment_paths
+
+    返回 (output_path, segment_durations)：segment_durations 为各段在成片中实际占用的秒数（已扣除出点裁切、
+    concat 入点与最终 -t 截尾），流媒体切片等按镜头边界对齐的下游应以此为准
     """
 
     if not segment_paths:
@@ -438,40 +2210,65 @@ def merge_videos_ffmpeg(segment_paths, output_path, target_duration_sec=None, fo
     out_dir = os.path.dirname(output_path)
     os.makedirs(out_dir, exist_ok=True)
 
+    merge_mode = merge_mode or VIDEO_CONFIG.get("merge_mode", "smart")
+    if merge_mode == "smart":
+        specs = [probe_stream_spec(p) for p in existing]
+        reference = pick_reference_spec(specs)
+        if reference and all(specs):
+            mismatched = [i for i, spec in enumerate(specs)
+                          if not spec_matches(spec, reference, keep_audio=not force_no_audio)]
+            if mismatched:
+                print(f"  🧩 smart 合成: {len(mismatched)}/{len(existing)} 个分段规格不一致，仅重编码这些分段")
+                norm_dir = os.path.join(out_dir, "normalized")
+                os.makedirs(norm_dir, exist_ok=True)
+                existing = list(existing)
+                for i in mismatched:
+                    dst = os.path.join(norm_dir, f"norm_{i + 1:02d}.mp4")
+                    existing[i] = normalize_segment(existing[i], dst, reference, keep_audio=not force_no_audio)
+            else:
+                print("  🧩 smart 合成: 分段规格一致，直接 stream copy")
+
+    cuts = [{"inpoint": None, "outpoint": None, "frames": None} for _ in existing]
+    if target_duration_sec and merge_mode != "reencode":
+        cuts, remaining = plan_cut_points(existing, target_duration_sec, planned_durations)
+        trimmed = [i + 1 for i, c in enumerate(cuts) if c["inpoint"] is not None or c["outpoint"] is not None]
+        if trimmed:
+            print(f"  ✂️ 按实际时长分摊裁切（stream copy）: 第 {trimmed} 段"
+                  + (f"，仍超出 {remaining:.2f}s" if remaining > 0 else ""))
+        # 出点：stream copy 保留解码顺序前 N 个视频包（音频按同一时长截断），失败则该段不裁
+        trim_dir = os.path.join(out_dir, "trimmed")
+        existing = list(existing)
+        for i, cut in enumerate(cuts):
+            if cut["outpoint"] is None:
+                continue
+            os.makedirs(trim_dir, exist_ok=True)
+            dst = os.path.join(trim_dir, f"trim_{i + 1:02d}.mp4")
+            cmd_trim = ["ffmpeg", "-y", "-v", "error", "-i", existing[i], "-map", "0:v:0", "-map", "0:a:0?",
+                        "-c", "copy", "-frames:v", str(cut["frames"]), "-t", f"{cut['outpoint']:.6f}", dst]
+            if run_ffmpeg(cmd_trim, label=f"trim_{i + 1:02d}").returncode == 0:
+                existing[i] = dst
+            else:
+                cut["outpoint"] = None
+
     concat_list_path = os.path.join(out_dir, "concat_list.txt")
     with open(concat_list_path, "w", encoding="utf-8") as f:
-        for p in existing:
+        for p, cut in zip(existing, cuts):
             ap = os.path.abspath(p).replace("\\\\", "/")
             ap = ap.replace("'", "\\'")
             f.write(f"file '{ap}'\n")
+            if cut["inpoint"] is not None:
+                f.write(f"inpoint {cut['inpoint']:.6f}\n")
 
     audio_flags = ["-an"] if force_no_audio else []
 
     def _run(cmd):
         print("  ▶ ffmpeg:", " ".join(cmd))
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        try:
+            result = run_ffmpeg(cmd, progress=True, label=os.path.basename(cmd[-1]))
+        except subprocess.TimeoutExpired as e:
+            return False, f"超时 {e.timeout}s"
         return result.returncode == 0, (result.stderr or "")
 
-    def _has_audio(video_path):
-        try:
-            probe = subprocess.run(
-                [
-                    "ffprobe", "-v", "error",
-                    "-select_streams", "a:0",
-                    "-show_entries", "stream=index",
-                    "-of", "json",
-                    video_path,
-                ],
-                capture_output=True,
-                text=True,
-                timeout=10,
-            )
-            if probe.returncode != 0 or not probe.stdout:
-                return False
-            data = json.loads(probe.stdout)
-            return len(data.get("streams", []) or []) > 0
-        except Exception:
-            return False
 
     # 1) 快速路径：concat demuxer + copy
     tmp_merged = os.path.join(out_dir, "merged_tmp.mp4")
@@ -483,17 +2280,19 @@ def merge_videos_ffmpeg(segment_paths, output_path, target_duration_sec=None, fo
         "-c", "copy",
         tmp_merged,
     ]
-    ok, err = _run(cmd_copy)
+    ok, err = _run(cmd_copy) if merge_mode != "reencode" else (False, "")
+    concat_copied = ok
+    trim_flags = ["-t", str(target_duration_sec)] if target_duration_sec else []
 
     if not ok:
-        # 2) 稳定路径：concat filter + re-encode
+        # 2) 稳定路径：concat filter + re-encode（同一次编码内完成裁切）
         inputs = []
         for p in existing:
             inputs += ["-i", p]
 
         n = len(existing)
         keep_audio = not force_no_audio
-        has_audio_all = keep_audio and all(_has_audio(p) for p in existing)
+        has_audio_all = keep_audio and all(probe_has_audio(p) for p in existing)
 
         if keep_audio and not has_audio_all:
             print("  ⚠️ 分段音轨不一致或缺失，fallback合成可能不包含音频")
@@ -511,6 +2310,7 @@ def merge_videos_ffmpeg(segment_paths, output_path, target_duration_sec=None, fo
                 "-pix_fmt", "yuv420p",
                 "-c:a", "aac",
                 "-b:a", "192k",
+                *trim_flags,
                 tmp_merged,
             ]
         else:
@@ -524,18 +2324,67 @@ def merge_videos_ffmpeg(segment_paths, output_path, target_duration_sec=None, fo
                 *audio_flags,
                 "-c:v", "libx264",
                 "-pix_fmt", "yuv420p",
+                *trim_flags,
                 tmp_merged,
             ]
 
         ok, err = _run(cmd_filter)
+        trim_flags = []
 
     if not ok:
         raise RuntimeError(f"ffmpeg 合并失败: {err[:500]}")
 
-    # 3) 可选裁切到目标时长（默认保留音轨）
-    cmd_trim = ["ffmpeg", "-y", "-i", tmp_merged]
-    if target_duration_sec:
-        cmd_trim += ["-t", str(int(target_duration_sec))]
+    # 各段在成片中的实际时长：concat demuxer 按“容器时长 - inpoint”推进；重编码路径不使用入点
+    segment_durations = []
+    for p, cut in zip(existing, cuts):
+        duration = probe_duration(p, container=True) or 0.0
+        if concat_copied and cut["inpoint"] is not None:
+            duration -= cut["inpoint"]
+        segment_durations.append(max(0.0, duration))
+
+    # 3) 输出成片：stream copy 重封装（faststart），仅在超出容差时用 -t 截尾
+    if trim_flags:
+        merged_duration = probe_duration(tmp_merged)
+        tolerance = float(VIDEO_CONFIG.get("final_trim_tolerance_sec", 0.25))
+        if merged_duration and merged_duration <= float(target_duration_sec) + tolerance:
+            print(f"  ⚡ 合并时长 {merged_duration:.2f}s 已在容差内，无需裁切")
+            trim_flags = []
+    if target_duration_sec and (trim_flags or not concat_copied):
+        # -t 截尾（含重编码路径同一次编码内的裁切）只影响末尾分段
+        budget = float(target_duration_sec)
+        for i, duration in enumerate(segment_durations):
+            segment_durations[i] = min(duration, budget)
+            budget = max(0.0, budget - segment_durations[i])
+
+    # 响度归一（可选）：只在分段响度偏差超过阈值时处理音频，视频始终 copy
+    loudness_filter = None
+    if (not force_no_audio) and VIDEO_CONFIG.get("loudness_normalization", False) and probe_has_audio(tmp_merged):
+        try:
+            # 响度按原分段查缓存（下载时已测量，规格化/裁切副本不重复测量），
+            # 增益切换点取各段在成片中的实际时长（含出点裁切、concat 入点与 -t 截尾）
+            sources = loudness_sources if loudness_sources and len(loudness_sources) == len(segment_paths) \
+                else segment_paths
+            loudness_filter = loudness_gain_filter(sources, segment_durations)
+        except Exception as e:
+            print(f"  ⚠️ 响度测量失败，跳过归一: {e}")
+    audio_codec_flags = (["-c:v", "copy", "-af", loudness_filter, "-c:a", "aac", "-b:a", "192k"]
+                         if loudness_filter else ["-c", "copy"])
+
+    stream_flags = ["-map", "0:v:0", "-an"] if force_no_audio else ["-map", "0:v:0", "-map", "0:a?"]
+    cmd_final = [
+        "ffmpeg", "-y", "-i", tmp_merged,
+        *trim_flags,
+        *stream_flags,
+        *audio_codec_flags,
+        "-movflags", "+faststart",
+        output_path,
+    ]
+    ok, err = _run(cmd_final)
+    if ok:
+        print("  ⚡ 成片输出: 视频 stream copy" + ("（音频响度归一）" if loudness_filter else "（无重编码）"))
+
+    # 3b) 仅在 copy 输出失败时才重编码
+    cmd_trim = ["ffmpeg", "-y", "-i", tmp_merged, *trim_flags]
 
     if force_no_audio:
         cmd_trim += [
@@ -551,29 +2400,21 @@ def merge_videos_ffmpeg(segment_paths, output_path, target_duration_sec=None, fo
             "-map", "0:a?",
             "-c:v", "libx264",
             "-pix_fmt", "yuv420p",
+            *(["-af", loudness_filter] if loudness_filter else []),
             "-c:a", "aac",
             "-b:a", "192k",
             output_path,
         ]
 
-    ok, err = _run(cmd_trim)
+    if not ok:
+        print("  ⚠️ stream copy 输出失败，回退到重编码")
+        ok, err = _run(cmd_trim)
     if not ok:
         raise RuntimeError(f"ffmpeg 输出失败: {err[:500]}")
 
     # 4) 简单校验：音频流数量 + 时长
     try:
-        cmd_audio = [
-            "ffprobe", "-v", "error",
-            "-select_streams", "a",
-            "-show_entries", "stream=index",
-            "-of", "json",
-            output_path,
-        ]
-        probe = subprocess.run(cmd_audio, capture_output=True, text=True, timeout=15)
-        audio_count = 0
-        if probe.returncode == 0 and probe.stdout:
-            data = json.loads(probe.stdout)
-            audio_count = len(data.get("streams", []) or [])
+        audio_count = probe_audio_stream_count(output_path)
         if force_no_audio and audio_count > 0:
             raise RuntimeError(f"输出仍检测到音频流 {audio_count} 条（已要求强制无音频）")
         print(f"  🎧 音轨流数量: {audio_count}")
@@ -584,14 +2425,322 @@ def merge_videos_ffmpeg(segment_paths, output_path, target_duration_sec=None, fo
     except Exception:
         pass
 
-    return output_path
+    return output_path, segment_durations
+
+def _rendition_crop_filter(aspect):
+    """居中裁切到指定画幅（如 "1:1"）的 crop 表达式，宽高取偶数"""
+    num, den = (int(x) for x in aspect.split(":"))
+    return (f"crop=w='trunc(min(iw,ih*{num}/{den})/2)*2':"
+            f"h='trunc(min(ih,iw*{den}/{num})/2)*2'")
+
+def render_renditions(src_path, renditions, output_dir=None, force_no_audio=False):
+    """一次解码同时输出多个画幅/码率版本（split 滤镜图），返回 {名称: 路径}。
+
+    renditions 每项：name、aspect（None 表示保持原画幅）、max_width（只缩小不放大）、
+    crf 或 video_bitrate、audio_bitrate（可选）。文件写在成片旁边：<成片名>_<name>.mp4
+    """
+    renditions = [r for r in (renditions or []) if r.get("name")]
+    if not renditions:
+        return {}
+    output_dir = output_dir or os.path.dirname(src_path)
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    keep_audio = (not force_no_audio) and probe_has_audio(src_path)
+
+    labels = [f"v{i}" for i in range(len(renditions))]
+    graph = [f"[0:v]split={len(renditions)}" + "".join(f"[{l}]" for l in labels)]
+    for i, rendition in enumerate(renditions):
+        chain = []
+        if rendition.get("aspect"):
+            chain.append(_rendition_crop_filter(rendition["aspect"]))
+        if rendition.get("max_width"):
+            chain.append(f"scale=w='min({int(rendition['max_width'])},iw)':h=-2")
+        chain.append("setsar=1")
+        graph.append(f"[{labels[i]}]{','.join(chain)}[o{i}]")
+
+    cmd = ["ffmpeg", "-y", "-i", src_path, "-filter_complex", ";".join(graph)]
+    outputs = {}
+    for i, rendition in enumerate(renditions):
+        out_path = os.path.join(output_dir, f"{stem}_{rendition['name']}.mp4")
+        cmd += ["-map", f"[o{i}]", "-c:v", "libx264", "-preset", "medium", "-pix_fmt", "yuv420p"]
+        if rendition.get("video_bitrate"):
+            bitrate = rendition["video_bitrate"]
+            cmd += ["-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate]
+        else:
+            cmd += ["-crf", str(rendition.get("crf", 20))]
+        if keep_audio:
+            cmd += ["-map", "0:a:0", "-c:a", "aac", "-b:a", rendition.get("audio_bitrate", "192k")]
+        else:
+            cmd += ["-an"]
+        cmd += ["-movflags", "+faststart", out_path]
+        outputs[rendition["name"]] = out_path
+
+    print(f"  🖼️ 多版本输出（一次解码 → {len(renditions)} 路）: {', '.join(outputs)}")
+    result = run_ffmpeg(cmd, progress=True, label=f"{stem}_renditions")
+    if result.returncode != 0:
+        raise RuntimeError(f"多版本输出失败: {result.stderr[-500:]}")
+    return outputs
+
+def _mp4_init_length(path):
+    """fMP4 文件中 ftyp+moov（初始化段）的字节长度"""
+    offset = 0
+    size_total = os.path.getsize(path)
+    with open(path, "rb") as f:
+        while offset < size_total:
+            f.seek(offset)
+            header = f.read(16)
+            if len(header) < 8:
+                break
+            box_size = int.from_bytes(header[:4], "big")
+            box_type = header[4:8]
+            if box_size == 1:
+                box_size = int.from_bytes(header[8:16], "big")
+            elif box_size == 0:
+                box_size = size_total - offset
+            offset += box_size
+            if box_type == b"moov":
+                return offset
+    raise RuntimeError(f"未找到 moov 初始化段: {path}")
+
+def package_for_streaming(film_path, shot_durations, output_dir, fmt="hls", force_no_audio=False):
+    """把成片按分镜边界切成流媒体分片（全程 stream copy，不重编码），返回播放列表路径。
+
+    - hls: MPEG-TS 分片 + m3u8
+    - cmaf: fMP4 分片 + m3u8（EXT-X-MAP/BYTERANGE 指向各分片自带的初始化段）
+    分片边界取各镜累计时长；每镜首帧是关键帧，所以 copy 也能在镜头边界精确切开。
+    """
+    if fmt not in ("hls", "cmaf"):
+        raise ValueError(f"不支持的封装格式: {fmt}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 累计时长对齐到成片中最近的关键帧（concat 按容器时长推进，与视频流时长可能差一两帧）
+    # 关键帧时间减去起始偏移（编辑列表造成的首帧 pts），与分段复用器的时间轴一致
+    keyframes = get_keyframe_times(film_path)
+    keyframes = [k - keyframes[0] for k in keyframes] if keyframes else []
+    boundaries, elapsed = [], 0.0
+    for duration in list(shot_durations)[:-1]:
+        elapsed += float(duration)
+        cut = min(keyframes, key=lambda k: abs(k - elapsed)) if keyframes else elapsed
+        if cut > 0 and (not boundaries or cut > float(boundaries[-1])):
+            boundaries.append(f"{cut:.3f}")
+
+    ext = "ts" if fmt == "hls" else "m4s"
+    cmd = ["ffmpeg", "-y", "-i", film_path, "-map", "0:v:0"]
+    cmd += ["-an"] if force_no_audio else ["-map", "0:a?"]
+    cmd += ["-c", "copy", "-f", "segment", "-segment_time_delta", "0.01", "-segment_start_number", "1"]
+    if boundaries:
+        cmd += ["-segment_times", ",".join(boundaries)]
+    else:
+        cmd += ["-segment_time", "86400"]
+    playlist_path = os.path.join(output_dir, "index.m3u8")
+    if fmt == "hls":
+        cmd += ["-segment_format", "mpegts", "-segment_list", playlist_path, "-segment_list_type", "m3u8"]
+    else:
+        list_csv = os.path.join(output_dir, "segments.csv")
+        cmd += ["-segment_format", "mp4",
+                "-segment_format_options", "movflags=+frag_keyframe+empty_moov+default_base_moof",
+                "-segment_list", list_csv, "-segment_list_type", "csv"]
+    cmd.append(os.path.join(output_dir, f"shot_%02d.{ext}"))
+
+    print(f"  📡 流媒体封装（{fmt.upper()}，stream copy）: {len(boundaries) + 1} 个分片")
+    result = run_ffmpeg(cmd, label=f"package_{fmt}")
+    if result.returncode != 0:
+        raise RuntimeError(f"流媒体封装失败: {result.stderr[-500:]}")
+    if fmt == "hls":
+        return playlist_path
+
+    entries = []
+    with open(list_csv, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.strip().split(",")
+            if len(parts) >= 3:
+                entries.append((parts[0], float(parts[2]) - float(parts[1])))
+
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:7",
+        f"#EXT-X-TARGETDURATION:{max(int(-(-d // 1)) for _, d in entries) if entries else 1}",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+    ]
+    last_init = None
+    for name, duration in entries:
+        path = os.path.join(output_dir, name)
+        init_len = _mp4_init_length(path)
+        with open(path, "rb") as f:
+            init_bytes = f.read(init_len)
+        # 初始化段相同时沿用上一个 EXT-X-MAP，避免播放器重复初始化
+        if init_bytes != last_init:
+            lines.append(f'#EXT-X-MAP:URI="{name}",BYTERANGE="{init_len}@0"')
+            last_init = init_bytes
+        lines.append(f"#EXTINF:{duration:.3f},")
+        lines.append(f"#EXT-X-BYTERANGE:{os.path.getsize(path) - init_len}@{init_len}")
+        lines.append(name)
+    lines.append("#EXT-X-ENDLIST")
+    with open(playlist_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return playlist_path
+
+def build_contact_sheet(segment_paths, output_dir, tail_frame_paths=None, tile_width=240, poster_width=720):
+    """一个 ffmpeg 滤镜图同时输出：分镜联系表（每镜首/中/尾帧一行）、海报图（首镜中间帧）、缩略图条（各镜中间帧）。
+
+    tail_frame_paths: {分段序号(从1开始): 已提取的尾帧JPEG}，存在时直接复用，不再解码该段末尾。
+    返回 {"contact_sheet": 路径, "poster": 路径, "thumbnail_strip": 路径}
+    """
+    segment_paths = [p for p in segment_paths if p and os.path.exists(p)]
+    if not segment_paths:
+        return {}
+    tail_frame_paths = tail_frame_paths or {}
+    os.makedirs(output_dir, exist_ok=True)
+
+    spec = probe_stream_spec(segment_paths[0]) or {}
+    src_w, src_h = spec.get("width") or 9, spec.get("height") or 16
+    tile_height = int(round(tile_width * src_h / src_w / 2)) * 2
+    tile = (f"scale={tile_width}:{tile_height}:force_original_aspect_ratio=decrease,"
+            f"pad={tile_width}:{tile_height}:(ow-iw)/2:(oh-ih)/2,setsar=1")
+
+    inputs, graph, rows, strip = [], [], [], []
 
+    def add_input(*args):
+        inputs.extend(args)
+        return sum(1 for arg in inputs if arg == "-i") - 1
 
+    count = len(segment_paths)
+    for i, path in enumerate(segment_paths, 1):
+        duration = probe_duration(path) or 4.0
+        first_idx = add_input("-i", path)
+        mid_idx = add_input("-ss", f"{duration / 2:.3f}", "-i", path)
+        tail = tail_frame_paths.get(i)
+        if tail and os.path.exists(tail):
+            last_idx = add_input("-i", tail)
+        else:
+            last_idx = add_input("-sseof", "-0.2", "-i", path)
+
+        graph.append(f"[{first_idx}:v]trim=end_frame=1,{tile}[f{i}]")
+        graph.append(f"[{last_idx}:v]trim=end_frame=1,{tile}[l{i}]")
+        mid_labels = f"[m{i}][s{i}]" + ("[poster_src]" if i == 1 else "")
+        graph.append(f"[{mid_idx}:v]trim=end_frame=1,{tile},split={3 if i == 1 else 2}{mid_labels}")
+        graph.append(f"[f{i}][m{i}][l{i}]hstack=inputs=3[r{i}]")
+        rows.append(f"[r{i}]")
+        strip.append(f"[s{i}]")
+
+    if count > 1:
+        graph.append(f"{''.join(rows)}vstack=inputs={count}[sheet]")
+        graph.append(f"{''.join(strip)}hstack=inputs={count}[strip]")
+    else:
+        graph.append("[r1]null[sheet]")
+        graph.append("[s1]null[strip]")
+    graph.append(f"[poster_src]scale={poster_width}:-2[poster]")
 
+    outputs = {
+        "contact_sheet": os.path.join(output_dir, "contact_sheet.jpg"),
+        "poster": os.path.join(output_dir, "poster.jpg"),
+        "thumbnail_strip": os.path.join(output_dir, "thumbnail_strip.jpg"),
+    }
+    cmd = ["ffmpeg", "-y", "-v", "error", *inputs, "-filter_complex", ";".join(graph)]
+    for label, key in (("sheet", "contact_sheet"), ("poster", "poster"), ("strip", "thumbnail_strip")):
+        cmd += ["-map", f"[{label}]", "-frames:v", "1", "-q:v", "3", "-update", "1", outputs[key]]
+
+    reused = sum(1 for i in range(1, count + 1) if tail_frame_paths.get(i) and os.path.exists(tail_frame_paths[i]))
+    print(f"  🗂️ 生成分镜联系表/海报/缩略图条（一次滤镜图，复用尾帧 {reused}/{count}）")
+    result = run_ffmpeg(cmd, label="contact_sheet")
+    if result.returncode != 0:
+        raise RuntimeError(f"联系表生成失败: {result.stderr[-500:]}")
+    return outputs
 
-def download_video(video_url, output_name):
+def _video_packet_index(video_path):
+    """视频流包索引 [(pts秒, 时长秒, 是否关键帧)]（解码顺序），只扫描包头不解码；结果进探测缓存"""
+    try:
+        key = _probe_cache_key(video_path)
+    except OSError:
+        return []
+    hit, cached = _cache_lookup(_PACKET_CACHE, key)
+    if hit:
+        return cached
+    try:
+        result = run_ffmpeg(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'packet=pts_time,duration_time,flags', '-of', 'csv=p=0', video_path],
+            timeout=30,
+        )
+        packets = []
+        for line in result.stdout.splitlines():
+            parts = line.strip().split(',')
+            if len(parts) < 3 or parts[0] in ('', 'N/A'):
+                continue
+            try:
+                duration = float(parts[1])
+            except ValueError:
+                duration = 0.0
+            packets.append((float(parts[0]), duration, 'K' in parts[2]))
+        _cache_store(_PACKET_CACHE, key, packets)
+        return packets
+    except Exception:
+        return []
+
+def get_keyframe_times(video_path):
+    """读取视频流关键帧时间点（秒，升序）"""
+    return sorted(pts for pts, _, is_key in _video_packet_index(video_path) if is_key)
+
+def get_safe_outpoints(video_path):
+    """可 stream copy 截尾的出点 [(相对首帧的秒数, 保留的视频包数)]，按时间升序。
+
+    保留解码顺序的前 N 个包：只有当这 N 个包的 pts 全部早于其后所有包时，
+    截掉的帧才不会被保留的 B 帧引用，也不会在拼接处与下一段时间戳重叠。
+    （concat demuxer 的 outpoint 按 dts 截断，有 B 帧时必然重叠，故不用它截尾）
+    """
+    packets = _video_packet_index(video_path)
+    if len(packets) < 2:
+        return []
+    base = min(pts for pts, _, _ in packets)
+    suffix_min = [0.0] * len(packets)
+    running = float("inf")
+    for i in range(len(packets) - 1, -1, -1):
+        running = min(running, packets[i][0])
+        suffix_min[i] = running
+    points, prefix_max, prefix_end = [], None, 0.0
+    for count, (pts, duration, _) in enumerate(packets[:-1], start=1):
+        if prefix_max is None or pts > prefix_max:
+            prefix_max, prefix_end = pts, pts + duration
+        if prefix_max < suffix_min[count]:
+            points.append((prefix_end - base, count))
+    return points
+
+def benchmark_merge_modes(segment_paths, work_dir, target_duration_sec=None, modes=("copy", "reencode", "smart")):
+    """对比各合成模式的 CPU 开销（子进程 user+sys 秒）与墙钟耗时"""
+    import resource
+
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    for mode in modes:
+        output_path = os.path.join(work_dir, f"bench_{mode}.mp4")
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        started = time.time()
+        error = None
+        try:
+            merge_videos_ffmpeg(segment_paths, output_path, target_duration_sec=target_duration_sec, merge_mode=mode)
+        except Exception as e:
+            error = str(e)
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        results.append({
+            "mode": mode,
+            "cpu_sec": (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime),
+            "wall_sec": time.time() - started,
+            "output_path": output_path if not error else None,
+            "error": error,
+        })
+    return results
+
+
+
+
+def download_video(video_url, output_name, tail_decoder=None):
+
+    """下载生成的视频 - 完整实现
+
+    tail_decoder: 可选的 TailFrameDecoder，下载数据会同时 tee 给它以边下边解尾帧
+    """
+    import urllib.request
 
-    """下载生成的视频 - 完整实现"""
     print(f"  ⬇⬇⬇️  下载视频...")
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -618,6 +2767,8 @@ def download_video(video_url, output_name):
                         break
                     
                     f.write(chunk)
+                    if tail_decoder is not None:
+                        tail_decoder.feed(chunk)
                     downloaded += len(chunk)
                     
                     if total_size > 0:
@@ -637,10 +2788,15 @@ def download_video(video_url, output_name):
             
     except Exception as e:
         print(f"\n  ❌❌ 视频下载失败: {e}")
+        if tail_decoder is not None:
+            tail_decoder.abort()
         return None
 
 def poll_video_task(task_id):
     """轮询视频任务状态 - 完整实现"""
+    import urllib.request
+    import urllib.error
+
     print(f"  🔄🔄 开始轮询任务状态...")
     
     query_url = f"{VOLC_CONFIG['task_info_api_base']}/{task_id}"
@@ -935,6 +3091,8 @@ def display_storyboard(story_data):
 
 def display_first_image(compressed_image_path, original_image_path, segment_info):
     """显示压缩后的首图并让用户确认 - 完整实现"""
+    from PIL import Image
+
     print("\n" + "="*60)
     print("🖼🖼🖼️ 首图确认环节 (使用压缩版本)")
     print("="*60)
@@ -943,7 +3101,9 @@ def display_first_image(compressed_image_path, original_image_path, segment_info
     display_path = compressed_image_path if os.path.exists(compressed_image_path) else original_image_path
     
     try:
-        # 在Jupyter中直接显示图片
+        # 在Jupyter中直接显示图片（仅当 IPython 已加载，命令行/批量模式不为此导入 IPython）
+        if "IPython" not in sys.modules:
+            raise ImportError("IPython 未加载")
         from IPython.display import Image as IPImage, display
         print(f"\n📁📁 图片文件: {os.path.basename(display_path)}")
         print(f"🎬🎬 所属分段: 第{segment_info.get('segment_number', 1)}段 - {segment_info.get('title', '未命名')}")
@@ -987,10 +3147,10 @@ def display_first_image(compressed_image_path, original_image_path, segment_info
         print(f"\n🔍🔍 无字画面检查:")
         try:
             img = Image.open(display_path)
-            # 简单检查：如果图片是纯色或简单图形，可能不会有明显文字
-            # 这里只是提示用户检查
             print(f"   ✅ 图片已加载")
             print(f"   📏📏 图片尺寸: {img.size}")
+            if segment_info.get('text_score') is not None:
+                print(f"   🔤 自动无字检测分数: {segment_info['text_score']:.2f}（阈值 {no_text_threshold()}）")
             print(f"   💡💡 请确认画面中无任何文字元素")
         except Exception as e:
             print(f"   ⚠⚠⚠️  无法分析图片: {e}")
@@ -8,21 +8,27 @@ import os
 import json
 import shutil
 import time
+from dataclasses import asdict, is_dataclass, fields as dataclass_fields
 from datetime import datetime
-from PIL import Image, ImageDraw, ImageEnhance
 import base64
 import io
+from concurrent.futures import ThreadPoolExecutor
 
-from config import VOLC_CONFIG, NGINX_CONFIG, VIDEO_CONFIG, COMIC_STYLES
-from models import StoryInput, StoryData, ImageResult, VideoResult, SegmentResult, GenerationResult
-from utils import (call_volc_api, compress_image_to_target, deploy_to_nginx, 
-                  extract_last_frame, merge_videos_ffmpeg, get_video_info, download_video, poll_video_task,
-                  setup_directories, cleanup_temp_files, confirm_with_user,
-                  display_storyboard, display_first_image, display_golden_hook_confirmation)
+from config import VOLC_CONFIG, NGINX_CONFIG, VIDEO_CONFIG, COMIC_STYLES, AGENT_CONFIG
+from models import StoryInput, StoryData, StorySegment, ImageResult, VideoResult, SegmentResult, GenerationResult
+from utils import (call_volc_api, score_image_variants, compress_image_to_target, deploy_to_nginx, deploy_image_bytes_to_nginx,
+                  extract_last_frame_bytes, merge_videos_ffmpeg, get_video_info, download_video, poll_video_task,
+                  setup_directories, cleanup_temp_files, confirm_with_user, TailFrameDecoder, SegmentNormalizer,
+                  IncrementalAssembler, probe_cache_stats, probe_duration, render_renditions, package_for_streaming,
+                  build_contact_sheet, measure_loudness, snap_to_allowed_duration, load_plan_table, probe_toolchain,
+                  no_text_threshold, get_plan_format, display_storyboard, display_first_image, display_golden_hook_confirmation)
 
-from agents import VideoDirectorAgent
+from agents import VideoDirectorAgent, ScriptDoctorAgent
 
 
+RUN_JOURNAL_NAME = "run_journal.json"
+RUN_JOURNAL_VERSION = 1
+
 NO_TEXT_SUFFIX = "，绝对无文字，无字幕，无对话框，无拟声词，无LOGO，无水印，无UI，无招牌，无书页文字，无屏幕文字，纯画面"
 
 
@@ -53,6 +59,10 @@ class VideoGenerator:
         self.config = config
         self.director = VideoDirectorAgent(config)
         self.setup_completed = False
+        self.text_check_stats = {"checked": 0, "flagged": 0, "regenerated": 0, "latency_ms": []}
+        self.reference_assets = None
+        self.reference_stats = {"generated": 0, "reused": 0, "conditioned": 0}
+        self.plan_format = get_plan_format()  # 本次运行的时长规格，决定镜头数上限与单镜时长归一
     
     def setup_environment(self):
         """设置生成环境"""
@@ -60,16 +70,21 @@ class VideoGenerator:
         
         if not setup_directories():
             return False
-        
-        # 检查FFmpeg
+
+        # 预加载时长规划表（批量模式下每部片只做 O(1) 查表）
         try:
-            import subprocess
-            result = subprocess.run(['ffmpeg', '-version'], capture_output=True, timeout=5)
-            if result.returncode == 0:
-                print("✅ FFmpeg已安装")
-            else:
-                print("⚠️  FFmpeg检查失败")
-        except:
+            plan_table = load_plan_table()
+            print(f"✅ 时长规划表已就绪: {len(plan_table)} 条")
+        except Exception as e:
+            print(f"⚠️ 时长规划表加载失败，将现场规划: {e}")
+        
+        # 检查FFmpeg（复用缓存的工具链探测，不再单独起 ffmpeg -version）
+        toolchain = probe_toolchain()
+        if toolchain.get("ffmpeg") and toolchain["ffmpeg"].get("version"):
+            print(f"✅ FFmpeg已安装: {toolchain['ffmpeg']['version']}")
+        elif toolchain.get("ffmpeg"):
+            print("⚠️  FFmpeg检查失败")
+        else:
             print("⚠️  FFmpeg未安装，尾帧提取功能可能受限")
         
         self.setup_completed = True
@@ -93,6 +108,7 @@ class VideoGenerator:
             # 2. 用户确认环节
             if not self._user_confirmation_workflow(story_data, production_plan):
                 return GenerationResult(status="cancelled", reason="用户取消生成")
+            self.director.script_doctor.remember_storyboard(user_input, story_data)
             
             # 3. 生成视频系列
             result = self._generate_video_series(story_data, user_input)
@@ -162,37 +178,66 @@ class VideoGenerator:
             json.dump({
                 "overall_title": story_data.overall_title,
                 "plot_twist": story_data.plot_twist,
-                "segments": [{
-                    "segment_number": seg.segment_number,
-                    "title": seg.title,
-                    "golden_hook": seg.golden_hook,
-                    "visual_prompt": seg.visual_prompt,
-                    "video_prompt": seg.video_prompt,
-                    "narration": seg.narration,
-                    "style_used": seg.style_used,
-                    "duration_sec": getattr(seg, 'duration_sec', VIDEO_CONFIG['video_duration']),
-                    "transition_strategy": getattr(seg, 'transition_strategy', 'hard_cut'),
-                    "transition_reason": getattr(seg, 'transition_reason', None)
-                } for seg in story_data.segments]
+                "segments": [self._segment_to_dict(seg) for seg in story_data.segments]
 
             }, f, ensure_ascii=False, indent=2)
         
         # 逐个生成分段视频
         all_results = []
         last_frame_path = None
+        last_frame_bytes = None
 
-        max_segments = int(VIDEO_CONFIG.get("max_segments", VIDEO_CONFIG.get("video_count", 10)))
+        self.plan_format = get_plan_format(getattr(user_input, "plan_format", None))
+        max_segments = int(self.plan_format["max_segments"])
         segment_count = min(max_segments, len(story_data.segments))
-        planned_total_sec = sum(
+        planned_durations = [
             int(getattr(seg, "duration_sec", VIDEO_CONFIG.get("video_duration", 4)) or VIDEO_CONFIG.get("video_duration", 4))
             for seg in story_data.segments[:segment_count]
-        )
+        ]
+        planned_total_sec = sum(planned_durations)
+
+        # 运行日志：逐段记录状态/产物，供 repair_segments 只重做失败或补齐的分段
+        journal = {
+            "version": RUN_JOURNAL_VERSION,
+            "story_input": asdict(user_input) if is_dataclass(user_input) else dict(vars(user_input)),
+            "overall_title": story_data.overall_title,
+            "plot_twist": story_data.plot_twist,
+            "planned_durations": planned_durations,
+            "final_video_path": "",
+            "segments": [
+                {**self._journal_segment_fields(seg), "status": "pending",
+                 "video_path": None, "image_url": None, "last_frame_path": None}
+                for seg in story_data.segments[:segment_count]
+            ],
+        }
+        self._write_run_journal(series_dir, journal)
+
+        # 角色/场景参考帧：复现的角色与场景只出一次图，后续分镜复用或作为条件图
+        self._prepare_reference_assets(story_data, series_dir)
 
         segments_dir = os.path.join(series_dir, "segments")
         frames_dir = os.path.join(series_dir, "frames")
 
         os.makedirs(segments_dir, exist_ok=True)
         os.makedirs(frames_dir, exist_ok=True)
+
+        # 下载即规格化：分段一落盘就提交后台规格化，与后续分段生成重叠
+        normalizer = None
+        if VIDEO_CONFIG.get("normalize_on_download", False):
+            normalizer = SegmentNormalizer(
+                os.path.join(segments_dir, "normalized"),
+                keep_audio=not bool(VIDEO_CONFIG.get("force_no_audio", False)),
+            )
+
+        # 增量拼装：分段按时间线顺序到齐即追加，最后一段落盘后只剩一次 concat copy
+        final_video_path = os.path.join(series_dir, "final_30s.mp4")
+        assembler = None
+        if VIDEO_CONFIG.get("incremental_assembly", True):
+            assembler = IncrementalAssembler(
+                final_video_path, segment_count,
+                force_no_audio=bool(VIDEO_CONFIG.get("force_no_audio", False)),
+                preview=bool(VIDEO_CONFIG.get("partial_preview", True)),
+            )
         
         for idx, segment in enumerate(story_data.segments[:segment_count], 1):
 
@@ -200,13 +245,28 @@ class VideoGenerator:
 
             segment_result = self._generate_single_segment(
                 segment, segment.segment_number, last_frame_path, series_dir,
-                is_last_segment=(idx == segment_count)
+                is_last_segment=(idx == segment_count),
+                last_frame_bytes=last_frame_bytes,
             )
 
             
+            self._record_segment_in_journal(journal, idx, segment_result)
+            self._write_run_journal(series_dir, journal)
+
             if segment_result:
                 all_results.append(segment_result)
                 last_frame_path = segment_result.last_frame_path
+                last_frame_bytes = segment_result.last_frame_bytes
+                src = segment_result.video_result.series_path or segment_result.video_result.local_path
+                if segment_result.video_result.status == "success" and src and os.path.exists(src):
+                    if normalizer:
+                        future = normalizer.submit(segment.segment_number, src)
+                        if assembler:
+                            future.add_done_callback(
+                                lambda f, i=idx, s=src: assembler.add(i, s if f.exception() else f.result(), s)
+                            )
+                    elif assembler:
+                        assembler.add(idx, src)
                 
                 # 显示进度
                 total_segments = segment_count if segment_count > 0 else 1
@@ -219,35 +279,126 @@ class VideoGenerator:
         # 统计成功视频数
         successful_videos = sum(1 for r in all_results if r.video_result.status == "success")
 
-        # 自动合成约30秒成片（全部分段成功才合成）
-        final_video_path = ""
-        if successful_videos == segment_count and segment_count > 0:
+        # 自动合成约30秒成片（全部分段成功才合成；未到齐时保留增量预览片）
+        preview_video_path = ""
+        merged_durations = None
+        if successful_videos == segment_count and segment_count > 0 and assembler:
+            if normalizer:
+                print("⏳ 等待后台分段规格化完成...")
+                normalizer.shutdown()
+            try:
+                _, merged_durations = assembler.finalize(target_duration_sec=planned_total_sec,
+                                                         planned_durations=planned_durations)
+                print(f"✅ 已自动合成成片: {final_video_path}")
+            except Exception as e:
+                final_video_path = ""
+                print(f"⚠️ 自动合成失败: {e}")
+        elif successful_videos == segment_count and segment_count > 0:
 
             segment_paths = []
             for r in all_results:
                 p = r.video_result.series_path or r.video_result.local_path
                 if p and os.path.exists(p):
                     segment_paths.append(p)
+            source_paths = list(segment_paths)
+            if normalizer:
+                print("⏳ 等待后台分段规格化完成...")
+                segment_paths = normalizer.result_paths(segment_paths)
 
             try:
-                final_video_path = os.path.join(series_dir, "final_30s.mp4")
-                merge_videos_ffmpeg(
+                _, merged_durations = merge_videos_ffmpeg(
                     segment_paths,
                     final_video_path,
                     target_duration_sec=planned_total_sec,
                     force_no_audio=bool(VIDEO_CONFIG.get("force_no_audio", False)),
+                    planned_durations=planned_durations,
+                    loudness_sources=source_paths,
                 )
 
 
                 print(f"✅ 已自动合成成片: {final_video_path}")
             except Exception as e:
+                final_video_path = ""
                 print(f"⚠️ 自动合成失败: {e}")
+        else:
+            final_video_path = ""
+            if assembler:
+                assembler.wait_preview()
+                if assembler.preview_path and os.path.exists(assembler.preview_path):
+                    preview_video_path = assembler.preview_path
+                    print(f"🧱 分段未全部成功，已保留前 {len(assembler.timeline)} 段预览: {preview_video_path}")
+
+        if normalizer:
+            normalizer.shutdown()
+        if assembler:
+            assembler.shutdown()
+
+        journal["final_video_path"] = final_video_path
+        self._write_run_journal(series_dir, journal)
+
+        if self.reference_assets:
+            print(f"🧷 参考帧: 新生成 {self.reference_stats['generated']} 张，复用首图 {self.reference_stats['reused']} 次，"
+                  f"条件出图 {self.reference_stats['conditioned']} 次")
+
+        # 多版本输出：一次解码产出各画幅/预览版
+        rendition_paths = {}
+        if final_video_path and os.path.exists(final_video_path) and VIDEO_CONFIG.get("render_renditions", False):
+            try:
+                rendition_paths = render_renditions(
+                    final_video_path, VIDEO_CONFIG.get("output_renditions", []),
+                    force_no_audio=bool(VIDEO_CONFIG.get("force_no_audio", False)),
+                )
+                print(f"✅ 多版本输出完成: {len(rendition_paths)} 个")
+            except Exception as e:
+                print(f"⚠️ 多版本输出失败: {e}")
+
+        # 审片素材：联系表/海报/缩略图条（分段有成功即生成，尾帧复用已提取的 JPEG）
+        review_assets = {}
+        if VIDEO_CONFIG.get("contact_sheet", True):
+            review_paths, tail_frames = [], {}
+            for r in all_results:
+                p = r.video_result.series_path or r.video_result.local_path
+                if r.video_result.status == "success" and p and os.path.exists(p):
+                    review_paths.append(p)
+                    if r.last_frame_path:
+                        tail_frames[len(review_paths)] = r.last_frame_path
+            if review_paths:
+                try:
+                    review_assets = build_contact_sheet(review_paths, os.path.join(series_dir, "review"), tail_frames)
+                    print(f"✅ 审片素材已生成: {review_assets.get('contact_sheet')}")
+                except Exception as e:
+                    print(f"⚠️ 审片素材生成失败: {e}")
+
+        # 流媒体封装：按分镜边界切片（stream copy），边界取合成时各分段裁切后在成片中的实际时长
+        stream_playlist_path = ""
+        packaging = VIDEO_CONFIG.get("stream_packaging")
+        if final_video_path and os.path.exists(final_video_path) and packaging:
+            shot_durations = merged_durations
+            if not shot_durations:
+                shot_durations = []
+                for r, seg in zip(all_results, story_data.segments[:segment_count]):
+                    p = r.video_result.series_path or r.video_result.local_path
+                    shot_durations.append(
+                        (probe_duration(p, container=True) if p and os.path.exists(p) else None)
+                        or getattr(seg, "duration_sec", VIDEO_CONFIG.get("video_duration", 4))
+                    )
+            try:
+                stream_playlist_path = package_for_streaming(
+                    final_video_path, shot_durations, os.path.join(series_dir, f"stream_{packaging}"),
+                    fmt=packaging, force_no_audio=bool(VIDEO_CONFIG.get("force_no_audio", False)),
+                )
+                print(f"✅ 流媒体封装完成: {stream_playlist_path}")
+            except Exception as e:
+                print(f"⚠️ 流媒体封装失败: {e}")
 
         # 生成合并说明（保留为日志/说明文件）
         merge_instructions = self._generate_merge_instructions(all_results, series_dir, story_data)
 
         # 生成详细报告
-        detailed_report = self._generate_detailed_report(user_input, story_data, all_results, series_dir, merge_instructions)
+        detailed_report = self._generate_detailed_report(user_input, story_data, all_results, series_dir, merge_instructions,
+                                                         rendition_paths=rendition_paths,
+                                                         stream_playlist_path=stream_playlist_path,
+                                                         review_assets=review_assets)
 
         return GenerationResult(
             status="completed",
@@ -257,12 +408,286 @@ class VideoGenerator:
             merge_instructions=merge_instructions,
             detailed_report=detailed_report,
             final_video_path=final_video_path,
+            preview_video_path=preview_video_path,
+            rendition_paths=rendition_paths,
+            stream_playlist_path=stream_playlist_path,
+            review_assets=review_assets,
             all_results=all_results
         )
 
+
+    def _prepare_reference_assets(self, story_data, series_dir):
+        """按 VIDEO_CONFIG["reference_frames"] 准备本片参考帧，清单存于 references/references.json（修复时复用）。
+
+        - reuse: 同一地点+角色组合的分镜，首个分镜出图后登记为参考帧，其余分镜直接复用为首图（不再出图）
+        - condition: 先为每个复现角色/场景各出一张参考帧，分镜出图时作为 Seedream 条件图传入
+        """
+        self.reference_assets = None
+        mode = VIDEO_CONFIG.get("reference_frames")
+        if mode not in ("reuse", "condition") or not story_data.segments:
+            return
+
+        ref_dir = os.path.join(series_dir, "references")
+        os.makedirs(ref_dir, exist_ok=True)
+        manifest_path = os.path.join(ref_dir, "references.json")
+        frames = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    frames = json.load(f).get("frames", {})
+            except Exception as e:
+                print(f"⚠️ 参考帧清单读取失败，将重新生成: {e}")
+        plan = self.director.visual_director.plan_reference_assets(
+            story_data, min_shots=int(VIDEO_CONFIG.get("reference_min_shots", 2)))
+        self.reference_assets = {"mode": mode, "dir": ref_dir, "manifest": manifest_path, "plan": plan, "frames": frames}
+
+        if mode == "condition":
+            style_key = story_data.segments[0].style_used
+            for kind, groups in (("character", plan["characters"]), ("location", plan["locations"])):
+                for name, numbers in groups.items():
+                    key = f"{kind}:{name}"
+                    if key in frames and os.path.exists(frames[key]["path"]):
+                        continue
+                    first = story_data.segments[numbers[0] - 1]
+                    if kind == "character":
+                        prompt = f"角色参考图：{name}，{first.visual_prompt}，单人，正面半身，面部与服装清晰，简洁背景"
+                    else:
+                        prompt = f"场景参考图：{name}，{first.visual_prompt}，空镜，无人物，完整展示环境"
+                    print(f"🧷 生成{'角色' if kind == 'character' else '场景'}参考帧: {name}")
+                    image_result = self.generate_comic_image(ensure_no_text_prompt(prompt), style_key, "ref")
+                    if image_result.is_fallback or not image_result.local_path:
+                        continue
+                    path = os.path.join(ref_dir, f"{kind}_{len(frames) + 1:02d}.png")
+                    try:
+                        shutil.move(image_result.local_path, path)
+                        compressed = compress_image_to_target(path)
+                        url = deploy_to_nginx(compressed, f"ref_{kind}")["public_url"]
+                    except Exception as e:
+                        print(f"⚠️ 参考帧部署失败，跳过: {e}")
+                        continue
+                    frames[key] = {"path": compressed, "url": url, "segments": numbers}
+                    self.reference_stats["generated"] += 1
+            self._save_reference_manifest()
+
+    def _save_reference_manifest(self):
+        assets = self.reference_assets
+        with open(assets["manifest"], 'w', encoding='utf-8') as f:
+            json.dump({"mode": assets["mode"], "plan": assets["plan"], "frames": assets["frames"]},
+                      f, ensure_ascii=False, indent=2)
+
+    def _reused_reference_frame(self, segment):
+        """reuse 模式：该分镜的地点+角色组合已有参考帧（且不是它自己登记的）时返回参考帧路径"""
+        assets = self.reference_assets
+        if not assets or assets["mode"] != "reuse":
+            return None
+        entry = assets["frames"].get(f"shot:{self.director.visual_director.shot_reference_key(segment)}")
+        if entry and entry.get("segment") != segment.segment_number and os.path.exists(entry["path"]):
+            return entry["path"]
+        return None
+
+    def _register_reference_frame(self, segment, image_path):
+        """reuse 模式：把复现组合中首个出图分镜的首帧登记为参考帧"""
+        assets = self.reference_assets
+        if not assets or assets["mode"] != "reuse":
+            return
+        shot_key = self.director.visual_director.shot_reference_key(segment)
+        key = f"shot:{shot_key}"
+        if shot_key not in assets["plan"]["shots"] or key in assets["frames"]:
+            return
+        path = os.path.join(assets["dir"], f"shot_{len(assets['frames']) + 1:02d}{os.path.splitext(image_path)[1]}")
+        shutil.copyfile(image_path, path)
+        assets["frames"][key] = {"path": path, "segment": segment.segment_number,
+                                 "segments": assets["plan"]["shots"][shot_key]}
+        self._save_reference_manifest()
+        print(f"📌 登记参考帧（第{assets['plan']['shots'][shot_key]}镜共用）: {os.path.basename(path)}")
+
+    def _reference_urls(self, segment):
+        """condition 模式：该分镜出场角色与地点对应的参考帧 URL（最多 reference_max_images 张）"""
+        assets = self.reference_assets
+        if not assets or assets["mode"] != "condition":
+            return []
+        keys = [f"character:{name}" for name in (getattr(segment, "characters", None) or [])]
+        if getattr(segment, "location", ""):
+            keys.append(f"location:{segment.location}")
+        urls = [assets["frames"][k]["url"] for k in keys if k in assets["frames"]]
+        urls = urls[:int(VIDEO_CONFIG.get("reference_max_images", 4))]
+        if urls:
+            self.reference_stats["conditioned"] += 1
+        return urls
+
+    @staticmethod
+    def _segment_to_dict(seg):
+        """分镜序列化（production_script.json / run_journal.json 共用）"""
+        return {
+            "segment_number": seg.segment_number,
+            "title": seg.title,
+            "golden_hook": seg.golden_hook,
+            "visual_prompt": seg.visual_prompt,
+            "video_prompt": seg.video_prompt,
+            "narration": seg.narration,
+            "style_used": seg.style_used,
+            "duration_sec": getattr(seg, 'duration_sec', VIDEO_CONFIG['video_duration']),
+            "transition_strategy": getattr(seg, 'transition_strategy', 'hard_cut'),
+            "transition_reason": getattr(seg, 'transition_reason', None),
+            "characters": list(getattr(seg, 'characters', None) or []),
+            "location": getattr(seg, 'location', '') or ''
+        }
+
+    @staticmethod
+    def _journal_segment_fields(seg):
+        """运行日志中的分镜字段：完整可还原 StorySegment，并标记是否为“补充分镜”"""
+        return {
+            **VideoGenerator._segment_to_dict(seg),
+            "aspect_ratio": seg.aspect_ratio,
+            "keywords": seg.keywords,
+            "filler": ScriptDoctorAgent.is_filler_segment(seg),
+        }
+
+    @staticmethod
+    def _record_segment_in_journal(journal, index, segment_result, segment=None):
+        """把第 index 段（1 起）的生成结果写入运行日志；segment 非空时同时更新分镜内容"""
+        entry = journal["segments"][index - 1]
+        if segment is not None:
+            entry.update(VideoGenerator._journal_segment_fields(segment))
+        if segment_result is None:
+            entry["status"] = "failed"
+            return
+        video_path = segment_result.video_result.series_path or segment_result.video_result.local_path
+        ok = segment_result.video_result.status == "success" and video_path and os.path.exists(video_path)
+        entry.update({
+            "status": "success" if ok else "failed",
+            "video_path": video_path if ok else None,
+            "image_url": segment_result.image_url,
+            "last_frame_path": segment_result.last_frame_path,
+        })
+
+    @staticmethod
+    def _write_run_journal(series_dir, journal):
+        """原子写入 run_journal.json（先写临时文件再替换，中途崩溃不留半截日志）"""
+        journal["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        path = os.path.join(series_dir, RUN_JOURNAL_NAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(journal, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def repair_segments(self, series_dir, segment_numbers=None, rewrite_numbers=None):
+        """按运行日志只重做指定分段，其余分段原样复用，全部成功后重新合成成片。
+
+        - segment_numbers: 要重做图片+视频的分段（1 起）；默认取日志中失败/未生成的分段与“补充分镜”
+        - rewrite_numbers: 先以相邻分镜为上下文重写分镜脚本的分段；默认取其中的“补充分镜”
+        """
+        journal_path = os.path.join(series_dir, RUN_JOURNAL_NAME)
+        if not os.path.exists(journal_path):
+            return GenerationResult(status="failed", series_dir=series_dir, reason=f"未找到运行日志: {journal_path}")
+        if not self.setup_completed and not self.setup_environment():
+            return GenerationResult(status="failed", reason="环境设置失败")
+
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            journal = json.load(f)
+        entries = journal["segments"]
+        story_input = StoryInput(**journal.get("story_input", {}))
+        self.plan_format = get_plan_format(story_input.plan_format)
+        fields = {field.name for field in dataclass_fields(StorySegment)}
+        story_data = StoryData(
+            overall_title=journal.get("overall_title", ""),
+            plot_twist=journal.get("plot_twist", ""),
+            segments=[StorySegment(**{k: v for k, v in e.items() if k in fields}) for e in entries],
+        )
+
+        def usable(entry):
+            return entry["status"] == "success" and entry.get("video_path") and os.path.exists(entry["video_path"])
+
+        invalid = sorted(n for n in set(segment_numbers or []) | set(rewrite_numbers or [])
+                         if not 1 <= n <= len(entries))
+        if invalid:
+            return GenerationResult(status="failed", series_dir=series_dir,
+                                    reason=f"分段编号超出范围: {invalid}（本系列共 {len(entries)} 段，编号从 1 开始）")
+
+        if segment_numbers is None:
+            segment_numbers = [e["segment_number"] for e in entries if not usable(e) or e.get("filler")]
+        if rewrite_numbers is None:
+            rewrite_numbers = [n for n in segment_numbers if entries[n - 1].get("filler")]
+        segment_numbers = sorted(set(segment_numbers) | set(rewrite_numbers))
+        if not segment_numbers:
+            print("✅ 运行日志中所有分段均已成功，无需修复")
+        else:
+            print(f"🩹 修复分段: {segment_numbers}（重写分镜: {sorted(rewrite_numbers) or '无'}），其余 "
+                  f"{len(entries) - len(segment_numbers)} 段复用")
+
+        if segment_numbers:
+            self._prepare_reference_assets(story_data, series_dir)
+
+        for n in segment_numbers:
+            segment = story_data.segments[n - 1]
+            if n in rewrite_numbers:
+                rebuilt = self.director.script_doctor.regenerate_segment(story_data, n, story_input)
+                if rebuilt is not None:
+                    story_data.segments[n - 1] = segment = rebuilt
+
+            previous_tail = os.path.join(series_dir, "frames", f"tail_{n - 1:02d}.jpg")
+            print(f"\n🎬 重做第{n}段: {segment.title}")
+            segment_result = self._generate_single_segment(
+                segment, n, previous_tail if os.path.exists(previous_tail) else None, series_dir,
+                is_last_segment=(n == len(entries)),
+            )
+            self._record_segment_in_journal(journal, n, segment_result, segment)
+            self._write_run_journal(series_dir, journal)
+
+            following = story_data.segments[n] if n < len(entries) else None
+            if (following is not None and following.transition_strategy == "tailframe_continue"
+                    and n + 1 not in segment_numbers):
+                print(f"⚠️ 第{n + 1}段以本段尾帧续接，本段重做后两段衔接可能不连贯，可一并修复")
+
+        segment_paths = [e.get("video_path") for e in entries]
+        successful_videos = sum(1 for e in entries if usable(e))
+        final_video_path = ""
+        existing_final = journal.get("final_video_path")
+        if not segment_numbers and existing_final and os.path.exists(existing_final):
+            final_video_path = existing_final
+        elif successful_videos == len(entries):
+            final_video_path = os.path.join(series_dir, "final_30s.mp4")
+            planned_durations = journal.get("planned_durations") or [e["duration_sec"] for e in entries]
+            try:
+                merge_videos_ffmpeg(
+                    segment_paths,
+                    final_video_path,
+                    target_duration_sec=sum(planned_durations),
+                    force_no_audio=bool(VIDEO_CONFIG.get("force_no_audio", False)),
+                    planned_durations=planned_durations,
+                )
+                print(f"✅ 已重新合成成片: {final_video_path}")
+            except Exception as e:
+                final_video_path = ""
+                print(f"⚠️ 重新合成失败: {e}")
+        else:
+            print(f"⚠️ 仍有 {len(entries) - successful_videos} 段未成功，可再次运行修复")
+
+        journal["final_video_path"] = final_video_path
+        self._write_run_journal(series_dir, journal)
+
+        script_path = os.path.join(series_dir, "production_script.json")
+        with open(script_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "overall_title": story_data.overall_title,
+                "plot_twist": story_data.plot_twist,
+                "segments": [self._segment_to_dict(seg) for seg in story_data.segments]
+            }, f, ensure_ascii=False, indent=2)
+
+        return GenerationResult(
+            status="completed",
+            successful_videos=successful_videos,
+            total_segments=len(entries),
+            series_dir=series_dir,
+            final_video_path=final_video_path,
+        )
     
-    def _generate_single_segment(self, segment, segment_number, last_frame_path, series_dir, is_last_segment=False):
-        """生成单个分段视频"""
+    def _generate_single_segment(self, segment, segment_number, last_frame_path, series_dir, is_last_segment=False,
+                                 last_frame_bytes=None):
+        """生成单个分段视频
+
+        last_frame_bytes: 上一段尾帧的JPEG字节（内存交接），存在时直接压缩并发布，不再重读磁盘文件
+        """
 
         print(f"\n📹 生成第{segment_number}段视频...")
         
@@ -274,17 +699,23 @@ class VideoGenerator:
         segment.video_prompt = ensure_no_text_prompt(getattr(segment, "video_prompt", "") or "")
 
         # 生成或使用首图（是否尾帧续接由剧情策略决定）
-        if use_tailframe and segment_number > 1 and last_frame_path and os.path.exists(last_frame_path):
+        image_to_use = None
+        image_bytes_to_use = None
+        reused_frame = self._reused_reference_frame(segment)
+        if use_tailframe and segment_number > 1 and last_frame_bytes:
+            print("🔄 转场策略=tailframe_continue：使用上一段尾帧作为首图（内存交接）")
+            image_bytes_to_use = last_frame_bytes
+        elif use_tailframe and segment_number > 1 and last_frame_path and os.path.exists(last_frame_path):
 
             print("🔄 转场策略=tailframe_continue：使用上一段尾帧作为首图")
             image_to_use = last_frame_path
+        elif reused_frame:
+            image_to_use = reused_frame
+            self.reference_stats["reused"] += 1
+            print(f"♻️ 同一场景/角色组合复用参考帧作为首图（省一次出图）: {os.path.basename(image_to_use)}")
         else:
             print("🖼️ 生成首帧图片...")
-            image_result = self.generate_comic_image(segment.visual_prompt, segment.style_used)
-
-            if not image_result or not image_result.local_path:
-                print("❌ 图片生成失败，使用备用方案")
-                image_result = self.create_fallback_image(segment.visual_prompt, segment.style_used)
+            image_result = self._generate_text_free_image(segment)
 
             compressed_path = compress_image_to_target(image_result.local_path)
 
@@ -293,18 +724,24 @@ class VideoGenerator:
                 if not display_first_image(compressed_path, image_result.local_path, {
                     "segment_number": segment_number,
                     "title": segment.title,
-                    "visual_prompt": segment.visual_prompt
+                    "visual_prompt": segment.visual_prompt,
+                    "text_score": image_result.text_score,
                 }):
                     print("❌ 用户取消了图片")
                     return None
 
             image_to_use = compressed_path
+            if not image_result.is_fallback:
+                self._register_reference_frame(segment, compressed_path)
 
         
         # 部署图片到Nginx
         print("🌐 部署图片到服务器...")
         try:
-            deploy_result = deploy_to_nginx(image_to_use, segment.title)
+            if image_bytes_to_use is not None:
+                deploy_result = deploy_image_bytes_to_nginx(image_bytes_to_use, segment.title)
+            else:
+                deploy_result = deploy_to_nginx(image_to_use, segment.title)
             image_url = deploy_result["public_url"]
         except Exception as e:
             print(f"❌ 图片部署失败: {e}")
@@ -318,9 +755,13 @@ class VideoGenerator:
             duration_sec = int(duration_sec)
         except Exception:
             duration_sec = int(VIDEO_CONFIG.get("video_duration", 4))
-        duration_sec = 5 if duration_sec >= 5 else 4
+        duration_sec = snap_to_allowed_duration(duration_sec, self.plan_format["allowed"], self.plan_format["min_duration"])
 
-        video_result = self.generate_video_from_image(image_url, segment.video_prompt, output_name, duration_sec=duration_sec)
+        capture_tail_frame = (not is_last_segment) and bool(VIDEO_CONFIG.get("tail_frame_during_download", False))
+        video_result = self.generate_video_from_image(
+            image_url, segment.video_prompt, output_name,
+            duration_sec=duration_sec, capture_tail_frame=capture_tail_frame,
+        )
 
 
         
@@ -337,13 +778,18 @@ class VideoGenerator:
                 shutil.move(video_result.local_path, new_video_path)
                 video_result.series_path = new_video_path
                 video_result.video_info = get_video_info(new_video_path)
+                if VIDEO_CONFIG.get("loudness_normalization", False):
+                    loudness = measure_loudness(new_video_path)
+                    if loudness:
+                        print(f"🔊 分段响度: {loudness['input_i']} LUFS（已缓存）")
                 print(f"✅ 视频已保存: {new_video_path}")
             except Exception as e:
                 print(f"⚠️ 移动视频失败: {e}")
                 video_result.series_path = video_result.local_path
         
-        # 提取尾帧（如果不是最后一段）
+        # 提取尾帧（如果不是最后一段）：单次ffmpeg经stdout取JPEG字节，内存交给下一段；磁盘仅留存档
         last_frame_path = None
+        last_frame_bytes = None
         if (not is_last_segment) and video_result.status == "success" and video_result.series_path:
 
 
@@ -353,10 +799,15 @@ class VideoGenerator:
 
             
             try:
-                extracted_frame = extract_last_frame(video_result.series_path, frame_path)
-                if extracted_frame:
-                    last_frame_path = extracted_frame
-                    print(f"✅ 尾帧已保存: {frame_path}")
+                if video_result.tail_frame_bytes:
+                    print("   ⚡ 使用下载过程中已解码的尾帧")
+                    last_frame_bytes = video_result.tail_frame_bytes
+                else:
+                    last_frame_bytes = extract_last_frame_bytes(video_result.series_path)
+                with open(frame_path, 'wb') as f:
+                    f.write(last_frame_bytes)
+                last_frame_path = frame_path
+                print(f"✅ 尾帧已保存: {frame_path} ({len(last_frame_bytes) / 1024:.1f} KB)")
             except Exception as e:
                 print(f"⚠️ 尾帧提取失败: {e}")
         
@@ -368,11 +819,117 @@ class VideoGenerator:
             video_prompt=segment.video_prompt,
             image_url=image_url,
             video_result=video_result,
-            last_frame_path=last_frame_path
+            last_frame_path=last_frame_path,
+            last_frame_bytes=last_frame_bytes,
         )
     
-    def generate_comic_image(self, visual_prompt, style_key):
-        """生成首帧图片（严格无字）"""
+    def _generate_text_free_image(self, segment):
+        """生成首帧：并发生成 max_variants 张候选，批量评分（清晰度/曝光/无字）后择优。
+
+        最佳候选仍疑似含字时，在提交视频前整批重生成；仍超标则取无字分数最低的一张。
+        """
+        variant_count = max(1, int(AGENT_CONFIG["visual_director"].get("max_variants", 1) or 1))
+        check_text = bool(VIDEO_CONFIG.get("no_text_check", True))
+        threshold = no_text_threshold()
+        max_regenerations = int(VIDEO_CONFIG.get("no_text_max_regenerations", 2)) if check_text else 0
+        best = None
+        fallback = None
+
+        for attempt in range(max_regenerations + 1):
+            candidates = self._generate_image_variants(segment, variant_count)
+            chosen = self._select_best_image(candidates, check_text, threshold)
+            if chosen.is_fallback:
+                # 备用图未参与无字评分：不算通过，也不顶替之前的真实候选
+                fallback = chosen
+                if attempt == max_regenerations:
+                    break
+                print(f"🔁 本轮出图全部失败，重新生成首帧 ({attempt + 1}/{max_regenerations})...")
+                continue
+            if not check_text or chosen.text_score is None:
+                return chosen
+
+            if best is None or chosen.text_score < best.text_score:
+                best = chosen
+            if chosen.text_score <= threshold:
+                print(f"🔤 无字检测通过 (分数 {chosen.text_score:.2f} ≤ {threshold:.2f})")
+                return chosen
+
+            self.text_check_stats["flagged"] += 1
+            print(f"⚠️ 首帧疑似含文字 (分数 {chosen.text_score:.2f} > {threshold:.2f})")
+            if attempt == max_regenerations:
+                break
+            print(f"🔁 自动重生成首帧 ({attempt + 1}/{max_regenerations})...")
+            self.text_check_stats["regenerated"] += 1
+
+        if best is None:
+            return fallback
+        print(f"⚠️ 重生成后仍疑似含字，使用分数最低的一张 ({best.text_score:.2f})")
+        return best
+
+    def _generate_image_variants(self, segment, variant_count):
+        """并发生成多张候选首帧（每个请求 n=1，避免单请求多图时串行出图）"""
+        reference_urls = self._reference_urls(segment)
+        if reference_urls:
+            print(f"🧷 以 {len(reference_urls)} 张角色/场景参考帧作为条件图")
+        if variant_count <= 1:
+            return [self.generate_comic_image(segment.visual_prompt, segment.style_used, reference_urls=reference_urls)]
+
+        print(f"🎨 并发生成 {variant_count} 张候选首帧...")
+        with ThreadPoolExecutor(max_workers=variant_count) as executor:
+            futures = [
+                executor.submit(self.generate_comic_image, segment.visual_prompt, segment.style_used, i, reference_urls)
+                for i in range(variant_count)
+            ]
+            return [f.result() for f in futures]
+
+    def _select_best_image(self, candidates, check_text=True, threshold=None):
+        """批量评分候选首帧并交由质量检测官择优；缺少 OpenCV/NumPy 时直接取第一张有效图
+
+        开启无字检测时只在无字分数不超过 threshold 的候选中择优，全部超标才在整批中择优。
+        """
+        real = [c for c in candidates if c and c.local_path and not c.is_fallback]
+        if not real:
+            print("❌ 图片生成失败，使用备用方案")
+            fallback = candidates[0]  # generate_comic_image 失败时已返回备用图
+            fallback.text_score = None  # 备用图未经评分
+            return fallback
+        if len(real) == 1 and not check_text:
+            return real[0]
+
+        start = time.time()
+        try:
+            scores = score_image_variants([c.local_path for c in real])
+        except ImportError as e:
+            print(f"⚠️ 首帧评分不可用（缺少依赖: {e}），跳过无字检测与择优")
+            return real[0]
+        latency_ms = (time.time() - start) * 1000
+        self.text_check_stats["checked"] += len(real)
+        self.text_check_stats["latency_ms"].append(latency_ms)
+        print(f"🔤 首帧评分 {len(real)} 张（清晰度/曝光/无字），耗时 {latency_ms:.0f}ms")
+
+        variants = []
+        for image_result, score in zip(real, scores):
+            image_result.text_score = score["text_score"]
+            variants.append({"image_result": image_result, **score})
+        if len(variants) == 1:
+            return real[0]
+        # 已有通过无字门限的候选时不让更清晰但疑似含字的一张胜出（否则会白白触发整批重生成）
+        if check_text and threshold is not None:
+            passing = [v for v in variants if v["text_score"] <= threshold]
+            if passing and len(passing) < len(variants):
+                print(f"🔤 {len(passing)}/{len(variants)} 张候选通过无字检测，仅在其中择优")
+            variants = passing or variants
+        if len(variants) == 1:
+            return variants[0]["image_result"]
+        return self.director.quality_inspector.select_best_variant(variants)["image_result"]
+
+    def generate_comic_image(self, visual_prompt, style_key, variant_index=0, reference_urls=None):
+        """生成首帧图片（严格无字）；variant_index 区分并发候选的文件名
+
+        reference_urls: 角色/场景参考帧的公网 URL，作为 Seedream 的 image 条件图（保持跨镜一致）
+        """
+        from PIL import Image, ImageEnhance
+
         style_config = COMIC_STYLES.get(style_key, COMIC_STYLES["cinematic"])
         style_name = style_config.get("name", style_key)
 
@@ -397,6 +954,9 @@ class VideoGenerator:
             "response_format": "b64_json",
             "watermark": False,
         }
+        if reference_urls:
+            payload["image"] = reference_urls[0] if len(reference_urls) == 1 else list(reference_urls)
+            payload["sequential_image_generation"] = "disabled"
 
         negative_common = "文字,字幕,对话框,拟声词,水印,logo,LOGO,UI,界面,按钮,招牌,书页文字,屏幕文字,二维码,低质量,模糊,变形,畸形"
         if style_key == "cinematic":
@@ -431,7 +991,7 @@ class VideoGenerator:
                 image = enhancer.enhance(1.1)
 
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                local_filename = f"comic_frame_{timestamp}.png"
+                local_filename = f"comic_frame_{timestamp}_{variant_index}.png"
                 local_path = os.path.join(".", local_filename)
 
                 image.save(local_path, "PNG", optimize=True, quality=95)
@@ -453,10 +1013,12 @@ class VideoGenerator:
 
         except Exception as e:
             print(f"❌ 图片生成失败: {e}")
-            return self.create_fallback_image(visual_prompt, style_key)
+            return self.create_fallback_image(visual_prompt, style_key, variant_index)
 
-    def create_fallback_image(self, prompt, style_key="cinematic"):
+    def create_fallback_image(self, prompt, style_key="cinematic", variant_index=0):
         """创建备用图片 - 基于原脚本重构"""
+        from PIL import Image, ImageDraw
+
         print("⚠️ 创建备用图片...")
 
         width, height = map(int, VIDEO_CONFIG["image_size"].split('x'))
@@ -501,7 +1063,7 @@ class VideoGenerator:
                 draw.line([(0, y), (width, y)], fill=(color_value, color_value, color_value + 20))
 
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"fallback_{timestamp}.png"
+        filename = f"fallback_{timestamp}_{variant_index}.png"
         local_path = os.path.join(".", filename)
         image.save(local_path, "PNG", quality=90)
 
@@ -516,8 +1078,11 @@ class VideoGenerator:
         )
 
     
-    def generate_video_from_image(self, image_url, prompt_text, output_name, duration_sec=None):
-        """从图片生成视频 - 基于原脚本重构"""
+    def generate_video_from_image(self, image_url, prompt_text, output_name, duration_sec=None, capture_tail_frame=False):
+        """从图片生成视频 - 基于原脚本重构
+
+        capture_tail_frame: 为 True 时下载过程中同步解码尾帧，结果放在 VideoResult.tail_frame_bytes
+        """
         print(f"🎬 生成视频: {output_name}")
 
         dur = int(duration_sec or VIDEO_CONFIG['video_duration'])
@@ -561,7 +1126,16 @@ class VideoGenerator:
             video_url = poll_video_task(task_id)
             
             if video_url:
-                video_path = download_video(video_url, output_name)
+                tail_decoder = None
+                if capture_tail_frame:
+                    try:
+                        tail_decoder = TailFrameDecoder()
+                    except FileNotFoundError:
+                        print("⚠️ 未找到ffmpeg，跳过边下边解尾帧")
+                    except RuntimeError as e:
+                        print(f"⚠️ {e}，跳过边下边解尾帧（下载后再提取）")
+                video_path = download_video(video_url, output_name, tail_decoder=tail_decoder)
+                tail_frame_bytes = tail_decoder.finish() if (tail_decoder and video_path) else None
                 video_info = get_video_info(video_path) if video_path else {}
                 
                 return VideoResult(
@@ -569,7 +1143,8 @@ class VideoGenerator:
                     video_url=video_url,
                     local_path=video_path,
                     status="success",
-                    video_info=video_info
+                    video_info=video_info,
+                    tail_frame_bytes=tail_frame_bytes,
                 )
             else:
                 return VideoResult(
@@ -592,6 +1167,7 @@ class VideoGenerator:
             for seg in getattr(story_data, "segments", [])[:segment_count]
         ]
         total_sec = sum(planned_durations) if planned_durations else 0
+        duration_options = "/".join(str(d) for d in self.plan_format["allowed"])
 
 
         final_path = os.path.join(series_dir, "final_30s.mp4")
@@ -645,9 +1221,9 @@ class VideoGenerator:
             f.write("-"*40 + "\n")
             f.write(f"• 图片尺寸: {VIDEO_CONFIG['image_size']}\n")
             if planned_durations:
-                f.write(f"• 视频时长: 4/5秒混合（duration_sec: {planned_durations}）\n")
+                f.write(f"• 视频时长: {duration_options}秒混合（duration_sec: {planned_durations}）\n")
             else:
-                f.write("• 视频时长: 4/5秒混合\n")
+                f.write(f"• 视频时长: {duration_options}秒混合\n")
 
             f.write(f"• 画面比例: {VIDEO_CONFIG['aspect_ratio']}\n")
             f.write("• 尾帧续接: 由分镜 transition_strategy 决定\n")
@@ -657,7 +1233,8 @@ class VideoGenerator:
         return instructions_path
 
     
-    def _generate_detailed_report(self, user_input, story_data, all_results, series_dir, merge_instructions):
+    def _generate_detailed_report(self, user_input, story_data, all_results, series_dir, merge_instructions,
+                                  rendition_paths=None, stream_playlist_path="", review_assets=None):
         """生成详细报告"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         report_path = os.path.join(series_dir, f"production_report_{timestamp}.txt")
@@ -689,12 +1266,22 @@ class VideoGenerator:
                 int(getattr(seg, "duration_sec", VIDEO_CONFIG.get("video_duration", 4)) or VIDEO_CONFIG.get("video_duration", 4))
                 for seg in getattr(story_data, "segments", [])[:total_videos]
             ]
+            duration_options = "/".join(str(d) for d in self.plan_format["allowed"])
             successful_duration = 0
             for i, r in enumerate(all_results):
                 if i < len(planned_durations) and r.video_result.status == "success":
                     successful_duration += int(planned_durations[i])
             f.write(f"总时长(理论): {successful_duration}秒\n\n")
 
+            stats = self.text_check_stats
+            if stats["checked"]:
+                latencies = stats["latency_ms"]
+                f.write("🔤 首帧无字检测\n")
+                f.write("-"*40 + "\n")
+                f.write(f"检测张数: {stats['checked']}，疑似含字: {stats['flagged']}，自动重生成: {stats['regenerated']}\n")
+                f.write(f"检测耗时: 平均 {sum(latencies) / len(latencies):.0f}ms/批，最大 {max(latencies):.0f}ms\n")
+                f.write(f"判定阈值: {no_text_threshold()}（误报率需用 evaluate_text_detector 在标注样本上评估）\n\n")
+
             
             f.write("🎨 风格信息\n")
             f.write("-"*40 + "\n")
@@ -705,9 +1292,9 @@ class VideoGenerator:
                     f.write(f"节奏风格: {user_input.rhythm_style}\n")
                 f.write(f"画面比例: {VIDEO_CONFIG['aspect_ratio']}\n")
                 if planned_durations:
-                    f.write(f"每镜时长: 4/5秒混合（duration_sec: {planned_durations}）\n\n")
+                    f.write(f"每镜时长: {duration_options}秒混合（duration_sec: {planned_durations}）\n\n")
                 else:
-                    f.write("每镜时长: 4/5秒混合\n\n")
+                    f.write(f"每镜时长: {duration_options}秒混合\n\n")
 
 
             
@@ -751,6 +1338,16 @@ class VideoGenerator:
             f.write(f"3. 成片: {os.path.join(series_dir, 'final_30s.mp4')}\n")
 
             f.write(f"4. 合成说明: {merge_instructions}\n")
+            if rendition_paths:
+                f.write("5. 多版本输出:\n")
+                for name, path in rendition_paths.items():
+                    f.write(f"   - {name}: {path}\n")
+            if stream_playlist_path:
+                f.write(f"6. 流媒体播放列表: {stream_playlist_path}\n")
+            if review_assets:
+                f.write(f"7. 分镜联系表: {review_assets.get('contact_sheet')}\n")
+                f.write(f"   海报图: {review_assets.get('poster')}\n")
+                f.write(f"   缩略图条: {review_assets.get('thumbnail_strip')}\n")
             f.write("\n说明: 如需后期加字幕/音效，请在剪辑软件中另行添加（注意画面本身仍需无字）。\n")
 
         
@@ -782,8 +1379,18 @@ class VideoGenerator:
             print(f"   • 保存目录: {result.series_dir}")
             if getattr(result, 'final_video_path', ''):
                 print(f"   • 成片文件: {result.final_video_path}")
+                for name, path in (getattr(result, 'rendition_paths', None) or {}).items():
+                    print(f"   • 版本 {name}: {path}")
+                if getattr(result, 'stream_playlist_path', ''):
+                    print(f"   • 流媒体播放列表: {result.stream_playlist_path}")
+            elif getattr(result, 'preview_video_path', ''):
+                print(f"   • 预览片（部分分段）: {result.preview_video_path}")
+            if (getattr(result, 'review_assets', None) or {}).get('contact_sheet'):
+                print(f"   • 分镜联系表: {result.review_assets['contact_sheet']}")
             print(f"   • 合并说明: {result.merge_instructions}")
             print(f"   • 详细报告: {result.detailed_report}")
+            probe_stats = probe_cache_stats()
+            print(f"   • 媒体探测缓存: 命中 {probe_stats['hits']} / 未命中 {probe_stats['misses']}")
 
             print(f"\n💡 重要提示:")
             print(f"   • 画面严格无字（字幕/对白框/拟声词需后期另加）")